@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# Prompt size / LLM latency / field agreement: ranked _compact_text vs the legacy compactor.
+#
+#   python3 benchmarks/compaction.py docs/*.pdf texts/*.txt [--budget 7000] [--llm] [--json out.json]
+#
+# Inputs are PDFs (text taken with the tool's own _pdftotext) or pre-extracted .txt files.
+# Without --llm only prompt sizes are compared; with --llm each document is sent once per
+# compactor to LLM_ENDPOINT and the normalized date/provider/document_type/title are compared.
+import sys, os, json, time, argparse, statistics
+
+REPO_ROOT=os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, REPO_ROOT)
+
+import scanfile_rename as s
+
+FIELDS=("date", "provider", "document_type", "title")
+
+
+def _load_text(path):
+    if path.lower().endswith(".pdf"):
+        text, rc, err=s._pdftotext(path)
+        if rc != 0:
+            raise RuntimeError(err or f"pdftotext rc={rc}")
+        return text
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        return f.read()
+
+
+def _norm_fields(info):
+    info=info or {}
+    return {
+        "date":s._normalize_date(info.get("date")),
+        "provider":str(info.get("provider") or "").strip().lower() or None,
+        "document_type":s._normalize_doc_type(info.get("document_type")),
+        "title":str(info.get("title") or "").strip().lower() or None,
+    }
+
+
+def _ask(prompt_text, lm_timeout):
+    t0=time.monotonic()
+    out, err=s._call_llm([
+        {"role":"system", "content":s._SYSTEM_PROMPT},
+        {"role":"user", "content":s._prompt_from_text(prompt_text)},
+    ], max_tokens=350, timeout=lm_timeout, retries=0)
+    return (s._extract_json_loose(out) if out else None), time.monotonic()-t0, err
+
+
+def main():
+    ap=argparse.ArgumentParser()
+    ap.add_argument("inputs", nargs="+")
+    ap.add_argument("--budget", type=int, default=7000)
+    ap.add_argument("--llm", action="store_true", help="Also call the LLM with both excerpts")
+    ap.add_argument("--lm-timeout", type=int, default=s.LLM_TIMEOUT)
+    ap.add_argument("--json", default=None, help="Write per-document results as JSON")
+    args=ap.parse_args()
+    s._PROGRESS_ENABLED=False
+
+    rows=[]
+    for path in args.inputs:
+        try:
+            text=_load_text(path)
+        except Exception as e:
+            print(f"skip {path}: {e}")
+            continue
+        legacy=s._compact_text_legacy(text, args.budget)
+        ranked=s._compact_text_ranked(text, args.budget)
+        row={"input":path, "text_chars":len(text), "legacy_chars":len(legacy), "ranked_chars":len(ranked),
+             "legacy_tokens":s._estimate_tokens(legacy), "ranked_tokens":s._estimate_tokens(ranked)}
+        if args.llm:
+            li, lt, lerr=_ask(legacy, args.lm_timeout)
+            ri, rt, rerr=_ask(ranked, args.lm_timeout)
+            lf, rf=_norm_fields(li), _norm_fields(ri)
+            row.update({"legacy_secs":round(lt, 3), "ranked_secs":round(rt, 3),
+                        "legacy_error":str(lerr)[:200] if lerr else None, "ranked_error":str(rerr)[:200] if rerr else None,
+                        "agree":{k:(lf[k] == rf[k]) for k in FIELDS},
+                        "legacy_unknown":s._unknown_count(li), "ranked_unknown":s._unknown_count(ri)})
+        rows.append(row)
+        extra=f"  {row['legacy_secs']}s -> {row['ranked_secs']}s  agree={sum(row['agree'].values())}/{len(FIELDS)}" if args.llm else ""
+        print(f"{os.path.basename(path)[:50]:50s} {row['legacy_chars']:6d} -> {row['ranked_chars']:6d} chars{extra}")
+
+    if not rows:
+        return 1
+    lc=[r["legacy_chars"] for r in rows]
+    rc=[r["ranked_chars"] for r in rows]
+    print(f"\nprompt chars: median {statistics.median(lc):.0f} -> {statistics.median(rc):.0f}, total {sum(lc)} -> {sum(rc)} ({100.0*sum(rc)/max(1, sum(lc)):.0f}%)")
+    if args.llm:
+        ls=[r["legacy_secs"] for r in rows]
+        rs=[r["ranked_secs"] for r in rows]
+        print(f"LLM latency: median {statistics.median(ls):.2f}s -> {statistics.median(rs):.2f}s")
+        for k in FIELDS:
+            print(f"agreement {k:14s} {sum(r['agree'][k] for r in rows)}/{len(rows)}")
+        print(f"unknown fields: legacy {sum(r['legacy_unknown'] for r in rows)}, ranked {sum(r['ranked_unknown'] for r in rows)}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# Synthetic scan corpus for the benchmarks: small hand-written PDFs, no extra dependencies.
+#
+#   python3 benchmarks/corpus.py OUTDIR [--count 24] [--kinds text,image,multipage,corrupt] [--seed 1]
+#
+# Kinds:
+#   text       1-2 pages with a text layer (statement/invoice/bill-like lines)
+#   multipage  12-30 text pages; the date and total sit on the first and last page
+#   image      1-2 image-only pages (grey "scan" with no text layer -> vision path)
+#   corrupt    a text PDF whose xref offsets and startxref are wrong (Poppler syntax errors)
+#
+# OUTDIR/manifest.json lists each file with its kind, page count and the values planted in it.
+import os, json, zlib, random, argparse
+
+KINDS=("text", "image", "multipage", "corrupt")
+
+_PROVIDERS=("Acme Power & Light", "Riverside Medical Group", "First Harbor Bank", "Northwind Water Utility",
+            "Lakeside Insurance Co", "Summit Credit Union", "Cedar Valley School District", "Metro Gas Services")
+_DOC_TYPES=("Statement", "Invoice", "Bill", "Receipt", "Notice", "Report")
+_MONTHS=("January", "February", "March", "April", "May", "June", "July", "August", "September", "October", "November", "December")
+_FILLER=("Thank you for your business.", "Please retain this copy for your records.", "Questions? Call customer service.",
+         "Online access is available 24 hours a day.", "Payments received after the due date may incur a late fee.",
+         "Visit our website to enroll in paperless billing.", "This is not a bill if your balance is zero.")
+
+def _pdf_str(s):
+    return "(" + s.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ")"
+
+def _text_stream(lines):
+    out=["BT", "/F1 10 Tf", "12 TL", "50 760 Td"]
+    for ln in lines:
+        out.append(f"{_pdf_str(ln)} Tj T*")
+    out.append("ET")
+    return "\n".join(out).encode("latin-1", "replace")
+
+def _gray_image(rng, w=850, h=1100):
+    # Light paper with dark bars where text lines would be.
+    rows=[]
+    for y in range(h):
+        in_line=(y % 24) < 9 and 80 < y < h-80
+        if in_line:
+            start=60+rng.randrange(0, 20)
+            end=w-60-rng.randrange(0, 300)
+            row=bytes([235])*start + bytes([40])*(end-start) + bytes([235])*(w-end)
+        else:
+            row=bytes([235])*w
+        rows.append(row)
+    return zlib.compress(b"".join(rows), 6), w, h
+
+def _build_pdf(pages, corrupt=False):
+    # pages: list of ("text", [lines]) or ("image", (data, w, h)).
+    objs=[None, None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]  # 1 catalog, 2 pages, 3 font
+    kids=[]
+    for kind, payload in pages:
+        if kind == "text":
+            stream=_text_stream(payload)
+            objs.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+            content_id=len(objs)
+            objs.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id)
+        else:
+            data, w, h=payload
+            objs.append(b"<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace /DeviceGray /BitsPerComponent 8 /Filter /FlateDecode /Length %d >>\nstream\n" % (w, h, len(data)) + data + b"\nendstream")
+            img_id=len(objs)
+            stream=b"q 612 0 0 792 0 0 cm /Im1 Do Q"
+            objs.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+            content_id=len(objs)
+            objs.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /XObject << /Im1 %d 0 R >> >> /Contents %d 0 R >>" % (img_id, content_id))
+        kids.append(len(objs))
+    objs[0]=b"<< /Type /Catalog /Pages 2 0 R >>"
+    objs[1]=b"<< /Type /Pages /Kids [" + b" ".join(b"%d 0 R" % k for k in kids) + b"] /Count %d >>" % len(kids)
+
+    out=bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets=[]
+    for i, body in enumerate(objs, start=1):
+        offsets.append(len(out))
+        out+=b"%d 0 obj\n" % i + body + b"\nendobj\n"
+    xref_at=len(out)
+    shift=37 if corrupt else 0
+    out+=b"xref\n0 %d\n0000000000 65535 f \n" % (len(objs)+1)
+    for off in offsets:
+        out+=b"%010d 00000 n \n" % (off+shift)
+    out+=b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objs)+1, xref_at+shift)
+    return bytes(out)
+
+def _doc_fields(rng):
+    provider=rng.choice(_PROVIDERS)
+    doc_type=rng.choice(_DOC_TYPES)
+    y, m, d=rng.randrange(2019, 2026), rng.randrange(1, 13), rng.randrange(1, 29)
+    return {"provider":provider, "document_type":doc_type, "date":f"{y:04d}-{m:02d}-{d:02d}",
+            "date_text":f"{_MONTHS[m-1]} {d}, {y}", "total":f"{rng.randrange(10, 2000)}.{rng.randrange(0, 100):02d}",
+            "account":f"{rng.randrange(10**7, 10**8)}"}
+
+def _page_lines(rng, f, page, n_pages, lines_per_page=52):
+    lines=[]
+    if page == 1:
+        lines+=[f["provider"], "PO Box %d" % rng.randrange(100, 9999), "Springfield, ST %05d" % rng.randrange(10000, 99999), "",
+                f"{f['document_type']}", f"Statement Date: {f['date_text']}", f"Account Number: {f['account']}", ""]
+    while len(lines) < lines_per_page-4:
+        if rng.random() < 0.7:
+            lines.append("%02d/%02d  %-32s %10s" % (rng.randrange(1, 13), rng.randrange(1, 29),
+                         rng.choice(("Service charge", "Usage", "Adjustment", "Payment received", "Transfer", "Fee")),
+                         "%d.%02d" % (rng.randrange(1, 500), rng.randrange(0, 100))))
+        else:
+            lines.append(rng.choice(_FILLER))
+    if page == n_pages:
+        lines+=["", f"Total Amount Due: ${f['total']}", f"Due Date: {f['date_text']}"]
+    lines.append(f"Page {page} of {n_pages}")
+    return lines
+
+def make_document(path, kind, rng):
+    f=_doc_fields(rng)
+    if kind == "image":
+        n=rng.randrange(1, 3)
+        pages=[("image", _gray_image(rng)) for _ in range(n)]
+    else:
+        n=rng.randrange(12, 31) if kind == "multipage" else rng.randrange(1, 3)
+        pages=[("text", _page_lines(rng, f, p, n)) for p in range(1, n+1)]
+    with open(path, "wb") as fh:
+        fh.write(_build_pdf(pages, corrupt=(kind == "corrupt")))
+    return {"file":os.path.basename(path), "kind":kind, "pages":n,
+            "expected":{k:f[k] for k in ("date", "provider", "document_type")} if kind != "image" else None}
+
+def make_corpus(outdir, count=24, kinds=KINDS, seed=1):
+    os.makedirs(outdir, exist_ok=True)
+    rng=random.Random(seed)
+    docs=[]
+    for i in range(count):
+        kind=kinds[i % len(kinds)]
+        docs.append(make_document(os.path.join(outdir, f"scan_{i:04d}_{kind}.pdf"), kind, rng))
+    with open(os.path.join(outdir, "manifest.json"), "w", encoding="utf-8") as fh:
+        json.dump({"seed":seed, "documents":docs}, fh, indent=2)
+    return docs
+
+def main():
+    ap=argparse.ArgumentParser()
+    ap.add_argument("outdir")
+    ap.add_argument("--count", type=int, default=24)
+    ap.add_argument("--kinds", default=",".join(KINDS), help=f"Comma-separated subset of {','.join(KINDS)}")
+    ap.add_argument("--seed", type=int, default=1)
+    args=ap.parse_args()
+    kinds=[k.strip() for k in args.kinds.split(",") if k.strip()]
+    bad=[k for k in kinds if k not in KINDS]
+    if bad or not kinds:
+        ap.error(f"unknown kind(s): {','.join(bad) or '(none)'}")
+    docs=make_corpus(args.outdir, args.count, kinds, args.seed)
+    print(f"wrote {len(docs)} PDFs to {args.outdir}")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
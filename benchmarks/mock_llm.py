@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# Local OpenAI-compatible mock (POST /v1/chat/completions, GET /v1/models) for benchmarks.
+#
+#   python3 benchmarks/mock_llm.py [--port 8765] [--latency-ms 300] [--jitter-ms 100]
+#                                  [--context 8192] [--error-rate 0.05] [--per-image-ms 150]
+#
+# Replies are derived from the prompt (first line of the excerpt, first date, a document-type
+# word), so the tool names files the way it would against a real model. Requests larger than
+# --context get LM Studio's context-overflow error; --error-rate answers that fraction of
+# requests with 503 + Retry-After (or 429 with --error-status 429).
+import sys, json, re, time, random, threading, argparse, typing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_MONTHS=("january", "february", "march", "april", "may", "june", "july", "august", "september", "october", "november", "december")
+_DATE_RX=re.compile(r"\b(" + "|".join(m[:3] for m in _MONTHS) + r")[a-z]*\.? (\d{1,2}), (\d{4})\b", re.I)
+_ISO_RX=re.compile(r"\b(\d{4})-(\d{2})-(\d{2})\b")
+_TYPE_RX=re.compile(r"\b(statement|invoice|bill|receipt|notice|report)\b", re.I)
+_EXCERPT_RX=re.compile(r"Text from a scanned document:\n(.*?)\n\nReturn ONLY", re.S)
+
+
+def _answer(prompt):
+    m=_EXCERPT_RX.search(prompt)
+    excerpt=m.group(1) if m else ""
+    lines=[ln.strip() for ln in excerpt.splitlines() if ln.strip() and not ln.startswith("[page")]
+    date=None
+    d=_DATE_RX.search(excerpt)
+    if d:
+        mon=[x[:3] for x in _MONTHS].index(d.group(1)[:3].lower())+1
+        date=f"{int(d.group(3)):04d}-{mon:02d}-{int(d.group(2)):02d}"
+    else:
+        d=_ISO_RX.search(excerpt)
+        date=d.group(0) if d else None
+    t=_TYPE_RX.search(excerpt)
+    doc_type=t.group(1).title() if t else None
+    provider=lines[0][:60] if lines else None
+    return {"date":date, "date_basis":"document" if date else "unknown", "provider":provider,
+            "document_type":doc_type, "title":f"{provider} {doc_type}" if provider and doc_type else None,
+            "author":provider, "subject":None, "keywords":[w for w in (doc_type, provider) if w],
+            "confidence":0.9 if excerpt else 0.5}
+
+
+class MockLLM:
+    def __init__(self, latency_ms=300, jitter_ms=0, context=0, error_rate=0.0, error_status=503,
+                 per_image_ms=0, tokens_per_image=800, chars_per_token=3.2, model="mock-model", seed=1):
+        self.latency_ms=latency_ms
+        self.jitter_ms=jitter_ms
+        self.context=context
+        self.error_rate=error_rate
+        self.error_status=error_status
+        self.per_image_ms=per_image_ms
+        self.tokens_per_image=tokens_per_image
+        self.chars_per_token=chars_per_token
+        self.model=model
+        self._rng=random.Random(seed)
+        self._lock=threading.Lock()
+        self.stats={"requests":0, "ok":0, "overflow":0, "injected":0, "inflight_max":0}
+        self._inflight=0
+        self._server=None
+        self._thread=None
+
+    @property
+    def url(self):
+        host, port=self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def _tokens(self, messages):
+        chars=0
+        images=0
+        for m in messages:
+            c=m.get("content")
+            if isinstance(c, str):
+                chars+=len(c)
+            elif isinstance(c, list):
+                for part in c:
+                    if part.get("type") == "text":
+                        chars+=len(part.get("text") or "")
+                    elif part.get("type") == "image_url":
+                        images+=1
+        return int(chars/self.chars_per_token)+images*self.tokens_per_image, images
+
+    def _handler(self):
+        mock=self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version="HTTP/1.1"
+
+            def log_message(self, *a):
+                pass
+
+            def _send(self, status, obj, headers=None):
+                body=json.dumps(obj).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path.rstrip("/").endswith("/models"):
+                    entry: typing.Dict[str, typing.Any]={"id":mock.model, "object":"model"}
+                    if mock.context: entry["context_length"]=mock.context
+                    return self._send(200, {"object":"list", "data":[entry]})
+                self._send(404, {"error":"not found"})
+
+            def do_POST(self):
+                n=int(self.headers.get("Content-Length") or 0)
+                raw=self.rfile.read(n) if n else b""
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    return self._send(404, {"error":"not found"})
+                try:
+                    req=json.loads(raw or b"{}")
+                except ValueError:
+                    return self._send(400, {"error":"invalid json"})
+                with mock._lock:
+                    mock.stats["requests"]+=1
+                    mock._inflight+=1
+                    mock.stats["inflight_max"]=max(mock.stats["inflight_max"], mock._inflight)
+                    inject=mock.error_rate > 0 and mock._rng.random() < mock.error_rate
+                    delay=max(0.0, mock.latency_ms+mock._rng.uniform(-mock.jitter_ms, mock.jitter_ms))/1000.0
+                try:
+                    messages=req.get("messages") or []
+                    tokens, images=mock._tokens(messages)
+                    if mock.context and tokens+int(req.get("max_tokens") or 0) > mock.context:
+                        with mock._lock: mock.stats["overflow"]+=1
+                        return self._send(400, {"error":f"Trying to keep the first {tokens} tokens when context the overflows. However, the model is loaded with context length of only {mock.context} tokens, which is not enough."})
+                    if inject:
+                        with mock._lock: mock.stats["injected"]+=1
+                        return self._send(mock.error_status, {"error":"Model is busy (injected)"}, {"Retry-After":"0"})
+                    time.sleep(delay+images*mock.per_image_ms/1000.0)
+                    prompt=""
+                    for m in messages:
+                        c=m.get("content")
+                        if isinstance(c, str): prompt+=c
+                        elif isinstance(c, list): prompt+="".join(p.get("text") or "" for p in c if p.get("type") == "text")
+                    content=json.dumps(_answer(prompt))
+                    with mock._lock: mock.stats["ok"]+=1
+                    self._send(200, {"id":"mock", "object":"chat.completion", "model":mock.model,
+                                     "choices":[{"index":0, "message":{"role":"assistant", "content":content}, "finish_reason":"stop"}],
+                                     "usage":{"prompt_tokens":tokens, "completion_tokens":int(len(content)/mock.chars_per_token), "total_tokens":tokens+int(len(content)/mock.chars_per_token)}})
+                finally:
+                    with mock._lock: mock._inflight-=1
+
+        return Handler
+
+    def start(self, host="127.0.0.1", port=0):
+        self._server=ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads=True
+        self._thread=threading.Thread(target=self._server.serve_forever, name="mock-llm", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server=None
+
+
+def main():
+    ap=argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--latency-ms", type=float, default=300)
+    ap.add_argument("--jitter-ms", type=float, default=0)
+    ap.add_argument("--per-image-ms", type=float, default=0, help="Extra latency per image in vision requests")
+    ap.add_argument("--context", type=int, default=0, help="Context window in tokens (0 = unlimited)")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with --error-status")
+    ap.add_argument("--error-status", type=int, default=503, choices=(429, 500, 503))
+    ap.add_argument("--model", default="mock-model")
+    args=ap.parse_args()
+    mock=MockLLM(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, context=args.context, error_rate=args.error_rate,
+                 error_status=args.error_status, per_image_ms=args.per_image_ms, model=args.model).start(args.host, args.port)
+    print(f"mock LLM on {mock.url} (LLM_ENDPOINT={mock.url} LLM_MODEL={args.model})", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        mock.stop()
+        print(json.dumps(mock.stats), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# Byte-level probe vs pypdf on a large synthetic scan: the decisions the metadata step needs
+# (signed? page count? text layer?) and the metadata write itself, with and without the probe.
+#
+#   python3 benchmarks/probe.py [--mb 200] [--pages 100] [--repeat 3] [--signed]
+#
+# Pages are incompressible grey images, so the file is about --mb large with few objects, like a
+# colour scan. "no probe" runs patch _pdf_probe to report nothing, which is the pre-probe behavior.
+import sys, os, zlib, time, shutil, argparse, tempfile, contextlib
+from unittest.mock import patch
+
+REPO_ROOT=os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def _make_scan(path, mb, pages, signed):
+    import corpus
+    side=int((mb*1024*1024/max(1, pages))**0.5)
+    page_list=[("image", (zlib.compress(os.urandom(side*side), 1), side, side)) for _ in range(pages)]
+    data=corpus._build_pdf(page_list)
+    if signed:
+        # Re-point the catalog at an AcroForm with one signature field, via an incremental update.
+        tail=data[data.rindex(b"startxref"):]
+        prev=int(tail.split()[1])
+        size=int(data[data.rindex(b"/Size"):].split()[1].rstrip(b">"))
+        out=bytearray(data)
+        offs=[]
+        for body in (b"<< /Type /Catalog /Pages 2 0 R /AcroForm << /Fields [%d 0 R] /SigFlags 3 >> >>" % size,
+                     b"<< /FT /Sig /T (S1) /V %d 0 R >>" % (size+1),
+                     b"<< /Type /Sig /Filter /Adobe.PPKLite /ByteRange [0 0 0 0] /Contents <00> >>"):
+            offs.append(len(out))
+            n=1 if len(offs) == 1 else size+len(offs)-2
+            out+=b"%d 0 obj\n%s\nendobj\n" % (n, body)
+        xref=len(out)
+        out+=b"xref\n1 1\n%010d 00000 n \n%d 2\n%010d 00000 n \n%010d 00000 n \n" % (offs[0], size, offs[1], offs[2])
+        out+=b"trailer\n<< /Size %d /Root 1 0 R /Prev %d >>\nstartxref\n%d\n%%%%EOF\n" % (size+2, prev, xref)
+        data=bytes(out)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def _timed(fn, repeat):
+    best=None
+    for _ in range(repeat):
+        t0=time.monotonic()
+        res=fn()
+        dt=time.monotonic()-t0
+        best=dt if best is None else min(best, dt)
+    return best, res
+
+
+def main():
+    ap=argparse.ArgumentParser()
+    ap.add_argument("--mb", type=float, default=200)
+    ap.add_argument("--pages", type=int, default=100)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--signed", action="store_true", help="Add a signature field (exercises the signed-skip decision)")
+    args=ap.parse_args()
+
+    import scanfile_rename as s
+    from pypdf import PdfReader
+    s._PROGRESS_ENABLED=False
+    no_probe=lambda: patch.object(s, "_pdf_probe", lambda _p: s._PdfProbe())
+
+    with tempfile.TemporaryDirectory(prefix="scanfile_probe_") as td:
+        src=os.path.join(td, "scan.pdf")
+        _make_scan(src, args.mb, args.pages, args.signed)
+        print(f"scan: {os.path.getsize(src)/1e6:.1f}MB, {args.pages} pages, signed={args.signed}")
+
+        def probe():
+            s._PROBE_CACHE.clear()
+            p=s._pdf_probe(src)
+            return f"pages={p.pages} signed={p.signed} text_layer={p.text_layer} objects={p.objects}"
+
+        def pypdf_decide():
+            with open(src, "rb") as f:
+                r=PdfReader(f)
+                return f"pages={len(r.pages)} signed={s._pdf_appears_signed(r)}"
+
+        rows=[("probe", *_timed(probe, args.repeat)), ("pypdf reader + signed walk", *_timed(pypdf_decide, args.repeat))]
+        for mode in ("rewrite", "incremental"):
+            for label, ctx in (("no probe", no_probe), ("probe", contextlib.nullcontext)):
+                def write():
+                    dst=os.path.join(td, "out.pdf")
+                    shutil.copyfile(src, dst)
+                    s._PROBE_CACHE.clear()
+                    with ctx():
+                        t0=time.monotonic()
+                        res=s.write_pdf_metadata_in_place(dst, {"/Title":"T", "/Keywords":"a; b"}, mode=mode)
+                        write.secs=time.monotonic()-t0
+                    return res
+                best=None
+                for _ in range(args.repeat):
+                    res=write()
+                    best=write.secs if best is None else min(best, write.secs)
+                rows.append((f"metadata {mode} ({label})", best, res))
+    for name, secs, res in rows:
+        print(f"  {name:34s} {secs*1000:9.1f} ms  {res}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# Throughput benchmark against the local mock LLM and a synthetic corpus, with JSON baselines.
+#
+#   python3 benchmarks/run.py [--docs 24] [--jobs 4] [--latency-ms 200] [--context 8192] [--error-rate 0.05]
+#                             [--text-backend auto|poppler|pypdf] [--save [PATH]] [--compare PATH|COMMIT] [--threshold 0.15]
+#
+# Scenarios (each in a fresh interpreter so peak RSS is per scenario; the mock runs in this process):
+#   extract  extract_information() on every document, one after another
+#   main     main() on the whole corpus with --jobs, --outdir in a temp dir, --no-cache and --lm-retries 5 (injected 503s are retried)
+#
+# Reported per scenario: docs/sec, failures, peak RSS, and p50/p95 seconds per stage (pdftotext,
+# render, llm, metadata; per document for extract, prepare/extract/place for main).
+# --save writes the result to benchmarks/baselines/<commit>.json (or PATH); --compare loads a
+# saved result (a path or a commit) and exits 1 if docs/sec, peak RSS or a stage p95 regressed
+# by more than --threshold.
+import sys, os, json, time, argparse, subprocess, tempfile, resource, threading, contextlib
+
+REPO_ROOT=os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+BENCH_DIR=os.path.dirname(os.path.abspath(__file__))
+BASELINE_DIR=os.path.join(BENCH_DIR, "baselines")
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+SCENARIOS=("extract", "main")
+_MIN_STAGE_SECS=0.005  # stage p95s below this are noise, not regressions
+
+
+def _maxrss_bytes():
+    r=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return r if sys.platform == "darwin" else r*1024
+
+
+def _pct(values, p):
+    if not values: return None
+    v=sorted(values)
+    return round(v[min(len(v)-1, max(0, int(round(p/100.0*len(v)+0.5))-1))], 4)
+
+
+def _git_commit():
+    try:
+        r=subprocess.run(["git", "-C", REPO_ROOT, "rev-parse", "--short", "HEAD"], capture_output=True, text=True)
+        commit=r.stdout.strip() or "unknown"
+        d=subprocess.run(["git", "-C", REPO_ROOT, "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True)
+        return commit+("-dirty" if d.stdout.strip() else "")
+    except Exception:
+        return "unknown"
+
+
+# --- child: run one scenario with timing wrappers around the tool's stage functions
+
+class _Timings:
+    def __init__(self):
+        self.lock=threading.Lock()
+        self.samples={}
+
+    def add(self, name, secs):
+        with self.lock:
+            self.samples.setdefault(name, []).append(secs)
+
+    def wrap(self, name, fn):
+        def timed(*a, **kw):
+            t0=time.monotonic()
+            try:
+                return fn(*a, **kw)
+            finally:
+                self.add(name, time.monotonic()-t0)
+        return timed
+
+    def summary(self):
+        return {k:{"n":len(v), "p50":_pct(v, 50), "p95":_pct(v, 95)} for k, v in sorted(self.samples.items())}
+
+
+def _child(scenario, corpus, jobs):
+    import scanfile_rename as s
+    s._PROGRESS_ENABLED=False
+    rss_import=_maxrss_bytes()
+    tm=_Timings()
+    for attr, name in (("_pdftotext", "pdftotext"), ("_render_pdf_to_images", "render"), ("_call_llm", "llm"),
+                       ("write_pdf_metadata_in_place", "metadata")):
+        setattr(s, attr, tm.wrap(name, getattr(s, attr)))
+    pdfs=sorted(os.path.join(corpus, f) for f in os.listdir(corpus) if f.endswith(".pdf"))
+    failed=0
+    t0=time.monotonic()
+    if scenario == "extract":
+        for p in pdfs:
+            d0=time.monotonic()
+            try:
+                info, _text=s.extract_information(p)
+            except RuntimeError:
+                info=None
+            tm.add("document", time.monotonic()-d0)
+            failed+=0 if info else 1
+    else:
+        s._STAGES=tuple((name, tm.wrap(name, fn)) for name, fn in s._STAGES)
+        results=[]
+        run_batch=s._run_batch
+        def _capture(inputs, args):
+            results.extend(run_batch(inputs, args))
+            return results
+        s._run_batch=_capture
+        with tempfile.TemporaryDirectory(prefix="scanfile_bench_out_") as out:
+            sys.argv=["scanfile_rename.py", *pdfs, "--outdir", out, "--jobs", str(jobs), "--no-cache", "--no-progress", "--lm-retries", "5"]
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                s.main()
+        failed=sum(1 for r in results if r["rc"] != 0)
+    secs=time.monotonic()-t0
+    print(json.dumps({"docs":len(pdfs), "failed":failed, "secs":round(secs, 3),
+                      "docs_per_sec":round(len(pdfs)/secs, 3) if secs > 0 else None,
+                      "peak_rss":_maxrss_bytes(), "rss_after_import":rss_import,
+                      "stages":tm.summary()}))
+
+
+# --- parent: corpus, mock server, scenarios, baselines
+
+def _run_scenario(scenario, corpus, args, endpoint, model):
+    env=dict(os.environ)
+    env.update({"LLM_ENDPOINT":endpoint, "LLM_MODEL":model, "SCANFILE_CACHE":"0", "TEXT_BACKEND":args.text_backend})
+    cmd=[sys.executable, os.path.abspath(__file__), "--child", scenario, "--corpus", corpus, "--jobs", str(args.jobs)]
+    r=subprocess.run(cmd, capture_output=True, text=True, env=env)
+    lines=[ln for ln in r.stdout.splitlines() if ln.startswith("{")]
+    if r.returncode != 0 or not lines:
+        raise RuntimeError(f"{scenario} failed (rc={r.returncode}): {(r.stderr or r.stdout).strip()[-2000:]}")
+    return json.loads(lines[-1])
+
+
+def _baseline_path(ref):
+    if os.path.exists(ref): return ref
+    return os.path.join(BASELINE_DIR, f"{ref}.json")
+
+
+def compare(current, baseline, threshold):
+    # Returns a list of human-readable regressions (empty = none).
+    out=[]
+    for name, cur in current.get("scenarios", {}).items():
+        base=baseline.get("scenarios", {}).get(name)
+        if not base: continue
+        if base.get("docs_per_sec") and cur.get("docs_per_sec") is not None and cur["docs_per_sec"] < base["docs_per_sec"]*(1-threshold):
+            out.append(f"{name}: docs/sec {base['docs_per_sec']} -> {cur['docs_per_sec']}")
+        if base.get("peak_rss") and cur.get("peak_rss", 0) > base["peak_rss"]*(1+threshold):
+            out.append(f"{name}: peak RSS {base['peak_rss']/1e6:.1f}MB -> {cur['peak_rss']/1e6:.1f}MB")
+        if cur.get("failed", 0) > base.get("failed", 0):
+            out.append(f"{name}: failures {base.get('failed', 0)} -> {cur['failed']}")
+        for stage, st in cur.get("stages", {}).items():
+            b=base.get("stages", {}).get(stage)
+            if not b or b.get("p95") is None or st.get("p95") is None: continue
+            if max(b["p95"], st["p95"]) < _MIN_STAGE_SECS: continue
+            if st["p95"] > b["p95"]*(1+threshold):
+                out.append(f"{name}: {stage} p95 {b['p95']:.3f}s -> {st['p95']:.3f}s")
+    return out
+
+
+def _print_result(res):
+    for name, r in res["scenarios"].items():
+        print(f"{name}: {r['docs']} docs in {r['secs']}s = {r['docs_per_sec']} docs/sec, {r['failed']} failed, peak RSS {r['peak_rss']/1e6:.1f}MB")
+        for stage, st in r["stages"].items():
+            print(f"  {stage:10s} n={st['n']:<4d} p50={st['p50']:.3f}s p95={st['p95']:.3f}s")
+    print(f"mock: {json.dumps(res['mock'])}")
+
+
+def main():
+    ap=argparse.ArgumentParser()
+    ap.add_argument("--docs", type=int, default=24)
+    ap.add_argument("--kinds", default="text,image,multipage,corrupt")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--scenarios", default=",".join(SCENARIOS))
+    ap.add_argument("--jobs", type=int, default=4, help="--jobs for the main scenario")
+    ap.add_argument("--latency-ms", type=float, default=200)
+    ap.add_argument("--jitter-ms", type=float, default=50)
+    ap.add_argument("--per-image-ms", type=float, default=100)
+    ap.add_argument("--context", type=int, default=0, help="Mock context window in tokens (0 = unlimited)")
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--text-backend", choices=("auto", "poppler", "pypdf"), default="auto", help="TEXT_BACKEND for the scenarios")
+    ap.add_argument("--save", nargs="?", const="", default=None, help="Save the result as a baseline (default path: benchmarks/baselines/<commit>.json)")
+    ap.add_argument("--compare", default=None, help="Baseline JSON path or commit to compare against")
+    ap.add_argument("--threshold", type=float, default=0.15, help="Relative change counted as a regression (default: 0.15)")
+    ap.add_argument("--json", default=None, help="Also write the result to this path")
+    ap.add_argument("--child", choices=SCENARIOS, default=None, help=argparse.SUPPRESS)
+    ap.add_argument("--corpus", default=None, help=argparse.SUPPRESS)
+    args=ap.parse_args()
+
+    if args.child:
+        _child(args.child, args.corpus, args.jobs)
+        return 0
+
+    import corpus as corpus_mod
+    from mock_llm import MockLLM
+    scenarios=[x.strip() for x in args.scenarios.split(",") if x.strip()]
+    config={k:getattr(args, k) for k in ("docs", "kinds", "seed", "jobs", "latency_ms", "jitter_ms", "per_image_ms", "context", "error_rate", "text_backend")}
+    mock=MockLLM(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, context=args.context, error_rate=args.error_rate,
+                 per_image_ms=args.per_image_ms, seed=args.seed).start()
+    try:
+        with tempfile.TemporaryDirectory(prefix="scanfile_bench_") as td:
+            corpus_mod.make_corpus(td, args.docs, [k.strip() for k in args.kinds.split(",") if k.strip()], args.seed)
+            res={"commit":_git_commit(), "created":time.strftime("%Y-%m-%dT%H:%M:%S"), "python":sys.version.split()[0],
+                 "config":config, "scenarios":{}}
+            for name in scenarios:
+                res["scenarios"][name]=_run_scenario(name, td, args, mock.url, mock.model)
+    finally:
+        mock.stop()
+    res["mock"]=mock.stats
+    _print_result(res)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(res, f, indent=2)
+    if args.save is not None:
+        path=args.save or os.path.join(BASELINE_DIR, f"{res['commit']}.json")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(res, f, indent=2)
+        print(f"baseline saved: {path}")
+    if args.compare:
+        with open(_baseline_path(args.compare), "r", encoding="utf-8") as f:
+            base=json.load(f)
+        if base.get("config") != config:
+            print(f"warning: baseline {base.get('commit')} was run with a different config: {base.get('config')}")
+        regressions=compare(res, base, args.threshold)
+        if regressions:
+            print(f"REGRESSIONS vs {base.get('commit')}:")
+            for r in regressions: print(f"  {r}")
+            return 1
+        print(f"no regressions vs {base.get('commit')} (threshold {args.threshold:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# Template index lookup latency at scale: nearest() against an index of --templates random layouts,
+# for near hits (1-3 bits off a stored fingerprint) and misses, plus the cost of fingerprinting a page.
+#
+#   python3 benchmarks/templates.py [--templates 100000] [--lookups 2000]
+import sys, os, time, random, argparse, tempfile, statistics
+
+REPO_ROOT=os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, REPO_ROOT)
+
+
+def _percentiles(samples):
+    samples=sorted(samples)
+    return statistics.median(samples), samples[int(len(samples)*0.99)]
+
+
+def main():
+    ap=argparse.ArgumentParser()
+    ap.add_argument("--templates", type=int, default=100000)
+    ap.add_argument("--lookups", type=int, default=2000)
+    args=ap.parse_args()
+
+    import scanfile_rename as s
+    rng=random.Random(7)
+    with tempfile.TemporaryDirectory(prefix="scanfile_templates_") as td:
+        db=s._TemplateIndex(os.path.join(td, "templates.sqlite3"))
+        hashes=[rng.getrandbits(64) for _ in range(args.templates)]
+        t0=time.monotonic()
+        with db._lock:
+            db._db.execute("BEGIN")
+            db._db.executemany("INSERT INTO templates(simhash, b0, b1, b2, b3, provider, document_type, title, seen, updated) VALUES(?,?,?,?,?,?,?,?,2,0)",
+                               ((s._signed64(h), *s._hash_bands(h), f"Provider {i}", "Bill", "Bill {month} {year}") for i, h in enumerate(hashes)))
+            db._db.execute("COMMIT")
+        print(f"index: {args.templates} templates, built in {time.monotonic()-t0:.1f}s, {os.path.getsize(db.path)/1e6:.1f}MB")
+
+        rows=[]
+        for label, probe in (("near hit", lambda: rng.choice(hashes) ^ (1 << rng.randrange(64)) ^ (1 << rng.randrange(64))),
+                             ("miss", lambda: rng.getrandbits(64))):
+            times=[]
+            found=0
+            for _ in range(args.lookups):
+                h=probe()
+                t=time.perf_counter()
+                found+=db.nearest(h) is not None
+                times.append(time.perf_counter()-t)
+            rows.append((f"nearest ({label})", *_percentiles(times), f"found {found}/{args.lookups}"))
+        db.close()
+
+    page="\n".join(f"Line {i} of the statement header, account {rng.randrange(10**8)} for March {i}, 2024" for i in range(40))
+    times=[]
+    for _ in range(200):
+        t=time.perf_counter()
+        s._template_fingerprint(page)
+        times.append(time.perf_counter()-t)
+    rows.append(("fingerprint (40-line page)", *_percentiles(times), ""))
+    for name, p50, p99, note in rows:
+        print(f"  {name:28s} p50 {p50*1000:7.3f} ms  p99 {p99*1000:7.3f} ms  {note}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
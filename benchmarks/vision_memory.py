@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# Peak RSS of building one vision request (render pages + base64 + request body), before/after.
+#
+#   python3 benchmarks/vision_memory.py scan.pdf [--pages 3] [--dpi 200]
+#
+# Each mode runs in a fresh interpreter so ru_maxrss is per mode. "legacy" reproduces the
+# pre-0.4 pipeline (temp JPEG files, base64 str, json.dumps of the whole payload); "stream"
+# uses the in-memory renderer and the lazily serialized _JsonBody that _call_llm sends.
+import sys, os, json, re, base64, tempfile, subprocess, argparse, time, resource
+
+REPO_ROOT=os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, REPO_ROOT)
+
+
+def _maxrss_bytes():
+    r=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return r if sys.platform == "darwin" else r*1024
+
+
+def _legacy_body(s, pdf, pages, dpi):
+    with tempfile.TemporaryDirectory(prefix="scan_vlm_") as td:
+        prefix=os.path.join(td, "page")
+        r=subprocess.run([s.PDFTOPPM, "-f", "1", "-l", str(pages), "-r", str(dpi), "-jpeg", pdf, prefix], capture_output=True, text=True)
+        if r.returncode != 0:
+            raise RuntimeError(r.stderr)
+        imgs=sorted([os.path.join(td, f) for f in os.listdir(td) if f.startswith("page-") and f.endswith(".jpg")],
+                    key=lambda p: int(re.search(r"-(\d+)\.jpg$", p).group(1)))
+        urls=["data:image/jpeg;base64,"+base64.b64encode(open(p, "rb").read()).decode("utf-8") for p in imgs]
+    payload={"model":s.LLM_MODEL, "messages":[{"role":"user", "content":[{"type":"image_url", "image_url":{"url":u}} for u in urls]}]}
+    return len(json.dumps(payload).encode("utf-8"))
+
+
+def _stream_body(s, pdf, pages, dpi):
+    urls=s._render_pdf_to_images(pdf, max_pages=pages, dpi=dpi)
+    payload={"model":s.LLM_MODEL, "messages":[{"role":"user", "content":[{"type":"image_url", "image_url":{"url":u}} for u in urls]}]}
+    body=s._JsonBody(payload)
+    n=0
+    while True:
+        b=body.read(1<<16)
+        if not b: break
+        n+=len(b)
+    return n
+
+
+def _child(mode, pdf, pages, dpi):
+    import scanfile_rename as s
+    s._PROGRESS_ENABLED=False
+    base=_maxrss_bytes()
+    t0=time.monotonic()
+    n=(_legacy_body if mode == "legacy" else _stream_body)(s, pdf, pages, dpi)
+    print(json.dumps({"mode":mode, "body_bytes":n, "secs":round(time.monotonic()-t0, 3),
+                      "peak_rss":_maxrss_bytes(), "peak_rss_delta":_maxrss_bytes()-base}))
+
+
+def main():
+    ap=argparse.ArgumentParser()
+    ap.add_argument("pdf")
+    ap.add_argument("--pages", type=int, default=3)
+    ap.add_argument("--dpi", type=int, default=200)
+    ap.add_argument("--child", choices=["legacy", "stream"], default=None, help=argparse.SUPPRESS)
+    args=ap.parse_args()
+    if args.child:
+        _child(args.child, args.pdf, args.pages, args.dpi)
+        return 0
+    for mode in ("legacy", "stream"):
+        r=subprocess.run([sys.executable, __file__, args.pdf, "--pages", str(args.pages), "--dpi", str(args.dpi), "--child", mode],
+                         capture_output=True, text=True)
+        if r.returncode != 0:
+            print(f"{mode}: failed: {r.stderr.strip()[:300]}")
+            return 1
+        d=json.loads(r.stdout)
+        print(f"{mode:7s} body={d['body_bytes']/1e6:.1f}MB peak_rss={d['peak_rss']/1e6:.1f}MB (+{d['peak_rss_delta']/1e6:.1f}MB) in {d['secs']}s")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,4 +1,9 @@
-import sys, subprocess, os, json, re, base64, tempfile, shutil, argparse, time, typing
+import sys, subprocess, os, io, json, re, tempfile, shutil, argparse, time, typing, glob, threading, contextlib, hashlib, codecs, binascii, queue, random, itertools, signal, select, struct, ctypes, ctypes.util, mmap, bisect, zlib
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl=None
 from datetime import datetime
 
 __version__="0.3.0"
@@ -43,10 +48,55 @@ GS=os.getenv("GS","/opt/homebrew/bin/gs")
 
 VISION_MAX_PAGES=int(os.getenv("VISION_MAX_PAGES","3"))
 VISION_DPI=int(os.getenv("VISION_DPI","200"))
+# Vision page encoding: "budget" picks gray vs colour, trims margins and caps edge/bytes; "plain" is pdftoppm's default JPEG.
+VISION_ENCODE=os.getenv("VISION_ENCODE","budget").strip().lower()
+VISION_MAX_EDGE=int(os.getenv("VISION_MAX_EDGE","1600"))               # px, 0 = no limit
+VISION_REQUEST_BYTES=int(os.getenv("VISION_REQUEST_BYTES","1200000"))  # base64 bytes per request, split over VISION_MAX_PAGES
+VISION_JPEG_QUALITY=int(os.getenv("VISION_JPEG_QUALITY","75"))
+VISION_MIN_DPI=int(os.getenv("VISION_MIN_DPI","72"))
+VISION_DPI_LEARN=os.getenv("VISION_DPI_LEARN","0").strip().lower() in ("1","true","yes","y","on")  # opt-in: one extra vision request per document until the DPI converges
 MIN_TEXT_CHARS=int(os.getenv("MIN_TEXT_CHARS","200"))
+RENDER_WORKERS=_env_int_first(("RENDER_WORKERS",), os.cpu_count() or 2)
+LLM_POOL_SIZE=_env_int_first(("LLM_POOL_SIZE",), 8)
+PLACE_WORKERS=_env_int_first(("PLACE_WORKERS",), 2)
+LLM_CONCURRENCY=_env_int_first(("LLM_CONCURRENCY",), 0)  # 0 = same as --jobs
+# Backoff for overloaded (429/503) or failing endpoints; LLM_BACKOFF_MAX_WAIT bounds total sleep per request.
+LLM_BACKOFF_BASE=float(os.getenv("LLM_BACKOFF_BASE","1"))
+LLM_BACKOFF_CAP=float(os.getenv("LLM_BACKOFF_CAP","30"))
+LLM_BACKOFF_MAX_WAIT=float(os.getenv("LLM_BACKOFF_MAX_WAIT","120"))
+LLM_BREAKER_COOLDOWN=float(os.getenv("LLM_BREAKER_COOLDOWN","5"))
+LLM_BREAKER_MAX_COOLDOWN=float(os.getenv("LLM_BREAKER_MAX_COOLDOWN","60"))
+# Token budgeting: 0 = learn the context window per model; LLM_TOKENIZER plugs in a local tokenizer.
+LLM_CONTEXT_WINDOW=_env_int_first(("LLM_CONTEXT_WINDOW",), 0)
+LLM_CONTEXT_PROBE=os.getenv("LLM_CONTEXT_PROBE","1").strip().lower() in ("1","true","yes","y","on")
+LLM_CHARS_PER_TOKEN=float(os.getenv("LLM_CHARS_PER_TOKEN","3.2"))
+LLM_TOKENIZER=os.getenv("LLM_TOKENIZER","")
+# Text extraction is page-bounded: start with the first TEXT_FIRST_PAGES pages (0 = whole document),
+# widen only while the text is too short or has no keyword hits, and cap what is kept at TEXT_MAX_CHARS.
+TEXT_FIRST_PAGES=int(os.getenv("TEXT_FIRST_PAGES","4"))
+TEXT_INCLUDE_LAST_PAGE=os.getenv("TEXT_INCLUDE_LAST_PAGE","1").strip().lower() in ("1","true","yes","y","on")
+TEXT_MAX_CHARS=int(os.getenv("TEXT_MAX_CHARS","200000"))
+# Text extraction backend: "poppler" (pdftotext subprocess), "pypdf" (in-process) or "auto" (pypdf for
+# clean, unencrypted text PDFs per the byte probe or when pdftotext is missing; Poppler otherwise and
+# whenever pypdf's output looks poor).
+TEXT_BACKENDS=("auto", "poppler", "pypdf")
+TEXT_BACKEND=os.getenv("TEXT_BACKEND","auto").strip().lower()
+# Mixed documents: pages with fewer extracted chars than this are sent as images next to the text of the others.
+PAGE_ROUTING=os.getenv("PAGE_ROUTING","1").strip().lower() in ("1","true","yes","y","on")
+PAGE_TEXT_MIN_CHARS=int(os.getenv("PAGE_TEXT_MIN_CHARS","40"))
+if TEXT_BACKEND not in TEXT_BACKENDS: TEXT_BACKEND="auto"
+
+CACHE_ENABLED=_env_first(("SCANFILE_CACHE",), "1").strip().lower() not in ("0","false","no","n","off")
+CACHE_DIR=_env_first(("SCANFILE_CACHE_DIR",), os.path.join(os.getenv("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"), "scanfile_rename"))
+CACHE_MAX_MB=_env_int_first(("SCANFILE_CACHE_MAX_MB",), 64)
+# Bump when the shape of cached extraction results changes.
+_CACHE_VERSION=1
 
 _PROGRESS_ENABLED=True
 _PROGRESS_FORCE=os.getenv("FORCE_PROGRESS","0").strip().lower() in ("1","true","yes","y","on")
+# Per-thread progress state: batch workers set a filename prefix, and callers can mute a single worker.
+_TLS=threading.local()
+_OUTPUT_LOCK=threading.Lock()
 
 def _fmt_secs(s):
     try:
@@ -62,8 +112,161 @@ def _fmt_secs(s):
 
 def _progress(msg):
     if not _PROGRESS_ENABLED: return
-    sys.stdout.write(str(msg).rstrip()+"\n")
-    sys.stdout.flush()
+    if getattr(_TLS, "quiet", False): return
+    prefix=getattr(_TLS, "prefix", "") or ""
+    with _OUTPUT_LOCK:
+        sys.stdout.write(prefix+str(msg).rstrip()+"\n")
+        sys.stdout.flush()
+
+@contextlib.contextmanager
+def _quiet_progress():
+    prev=getattr(_TLS, "quiet", False)
+    _TLS.quiet=True
+    try:
+        yield
+    finally:
+        _TLS.quiet=prev
+
+def _emit(*parts):
+    with _OUTPUT_LOCK:
+        print(*parts)
+        sys.stdout.flush()
+
+# --- Tracing: one span per unit of work (name, duration, bytes, attributes), written as JSON
+# lines (--trace) and aggregated into a Prometheus textfile-collector file (--metrics-file).
+# Spans nest per thread (parent id) and carry the document being processed.
+TRACE_FILE=os.getenv("SCANFILE_TRACE","")
+METRICS_FILE=os.getenv("SCANFILE_METRICS","")
+_TRACE_LOCK=threading.Lock()
+_TRACE_FH=None
+_METRICS=None
+_SPAN_IDS=itertools.count(1)
+_SPAN_BUCKETS=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+def _tracing_start(trace_file=None, metrics_file=None):
+    global _TRACE_FH, _METRICS
+    _TRACE_FH=None
+    if trace_file:
+        _TRACE_FH=sys.stderr if trace_file == "-" else open(trace_file, "a", encoding="utf-8")
+    _METRICS={"spans":{}, "documents":{}, "t0":time.time()} if metrics_file else None
+
+def _tracing_finish(metrics_file=None):
+    global _TRACE_FH, _METRICS
+    with _TRACE_LOCK:
+        if _TRACE_FH is not None and _TRACE_FH is not sys.stderr:
+            _TRACE_FH.close()
+        _TRACE_FH=None
+    if metrics_file and _METRICS is not None:
+        _write_metrics(metrics_file)
+    _METRICS=None
+
+def _record_span(rec):
+    with _TRACE_LOCK:
+        if _TRACE_FH is not None:
+            _TRACE_FH.write(json.dumps(rec, ensure_ascii=False, default=str)+"\n")
+            _TRACE_FH.flush()
+        if _METRICS is not None:
+            m=_METRICS["spans"].setdefault(rec["span"], {"count":0, "secs":0.0, "bytes":0, "buckets":[0]*len(_SPAN_BUCKETS), "outcomes":{}})
+            m["count"]+=1
+            m["secs"]+=rec["secs"]
+            m["bytes"]+=int(rec.get("bytes") or 0)
+            for i, le in enumerate(_SPAN_BUCKETS):
+                if rec["secs"] <= le: m["buckets"][i]+=1
+            outcome=str(rec.get("outcome") or rec["status"])
+            m["outcomes"][outcome]=m["outcomes"].get(outcome, 0)+1
+
+@contextlib.contextmanager
+def _span(name, **attrs):
+    # Yields the attribute dict; set "bytes", "outcome" or anything else on it before the block ends.
+    if _TRACE_FH is None and _METRICS is None:
+        yield attrs
+        return
+    parent=getattr(_TLS, "span", None)
+    sid=next(_SPAN_IDS)
+    _TLS.span=sid
+    ts=time.time()
+    t0=time.monotonic()
+    status="ok"
+    try:
+        yield attrs
+    except BaseException as e:
+        status="error"
+        attrs.setdefault("error", f"{type(e).__name__}: {e}"[:200])
+        raise
+    finally:
+        _TLS.span=parent
+        _record_span({"ts":round(ts, 3), "span":name, "id":sid, "parent":parent, "doc":getattr(_TLS, "doc", None),
+                      "secs":round(time.monotonic()-t0, 4), "status":status, **attrs})
+
+def _prom_label(v):
+    return str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _write_metrics(path):
+    with _TRACE_LOCK:
+        spans: typing.Dict[str, typing.Dict[str, typing.Any]]={}
+        for k, v in _METRICS["spans"].items():
+            spans[k]={**v, "outcomes":dict(v["outcomes"]), "buckets":list(v["buckets"])}
+        docs=dict(_METRICS["documents"])
+        t0=_METRICS["t0"]
+    lines=["# HELP scanfile_span_seconds Time spent per span.", "# TYPE scanfile_span_seconds histogram"]
+    for name, m in sorted(spans.items()):
+        lab=_prom_label(name)
+        for le, n in zip(_SPAN_BUCKETS, m["buckets"]):
+            lines.append(f'scanfile_span_seconds_bucket{{span="{lab}",le="{le}"}} {n}')
+        lines.append(f'scanfile_span_seconds_bucket{{span="{lab}",le="+Inf"}} {m["count"]}')
+        lines.append(f'scanfile_span_seconds_sum{{span="{lab}"}} {m["secs"]:.6f}')
+        lines.append(f'scanfile_span_seconds_count{{span="{lab}"}} {m["count"]}')
+    lines+=["# HELP scanfile_span_bytes_total Bytes handled per span (text read, images, request bodies, files).", "# TYPE scanfile_span_bytes_total counter"]
+    for name, m in sorted(spans.items()):
+        lines.append(f'scanfile_span_bytes_total{{span="{_prom_label(name)}"}} {m["bytes"]}')
+    lines+=["# HELP scanfile_span_outcomes_total Spans by outcome.", "# TYPE scanfile_span_outcomes_total counter"]
+    for name, m in sorted(spans.items()):
+        for outcome, n in sorted(m["outcomes"].items()):
+            lines.append(f'scanfile_span_outcomes_total{{span="{_prom_label(name)}",outcome="{_prom_label(outcome)}"}} {n}')
+    lines+=["# HELP scanfile_documents_total Documents processed in the last run.", "# TYPE scanfile_documents_total counter"]
+    for result, n in sorted(docs.items()):
+        lines.append(f'scanfile_documents_total{{result="{_prom_label(result)}"}} {n}')
+    lines+=["# HELP scanfile_run_seconds Wall time of the last run.", "# TYPE scanfile_run_seconds gauge",
+            f"scanfile_run_seconds {time.time()-t0:.3f}",
+            "# HELP scanfile_last_run_timestamp_seconds End of the last run (unix time).", "# TYPE scanfile_last_run_timestamp_seconds gauge",
+            f"scanfile_last_run_timestamp_seconds {time.time():.0f}"]
+    # Write-then-rename so the node_exporter textfile collector never reads a partial file.
+    d=os.path.dirname(os.path.abspath(path))
+    os.makedirs(d, exist_ok=True)
+    fd, tmp=tempfile.mkstemp(prefix=".scanfile_metrics_", suffix=".tmp", dir=d)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines)+"\n")
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except Exception:
+        try: os.unlink(tmp)
+        except OSError: pass
+        raise
+
+def _job_secs(job):
+    # A batch job's own time, from its first stage to its final rc (not from when the batch queued it).
+    return (job.get("t_end") or time.monotonic())-(job.get("t_start") or job["t0"])
+
+def _trace_document(job):
+    # Closing record for a batch job: from its first stage to its final rc.
+    if _TRACE_FH is None and _METRICS is None: return
+    rc=job["rc"] if job["rc"] is not None else 1
+    rec={"ts":round(job.get("ts_start") or time.time(), 3), "span":"document", "id":next(_SPAN_IDS), "parent":None,
+         "doc":job["input"], "secs":round(_job_secs(job), 4), "status":"ok" if rc == 0 else "error",
+         "rc":rc, "bytes":_file_size(job["input"]) or _file_size(job.get("dst"))}
+    if job.get("detail"): rec["detail"]=str(job["detail"])[:200]
+    _record_span(rec)
+    if _METRICS is not None:
+        with _TRACE_LOCK:
+            k="ok" if rc == 0 else "failed"
+            _METRICS["documents"][k]=_METRICS["documents"].get(k, 0)+1
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path) if path else 0
+    except OSError:
+        return 0
 
 def _run(cmd): return subprocess.run(cmd, capture_output=True, text=True)
 
@@ -87,25 +290,29 @@ def _looks_like_pdf_syntax_error(msg):
     )
 
 def _repair_pdf_to(pdf_input, pdf_output):
-    qpdf=_tool_exists(QPDF) or _tool_exists("qpdf")
-    if qpdf:
-        _progress(f"  trying qpdf repair: {qpdf}")
-        r=_run([qpdf, "--repair", pdf_input, pdf_output])
-        if r.returncode == 0 and os.path.exists(pdf_output):
-            return True, None
-        err=_tool_err(r)
-        _progress(f"  qpdf repair failed (rc={r.returncode}): {err[:200]}")
-
-    gs=_tool_exists(GS) or _tool_exists("gs")
-    if gs:
-        _progress(f"  trying ghostscript rewrite: {gs}")
-        r=_run([gs, "-o", pdf_output, "-sDEVICE=pdfwrite", "-dNOPAUSE", "-dBATCH", "-dSAFER", pdf_input])
-        if r.returncode == 0 and os.path.exists(pdf_output):
-            return True, None
-        err=_tool_err(r)
-        _progress(f"  ghostscript rewrite failed (rc={r.returncode}): {err[:200]}")
-
-    return False, "No repair tool succeeded (qpdf/gs not available or failed)"
+    with _span("repair", bytes=_file_size(pdf_input)) as sp:
+        qpdf=_tool_exists(QPDF) or _tool_exists("qpdf")
+        if qpdf:
+            _progress(f"  trying qpdf repair: {qpdf}")
+            r=_run([qpdf, "--repair", pdf_input, pdf_output])
+            if r.returncode == 0 and os.path.exists(pdf_output):
+                sp.update(tool="qpdf", outcome="ok")
+                return True, None
+            err=_tool_err(r)
+            _progress(f"  qpdf repair failed (rc={r.returncode}): {err[:200]}")
+
+        gs=_tool_exists(GS) or _tool_exists("gs")
+        if gs:
+            _progress(f"  trying ghostscript rewrite: {gs}")
+            r=_run([gs, "-o", pdf_output, "-sDEVICE=pdfwrite", "-dNOPAUSE", "-dBATCH", "-dSAFER", pdf_input])
+            if r.returncode == 0 and os.path.exists(pdf_output):
+                sp.update(tool="gs", outcome="ok")
+                return True, None
+            err=_tool_err(r)
+            _progress(f"  ghostscript rewrite failed (rc={r.returncode}): {err[:200]}")
+
+        sp["outcome"]="failed"
+        return False, "No repair tool succeeded (qpdf/gs not available or failed)"
 
 def _extract_json_loose(s):
     s=(s or "").strip()
@@ -117,38 +324,683 @@ def _extract_json_loose(s):
         except: return None
     return None
 
-def _img_to_data_url(path):
-    b=base64.b64encode(open(path,"rb").read()).decode("utf-8")
-    return f"data:image/jpeg;base64,{b}"
+# --- Byte-level PDF probe: follows startxref through the xref sections (classic tables and xref
+# streams) of the mmap'd file and reads only object dictionaries (object streams are inflated),
+# never page content or image data, so cost scales with the object count, not the file size.
+# Stages share results through _pdf_probe()'s cache; a field is None when the probe can't tell,
+# and callers then fall back to pypdf / pdftotext.
+_PROBE_DICT_CAP=1<<16
+_PROBE_CACHE={}
+_PROBE_LOCK=threading.Lock()
+
+class _PdfProbe:
+    __slots__=("size", "ok", "pages", "encrypted", "signed", "certified", "text_layer", "objects", "revisions", "trailer", "info", "page_images",
+               "page_chars")
+
+    def __init__(self, size=0):
+        self.size=size
+        self.ok=False
+        self.pages: typing.Optional[int]=None
+        # True/False when the probe could decide, None when inconclusive.
+        self.encrypted: typing.Optional[bool]=None
+        self.signed: typing.Optional[bool]=None
+        self.certified: typing.Optional[bool]=None
+        self.text_layer: typing.Optional[bool]=None
+        self.objects=0
+        self.revisions=0
+        self.trailer: typing.Optional[bytes]=None  # raw bytes of the newest trailer / Info dictionaries
+        self.info: typing.Optional[bytes]=None
+        self.page_images: typing.Optional[typing.FrozenSet[int]]=None  # pages whose resources hold an image XObject
+        self.page_chars: typing.Optional[typing.Dict[int, int]]=None  # {page: chars} from the last text extraction of this file (_text_pages)
+
+_RX_REF=rb"\s+(\d+)\s+(\d+)\s+R"
+_RX_OBJSTM=re.compile(rb"/Type\s*/ObjStm\b")
+_RX_SIG=re.compile(rb"/ByteRange\b|/FT\s*/Sig\b|/Type\s*/Sig\b")
+_RX_PAGEISH=re.compile(rb"/Type\s*/Pages?\b|/Subtype\s*/Form\b")
+_RX_XOBJECTS=re.compile(rb"/XObject\s*(?:<<(.*?)>>|(\d+)\s+\d+\s+R)", re.S)
+_RX_IMAGE=re.compile(rb"/Subtype\s*/Image\b")
+
+def _probe_int(rx, data):
+    m=re.search(rx, data)
+    return int(m.group(1)) if m else None
+
+def _probe_png_unpredict(data, columns):
+    # PNG row predictors as used by xref streams (/Predictor >= 10); only None/Sub/Up occur in practice.
+    out=bytearray()
+    prev=bytearray(columns)
+    row_len=columns+1
+    for i in range(0, len(data)-row_len+1, row_len):
+        ft=data[i]
+        row=bytearray(data[i+1:i+row_len])
+        if ft == 1:
+            for j in range(1, columns): row[j]=(row[j]+row[j-1]) & 0xFF
+        elif ft == 2:
+            for j in range(columns): row[j]=(row[j]+prev[j]) & 0xFF
+        elif ft != 0:
+            raise ValueError(f"PNG predictor {ft}")
+        out+=row
+        prev=row
+    return bytes(out)
+
+def _probe_stream_data(mm, head, start, end):
+    # Inflates the stream following a dictionary head (FlateDecode or unfiltered only).
+    filt=re.search(rb"/Filter\s*\[?\s*/(\w+)", head)
+    m=re.compile(rb"stream\r?\n").search(mm, start, min(end, start+len(head)+16))
+    if not m:
+        raise ValueError("no stream keyword")
+    raw=mm[m.end():end]
+    if filt is None:
+        n=_probe_int(rb"/Length\s+(\d+)(?!\s+\d+\s+R)", head)
+        return raw[:n] if n is not None else raw
+    if filt.group(1) != b"FlateDecode":
+        raise ValueError(f"filter {filt.group(1)!r}")
+    data=zlib.decompressobj().decompress(raw, 1<<24)
+    pred=_probe_int(rb"/Predictor\s+(\d+)", head) or 1
+    if pred >= 10:
+        data=_probe_png_unpredict(data, _probe_int(rb"/Columns\s+(\d+)", head) or 1)
+    elif pred != 1:
+        raise ValueError(f"predictor {pred}")
+    return data
+
+def _probe_head(mm, off, end):
+    # The dictionary part of the object at off: up to its stream data or endobj, capped.
+    stop=min(end, off+_PROBE_DICT_CAP)
+    s=mm.find(b"stream", off, stop)
+    e=mm.find(b"endobj", off, stop)
+    cut=min(x for x in (s, e, stop) if x != -1)
+    return mm[off:cut], cut < stop or stop == end
+
+def _probe_xref(mm, off, entries, trailers):
+    # Reads one xref section (table or stream); returns the /Prev offset or None.
+    if mm[off:off+4] == b"xref":
+        t=mm.find(b"trailer", off)
+        if t == -1: raise ValueError("no trailer")
+        toks=mm[off+4:t].split()
+        i=0
+        while i+1 < len(toks):
+            start, count=int(toks[i]), int(toks[i+1])
+            i+=2
+            for n in range(start, start+count):
+                o, _gen, kind=toks[i:i+3]
+                i+=3
+                entries.setdefault(n, (1, int(o)) if kind == b"n" else (0, 0))
+        head, _=_probe_head(mm, t, len(mm))
+        trailers.append(head)
+        stm=_probe_int(rb"/XRefStm\s+(\d+)", head)
+        if stm is not None:
+            _probe_xref(mm, stm, entries, [])
+        return _probe_int(rb"/Prev\s+(\d+)", head)
+    m=re.compile(rb"\d+\s+\d+\s+obj").match(mm, off)
+    if not m: raise ValueError("startxref points at neither xref nor an object")
+    head, _=_probe_head(mm, off, len(mm))
+    if not re.search(rb"/Type\s*/XRef\b", head): raise ValueError("not an xref stream")
+    trailers.append(head)
+    w=[int(x) for x in re.search(rb"/W\s*\[([\d\s]+)\]", head).group(1).split()]
+    size=_probe_int(rb"/Size\s+(\d+)", head)
+    idx=re.search(rb"/Index\s*\[([\d\s]+)\]", head)
+    idx=[int(x) for x in idx.group(1).split()] if idx else [0, size]
+    data=_probe_stream_data(mm, head, off, len(mm))
+    starts=[0, w[0], w[0]+w[1]]
+    pos=0
+    for k in range(0, len(idx), 2):
+        for n in range(idx[k], idx[k]+idx[k+1]):
+            f=[int.from_bytes(data[pos+starts[j]:pos+starts[j]+w[j]], "big") for j in range(3)]
+            kind=f[0] if w[0] else 1
+            pos+=sum(w)
+            entries.setdefault(n, (kind, f[1], f[2]) if kind == 2 else (kind, f[1]))
+    return _probe_int(rb"/Prev\s+(\d+)", head)
+
+def _probe_resources(heads, head):
+    # The resource dictionary of a page, page tree node or form: its own object, or head itself when inline; None when absent.
+    r=re.search(rb"/Resources"+_RX_REF, head)
+    if r: return heads.get(int(r.group(1))) or b""
+    return head if b"/Resources" in head else None
+
+def _probe_has_image(heads, res, depth=0):
+    # True when res names an image XObject, directly or in a form XObject (two levels deep).
+    for m in _RX_XOBJECTS.finditer(res or b""):
+        names=m.group(1) if m.group(1) is not None else heads.get(int(m.group(2))) or b""
+        for r in re.finditer(rb"(\d+)\s+\d+\s+R", names):
+            h=heads.get(int(r.group(1))) or b""
+            if _RX_IMAGE.search(h): return True
+            if depth < 2 and b"/Form" in h and _probe_has_image(heads, _probe_resources(heads, h), depth+1): return True
+    return False
+
+def _probe_page_images(heads, pages):
+    # Numbers (1-based, in page tree order) of the pages with an image XObject; None when the tree can't be walked.
+    # Inline images in content streams are not seen.
+    out=set()
+    n=0
+    stack: typing.List[typing.Tuple[bytes, typing.Optional[bytes], int]]=[(pages, None, 0)]  # (node, inherited resources, depth)
+    while stack:
+        head, inherited, depth=stack.pop()
+        res=_probe_resources(heads, head)
+        if res is None: res=inherited
+        kids=re.search(rb"/Kids\s*\[([^\]]*)\]", head)
+        if kids is None:
+            n+=1
+            if _probe_has_image(heads, res): out.add(n)
+            continue
+        if depth > 32: return None
+        children=[heads.get(int(r.group(1))) for r in re.finditer(rb"(\d+)\s+\d+\s+R", kids.group(1))]
+        if any(c is None for c in children): return None
+        stack.extend((c, res, depth+1) for c in reversed(children))
+    return frozenset(out)
+
+def _probe_scan(mm, size):
+    p=_PdfProbe(size)
+    tail=mm[max(0, size-2048):]
+    m=list(re.finditer(rb"startxref\s+(\d+)", tail))
+    if not m: return p
+    entries={}
+    trailers=[]
+    off=int(m[-1].group(1))
+    seen=set()
+    while off is not None and off not in seen and len(seen) < 64:
+        seen.add(off)
+        off=_probe_xref(mm, off, entries, trailers)
+    p.revisions=len(trailers)
+    trailer=trailers[0]
+    p.encrypted=bool(re.search(rb"/Encrypt\b", trailer))
+
+    offsets=sorted(e[1] for e in entries.values() if e[0] == 1)+[size]
+    heads={}
+    complete=True
+    streams={}
+    for n, e in entries.items():
+        if e[0] == 1 and 0 < e[1] < size:
+            end=offsets[bisect.bisect_right(offsets, e[1])]
+            head, full=_probe_head(mm, e[1], end)
+            toks=head[:48].split(None, 3)
+            complete&=full and len(toks) >= 3 and toks[0] == b"%d" % n and toks[2].startswith(b"obj")
+            heads[n]=head
+            if b"/ObjStm" in head and _RX_OBJSTM.search(head):
+                streams[n]=(e[1], end)
+    compressed=[(n, e[1]) for n, e in entries.items() if e[0] == 2]
+    if compressed:
+        if p.encrypted:
+            complete=False
+        else:
+            for stm in set(s for _n, s in compressed):
+                try:
+                    start, end=streams[stm]
+                    data=_probe_stream_data(mm, heads[stm], start, end)
+                    first=_probe_int(rb"/First\s+(\d+)", heads[stm])
+                    nums=[int(x) for x in data[:first].split()]
+                    pairs=list(zip(nums[0::2], nums[1::2]))
+                    for k, (num, rel) in enumerate(pairs):
+                        stop=first+pairs[k+1][1] if k+1 < len(pairs) else len(data)
+                        if entries.get(num, (0,))[0] == 2:
+                            heads[num]=data[first+rel:stop]
+                except Exception:
+                    complete=False
+    p.objects=len(heads)
+
+    def _obj(ref_rx, data):
+        r=re.search(ref_rx+_RX_REF, data or b"")
+        return heads.get(int(r.group(1))) if r else None
+
+    catalog=_obj(rb"/Root", trailer)
+    p.trailer=trailer
+    p.info=_obj(rb"/Info", trailer)
+    pages=_obj(rb"/Pages", catalog)
+    p.pages=_probe_int(rb"/Count\s+(\d+)", pages or b"")
+    sig=False
+    fonts=False
+    for head in heads.values():
+        if (not sig) and (b"/Sig" in head or b"/ByteRange" in head):
+            sig=bool(_RX_SIG.search(head))
+        if (not fonts) and _RX_PAGEISH.search(head):
+            fonts=b"/Font" in head or b"/Font" in (_obj(rb"/Resources", head) or b"")
+    p.certified=bool(catalog and re.search(rb"/DocMDP\b", catalog)) if complete else None
+    p.signed=True if sig else (False if complete else None)
+    p.text_layer=True if fonts else (False if complete and p.pages else None)
+    p.page_images=_probe_page_images(heads, pages) if complete and pages else None
+    p.ok=complete and catalog is not None and (p.info is not None or b"/Info" not in trailer)
+    return p
+
+def _pdf_probe(path):
+    try:
+        st=os.stat(path)
+    except OSError:
+        return _PdfProbe()
+    key=(os.path.abspath(path), st.st_size, st.st_mtime_ns, st.st_ino)
+    with _PROBE_LOCK:
+        hit=_PROBE_CACHE.get(key)
+    if hit is not None:
+        return hit
+    with _span("probe", bytes=st.st_size) as sp:
+        p=_PdfProbe(st.st_size)
+        try:
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                p=_probe_scan(mm, st.st_size)
+        except Exception:
+            pass  # empty, not a PDF, or a damaged xref: nothing conclusive
+        sp.update(outcome="ok" if p.ok else "inconclusive", pages=p.pages, signed=p.signed, text_layer=p.text_layer, objects=p.objects)
+    with _PROBE_LOCK:
+        if len(_PROBE_CACHE) >= 256:
+            _PROBE_CACHE.pop(next(iter(_PROBE_CACHE)))
+        _PROBE_CACHE[key]=p
+    return p
+
+def _pdf_page_count(pdf_input):
+    pages=_pdf_probe(pdf_input).pages
+    if pages is not None:
+        return pages
+    try:
+        from pypdf import PdfReader
+        with open(pdf_input, "rb") as f:
+            return len(PdfReader(f).pages)
+    except Exception:
+        return None
+
+def _pdftotext_stream(pdf_input, first_page=None, last_page=None, max_chars=TEXT_MAX_CHARS):
+    cmd=[PDFTOTEXT]
+    if first_page: cmd+=["-f", str(first_page)]
+    if last_page: cmd+=["-l", str(last_page)]
+    cmd+=[pdf_input, "-"]
+    dec=codecs.getincrementaldecoder("utf-8")("replace")
+    parts=[]
+    n=0
+    truncated=False
+    with tempfile.TemporaryFile() as errf:
+        p=subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=errf)
+        try:
+            while True:
+                b=p.stdout.read(1<<16)
+                if not b: break
+                chunk=dec.decode(b)
+                if n+len(chunk) >= max_chars:
+                    parts.append(chunk[:max_chars-n])
+                    truncated=True
+                    p.kill()
+                    break
+                parts.append(chunk)
+                n+=len(chunk)
+            if not truncated: parts.append(dec.decode(b"", final=True))
+        finally:
+            p.stdout.close()
+            rc=p.wait()
+        errf.seek(0)
+        err=errf.read().decode("utf-8", "replace").strip()
+    if truncated: rc=0
+    return "".join(parts), rc, err, truncated
+
+_KEYWORD_PATTERNS=[
+    r"\b\d{1,2}/\d{1,2}/\d{2,4}\b",
+    r"\b\d{4}-\d{2}-\d{2}\b",
+    r"\b(jan|feb|mar|apr|may|jun|jul|aug|sep|sept|oct|nov|dec)[a-z]*\b",
+    r"\b(invoice|statement|receipt|bill|balance|amount|total|due|paid|payment|account|acct|order|purchase)\b",
+    r"\b(service|date of service|dos|appointment|visit|delivered|shipped)\b",
+    r"\b(policy|contract|agreement|notice|letter|form|report|summary|renewal)\b",
+    r"\b(tax|irs|1099|w-2|utility|electric|gas|water|internet|insurance|mortgage|bank|credit)\b",
+]
+_KEYWORD_RX=re.compile("|".join(_KEYWORD_PATTERNS), re.I)
+
+def _text_is_sufficient(text):
+    return len((text or "").strip()) >= MIN_TEXT_CHARS and bool(_KEYWORD_RX.search(text or ""))
+
+class _PypdfText:
+    # In-process backend with the same contract as _pdftotext_stream; one PdfReader per document,
+    # reused across the page ranges _text_pages asks for.
+    def __init__(self, pdf_input):
+        self.pdf_input=pdf_input
+        self._fh=None
+        self._reader=None
+
+    def __call__(self, pdf_input, first_page=None, last_page=None, max_chars=TEXT_MAX_CHARS):
+        try:
+            if self._reader is None:
+                from pypdf import PdfReader
+                self._fh=open(self.pdf_input, "rb")
+                self._reader=PdfReader(self._fh)
+                if self._reader.is_encrypted and not self._reader.decrypt(""):
+                    raise ValueError("encrypted")
+            pages=self._reader.pages
+            parts=[]
+            n=0
+            for i in range(max(1, first_page or 1)-1, min(len(pages), last_page or len(pages))):
+                t=(pages[i].extract_text() or "")+"\f"
+                if n+len(t) >= max_chars:
+                    parts.append(t[:max_chars-n])
+                    return "".join(parts), 0, "", True
+                parts.append(t)
+                n+=len(t)
+            return "".join(parts), 0, "", False
+        except Exception as e:
+            return "", 1, f"pypdf: {type(e).__name__}: {e}", False
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+        self._fh=None
+        self._reader=None
+
+def _text_backend_for(probe):
+    if TEXT_BACKEND != "auto":
+        return TEXT_BACKEND
+    if not _tool_exists(PDFTOTEXT):
+        return "pypdf"
+    if probe.ok and probe.text_layer and probe.encrypted is False:
+        return "pypdf"
+    return "poppler"
+
+def _text_looks_poor(text):
+    # pypdf output Poppler would likely do better on: nearly empty, mojibake, or glyphs run together.
+    s=(text or "").strip()[:20000]
+    if len(s) < MIN_TEXT_CHARS: return True
+    bad=s.count("\ufffd")+s.count("\x00")
+    alnum=sum(1 for c in s if c.isalnum())
+    spaces=sum(1 for c in s if c.isspace())
+    return bad > len(s)*0.01 or alnum < len(s)*0.4 or spaces < len(s)*0.05
 
-def _pdftotext(pdf_input):
+def _pdftotext(pdf_input, first_pages=None):
+    probe=_pdf_probe(pdf_input)
+    if probe.text_layer is False:
+        _progress("[1/4] No fonts on any page (no text layer); skipping pdftotext")
+        return "", 0, ""
+    backend=_text_backend_for(probe)
+    with _span("pdftotext", backend=backend) as sp:
+        text, rc, err=_text_with(backend, pdf_input, first_pages, sp)
+        if backend == "pypdf" and TEXT_BACKEND == "auto" and (rc != 0 or _text_looks_poor(text)) and _tool_exists(PDFTOTEXT):
+            _progress("  pypdf text looks poor; retrying with pdftotext")
+            sp["fallback"]="poppler"
+            text, rc, err=_text_with("poppler", pdf_input, first_pages, sp)
+        sp.update(outcome="ok" if rc == 0 else "failed", rc=rc, chars=len(text))
+        return text, rc, err
+
+def _text_with(backend, pdf_input, first_pages, sp):
+    if backend == "poppler":
+        return _text_pages(pdf_input, first_pages, sp, _pdftotext_stream, "pdftotext")
+    stream=_PypdfText(pdf_input)
+    try:
+        return _text_pages(pdf_input, first_pages, sp, stream, "pypdf")
+    finally:
+        stream.close()
+
+def _count_page_chars(chars, first, text):
+    # Both backends end every page with a form feed; a truncated last page has none.
+    segs=(text or "").split("\f")
+    if segs and segs[-1] == "": segs.pop()
+    for i, seg in enumerate(segs):
+        chars[first+i]=len(seg.strip())
+
+def _route_pages(page_chars, page_images):
+    # Textless pages that carry an image, in a document that also has text pages (first VISION_MAX_PAGES of them);
+    # None when not mixed. Blank or short text-only pages (versos, separators, signatures) stay on the text path.
+    if not PAGE_ROUTING or not page_chars or not page_images: return None
+    textless=[p for p in sorted(page_chars) if page_chars[p] < PAGE_TEXT_MIN_CHARS]
+    if not textless or len(textless) == len(page_chars): return None
+    scanned=[p for p in textless if p in page_images]
+    return scanned[:VISION_MAX_PAGES] or None
+
+def _text_pages(pdf_input, first_pages, sp, stream, name):
     t0=time.monotonic()
-    _progress(f"[1/4] Extracting text via pdftotext: {os.path.basename(pdf_input)}")
-    r=_run([PDFTOTEXT, pdf_input, "-"])
-    if r.returncode != 0:
-        err=_tool_err(r)
-        _progress(f"  pdftotext failed (rc={r.returncode}) in {_fmt_secs(time.monotonic()-t0)}")
-        if err: _progress(f"  pdftotext error: {err[:200]}")
-        return "", r.returncode, err
-    out=(r.stdout or "").strip()
-    _progress(f"  pdftotext ok: {len(out)} chars in {_fmt_secs(time.monotonic()-t0)}")
+    _progress(f"[1/4] Extracting text via {name}: {os.path.basename(pdf_input)}")
+    n=TEXT_FIRST_PAGES if first_pages is None else int(first_pages)
+    total=_pdf_page_count(pdf_input) if n > 0 else None
+    chars={}
+    if n <= 0 or (total is not None and total <= n):
+        text, rc, err, _=stream(pdf_input)
+        _count_page_chars(chars, 1, text)
+        pages_desc="all pages"
+    else:
+        text, rc, err, truncated=stream(pdf_input, 1, n)
+        _count_page_chars(chars, 1, text)
+        last=n
+        while rc == 0 and (not truncated) and (not _text_is_sufficient(text)):
+            if total is not None and last >= total: break
+            if total is None and text.count("\f") < last: break  # ran past the end of the document
+            nxt=last*2 if total is None else min(last*2, total)
+            _progress(f"  text insufficient in pages 1-{last}; widening to 1-{nxt}")
+            more, rc, err, truncated=stream(pdf_input, last+1, nxt, max_chars=max(0, TEXT_MAX_CHARS-len(text)))
+            _count_page_chars(chars, last+1, more)
+            text+=more
+            last=nxt
+        pages_desc=f"pages 1-{last}"
+        if rc == 0 and (not truncated) and TEXT_INCLUDE_LAST_PAGE and total is not None and total > last:
+            tail, trc, _terr, _=stream(pdf_input, total, total)
+            if trc == 0: _count_page_chars(chars, total, tail)
+            if trc == 0 and tail.strip():
+                text=text.rstrip("\f")+"\f"+tail
+                pages_desc+=f" + {total}"
+        if total is not None: pages_desc+=f" of {total}"
+    sp.update(pages=pages_desc, total_pages=total, bytes=len((text or "").encode("utf-8")))
+    if rc != 0:
+        _progress(f"  {name} failed (rc={rc}) in {_fmt_secs(time.monotonic()-t0)}")
+        if err: _progress(f"  {name} error: {err[:200]}")
+        return "", rc, err
+    _pdf_probe(pdf_input).page_chars=chars
+    out=(text or "").strip()
+    _progress(f"  {name} ok: {len(out)} chars ({pages_desc}) in {_fmt_secs(time.monotonic()-t0)}")
     return out, 0, ""
 
-def _render_pdf_to_images(pdf_input, max_pages=VISION_MAX_PAGES, dpi=VISION_DPI):
-    t0=time.monotonic()
-    _progress(f"[2/4] Rendering PDF to images (pages={max_pages}, dpi={dpi})")
-    with tempfile.TemporaryDirectory(prefix="scan_vlm_") as td:
-        prefix=os.path.join(td, "page")
-        r=_run([PDFTOPPM, "-f","1","-l",str(max_pages),"-r",str(dpi),"-jpeg", pdf_input, prefix])
-        if r.returncode != 0:
-            raise RuntimeError(_tool_err(r) or "pdftoppm failed")
-        imgs=sorted([os.path.join(td,f) for f in os.listdir(td) if f.startswith("page-") and f.endswith(".jpg")],
-                    key=lambda p: int(re.search(r"-(\d+)\.jpg$", p).group(1)))
-        if not imgs: raise RuntimeError("No images produced from PDF")
-        out=[_img_to_data_url(p) for p in imgs]
-        _progress(f"  rendered {len(out)} image(s) in {_fmt_secs(time.monotonic()-t0)}")
+_DATA_URL_PREFIX=b"data:image/jpeg;base64,"
+
+def _jpeg_to_data_url(data):
+    # base64 straight into one preallocated buffer; the result is embedded as-is by _JsonBody.
+    mv=memoryview(data)
+    n=len(mv)
+    buf=bytearray(len(_DATA_URL_PREFIX)+4*((n+2)//3))
+    buf[:len(_DATA_URL_PREFIX)]=_DATA_URL_PREFIX
+    pos=len(_DATA_URL_PREFIX)
+    step=3*(1<<14)
+    for i in range(0, n, step):
+        enc=binascii.b2a_base64(mv[i:i+step], newline=False)
+        buf[pos:pos+len(enc)]=enc
+        pos+=len(enc)
+    return buf
+
+# Caps concurrent pdftoppm processes across all documents/workers of the run.
+_RENDER_SLOTS=threading.BoundedSemaphore(max(1, RENDER_WORKERS))
+
+def _render_page_jpeg(pdf_input, page, dpi=VISION_DPI, opts=("-jpeg",)):
+    # No output root: pdftoppm writes the page image to stdout.
+    with _RENDER_SLOTS:
+        r=subprocess.run([PDFTOPPM, "-f", str(page), "-l", str(page), "-r", str(dpi), *opts, pdf_input], capture_output=True)
+    if r.returncode != 0 or not r.stdout:
+        raise RuntimeError((r.stderr or b"").decode("utf-8", "replace").strip() or f"pdftoppm failed on page {page}")
+    return r.stdout
+
+_THUMB_DPI=12
+_RX_PPM=re.compile(rb"P6\s+(\d+)\s+(\d+)\s+255\s")
+
+class _PageLayout:
+    __slots__=("w", "h", "gray", "box")
+
+    def __init__(self, w: int, h: int, gray: bool, box: typing.Optional[typing.Tuple[int, int, int, int]]):
+        self.w=w
+        self.h=h
+        self.gray=gray
+        self.box=box  # inked (x0, y0, x1, y1) in thumbnail pixels; None when blank or not worth a crop
+
+def _page_layout(ppm):
+    # From a _THUMB_DPI colour thumbnail: page size, whether colour matters and the inked box (None when blank).
+    m=_RX_PPM.match(ppm or b"")
+    if not m: return None
+    w, h=int(m[1]), int(m[2])
+    px=ppm[m.end():m.end()+w*h*3]
+    if not w or not h or len(px) < w*h*3: return None
+    r, g, b=px[0::3], px[1::3], px[2::3]
+    lo=bytes(map(min, r, g, b))
+    colored=sum(1 for a, c in zip(lo, map(max, r, g, b)) if c-a > 48)
+    rows=[y for y in range(h) if min(lo[y*w:(y+1)*w]) < 200]
+    cols=[x for x in range(w) if min(lo[x::w]) < 200]
+    box=None
+    if rows and cols:
+        pad=2
+        box=(max(0, cols[0]-pad), max(0, rows[0]-pad), min(w, cols[-1]+1+pad), min(h, rows[-1]+1+pad))
+        if (box[2]-box[0])*(box[3]-box[1]) > 0.9*w*h: box=None  # not worth a crop
+    return _PageLayout(w, h, colored <= w*h*0.01, box)
+
+def _encode_page(pdf_input, page, dpi):
+    # Rendered JPEG within the per-page share of VISION_REQUEST_BYTES, plus a short description for progress output.
+    q=VISION_JPEG_QUALITY
+    try:
+        lay=_page_layout(_render_page_jpeg(pdf_input, page, dpi=_THUMB_DPI, opts=()))
+    except RuntimeError:
+        lay=None
+    box=lay.box if lay else None
+    if lay:
+        x0, y0, x1, y1=box or (0, 0, lay.w, lay.h)
+        if VISION_MAX_EDGE > 0:
+            dpi=min(dpi, int(VISION_MAX_EDGE*_THUMB_DPI/max(x1-x0, y1-y0)))
+        dpi=max(VISION_MIN_DPI, dpi)
+    gray=bool(lay and lay.gray)
+    budget=VISION_REQUEST_BYTES*3//4//max(1, VISION_MAX_PAGES) if VISION_REQUEST_BYTES > 0 else 0
+
+    def _render():
+        opts=["-gray"] if gray else []
+        if box:
+            k=dpi/_THUMB_DPI
+            opts+=["-x", str(int(box[0]*k)), "-y", str(int(box[1]*k)), "-W", str(int((box[2]-box[0])*k)), "-H", str(int((box[3]-box[1])*k))]
+        return _render_page_jpeg(pdf_input, page, dpi=dpi, opts=(*opts, "-jpeg", "-jpegopt", f"quality={q}"))
+
+    data=_render()
+    for _ in range(2):
+        if not budget or len(data) <= budget: break
+        # JPEG size grows roughly with the pixel count: lower the resolution first, then the quality.
+        nd=max(VISION_MIN_DPI, int(dpi*(budget/len(data))**0.5*0.95))
+        if nd < dpi: dpi=nd
+        elif q > 40: q=max(40, q-20)
+        else: break
+        data=_render()
+    return data, f"{len(data)//1024}KB {dpi}dpi q{q}"+(" gray" if gray else "")+(" cropped" if box else "")
+
+_DPI_RUNGS=(300, 240, 200, 150, 120, 100, 85, 72)
+
+def _vision_dpi(model=None):
+    if not VISION_DPI_LEARN: return VISION_DPI
+    return int(_model_state(model).get("vision_dpi") or VISION_DPI)
+
+def _next_learn_dpi(model=None):
+    # Next rung below the learned DPI not yet shown to change the extracted fields; None once converged.
+    st=_model_state(model)
+    cur=int(st.get("vision_dpi") or VISION_DPI)
+    floor=max(int(st.get("vision_dpi_floor") or 0), VISION_MIN_DPI-1)
+    lower=[r for r in _DPI_RUNGS if floor < r < cur]
+    return lower[0] if lower else None
+
+def _same_fields(a, b):
+    norm=lambda v: re.sub(r"\W+", " ", str(v or "")).strip().lower()
+    return all(norm(a.get(k)) == norm(b.get(k)) for k in ("date", "provider", "document_type"))
+
+def _render_page_data_url(pdf_input, page, dpi):
+    if VISION_ENCODE == "plain":
+        return _jpeg_to_data_url(_render_page_jpeg(pdf_input, page, dpi=dpi))
+    data, desc=_encode_page(pdf_input, page, dpi)
+    _progress(f"  page {page}: {desc}")
+    return _jpeg_to_data_url(data)
+
+def _render_pdf_to_images(pdf_input, max_pages=VISION_MAX_PAGES, dpi=VISION_DPI, cache=None, pages=None):
+    # cache: per-document {(page, dpi): data_url} shared by vision retries and the merge pass.
+    # pages: explicit page numbers instead of 1..max_pages.
+    with _span("render", dpi=dpi) as sp:
+        out=_render_pages(pdf_input, max_pages, dpi, cache, sp, pages)
+        sp.update(pages=len(out), bytes=sum(len(u) for u in out), page_bytes=[len(u) for u in out])
         return out
 
+def _render_pages(pdf_input, max_pages, dpi, cache, sp, pages=None):
+    t0=time.monotonic()
+    cache=cache if cache is not None else {}
+    if "_total" not in cache:
+        cache["_total"]=_pdf_page_count(pdf_input)
+    total=cache["_total"]
+    last=max_pages if total is None else min(max_pages, total)
+    wanted=list(range(1, last+1)) if pages is None else [p for p in pages if total is None or p <= total]
+    missing=[p for p in wanted if (p, dpi) not in cache]
+    sp.update(rendered=len(missing), reused=len(wanted)-len(missing))
+    if missing:
+        _progress(f"[2/4] Rendering PDF to images (pages={','.join(str(p) for p in missing)}, dpi={dpi})")
+        errors={}
+        workers=max(1, min(len(missing), RENDER_WORKERS))
+
+        def _one(page):
+            try:
+                cache[(page, dpi)]=_render_page_data_url(pdf_input, page, dpi)
+            except RuntimeError as e:
+                errors[page]=e
+
+        if workers == 1:
+            for p in missing: _one(p)
+        else:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="render") as ex:
+                list(ex.map(_one, missing))
+        if errors:
+            first_bad=min(errors)
+            # Page count unknown: a failure past page 1 just means we ran off the end of the document.
+            if total is None and first_bad > 1 and all((p, dpi) in cache for p in range(1, first_bad)):
+                cache["_total"]=first_bad-1
+            else:
+                raise errors[first_bad]
+        _progress(f"  rendered {len(missing)-len(errors)} page(s) in {_fmt_secs(time.monotonic()-t0)}")
+    else:
+        desc=f"1-{last}" if pages is None else ",".join(str(p) for p in wanted)
+        _progress(f"[2/4] Reusing rendered pages {desc} (dpi={dpi})")
+    out=[cache[(p, dpi)] for p in wanted if (p, dpi) in cache]
+    if not out: raise RuntimeError("No images produced from PDF")
+    return out
+
+# Request body for requests.post(data=...): JSON text is generated piecewise and bytes values
+# (image data URLs) are referenced, not copied; __len__ lets requests send a Content-Length.
+class _JsonBody:
+    def __init__(self, payload):
+        self._parts=[]
+        self._pending=[]
+        self._emit(payload)
+        self._flush()
+        self._len=sum(len(p) for p in self._parts)
+        self._idx=0
+        self._off=0
+
+    def _emit(self, v):
+        if isinstance(v, (bytes, bytearray, memoryview)):
+            self._pending.append('"')
+            self._flush()
+            self._parts.append(memoryview(v))
+            self._pending.append('"')
+        elif isinstance(v, dict):
+            self._pending.append("{")
+            for i, (k, x) in enumerate(v.items()):
+                if i: self._pending.append(",")
+                self._pending.append(json.dumps(str(k), ensure_ascii=False)+":")
+                self._emit(x)
+            self._pending.append("}")
+        elif isinstance(v, (list, tuple)):
+            self._pending.append("[")
+            for i, x in enumerate(v):
+                if i: self._pending.append(",")
+                self._emit(x)
+            self._pending.append("]")
+        else:
+            self._pending.append(json.dumps(v, ensure_ascii=False))
+
+    def _flush(self):
+        if self._pending:
+            self._parts.append(memoryview("".join(self._pending).encode("utf-8")))
+            self._pending=[]
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        for p in self._parts:
+            yield bytes(p)
+
+    def read(self, size=-1):
+        if size is None or size < 0: size=self._len
+        out=[]
+        while size > 0 and self._idx < len(self._parts):
+            p=self._parts[self._idx]
+            chunk=p[self._off:self._off+size]
+            out.append(chunk)
+            size-=len(chunk)
+            self._off+=len(chunk)
+            if self._off >= len(p):
+                self._idx+=1
+                self._off=0
+        return b"".join(out)
+
 def _is_context_overflow(err):
     s=str(err or "").lower()
     return ("context length" in s) or ("overflows" in s) or ("not enough" in s) or ("overflow" in s)
@@ -160,31 +1012,660 @@ def _clean_err(resp):
     except Exception:
         return (resp.text or "").strip()
 
+# One keep-alive session shared by every _call_llm in the process (all batch workers).
+_HTTP_LOCK=threading.Lock()
+_HTTP_SESSION=None
+_HTTP_STATS={"requests":0, "connections":0, "connect_secs":0.0}
+
+def _note_http_connect(secs):
+    conns=getattr(_TLS, "http_connects", None)
+    if conns is not None: conns.append(secs)
+    with _HTTP_LOCK:
+        _HTTP_STATS["connections"]+=1
+        _HTTP_STATS["connect_secs"]+=secs
+
+def _new_http_session(pool_size):
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.connection import HTTPConnection, HTTPSConnection
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+    class _TimedHTTPConnection(HTTPConnection):
+        def connect(self):
+            t0=time.monotonic()
+            super().connect()
+            _note_http_connect(time.monotonic()-t0)
+
+    class _TimedHTTPSConnection(HTTPSConnection):
+        def connect(self):
+            t0=time.monotonic()
+            super().connect()
+            _note_http_connect(time.monotonic()-t0)
+
+    class _TimedHTTPConnectionPool(HTTPConnectionPool):
+        ConnectionCls=_TimedHTTPConnection  # pyright: ignore[reportAssignmentType]  # urllib3 declares a Protocol its own classes don't satisfy
+
+    class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+        ConnectionCls=_TimedHTTPSConnection  # pyright: ignore[reportAssignmentType]
+
+    class _TimedAdapter(HTTPAdapter):
+        def init_poolmanager(self, *args, **kwargs):
+            super().init_poolmanager(*args, **kwargs)
+            self.poolmanager.pool_classes_by_scheme={"http":_TimedHTTPConnectionPool, "https":_TimedHTTPSConnectionPool}
+
+    n=max(1, int(pool_size))
+    sess=requests.Session()
+    hosts=max(4, len(_LLM_ROUTER.endpoints)+1 if _LLM_ROUTER is not None else 0)  # one pool per endpoint host
+    adapter=_TimedAdapter(pool_connections=hosts, pool_maxsize=n, pool_block=False, max_retries=0)
+    sess.mount("http://", adapter)
+    sess.mount("https://", adapter)
+    sess.headers.update({"Content-Type":"application/json", "Connection":"keep-alive"})
+    return sess
+
+def _http_session():
+    global _HTTP_SESSION
+    with _HTTP_LOCK:
+        if _HTTP_SESSION is None:
+            _HTTP_SESSION=_new_http_session(LLM_POOL_SIZE)
+        return _HTTP_SESSION
+
+def _http_stats_line():
+    with _HTTP_LOCK:
+        st=dict(_HTTP_STATS)
+    if not st["requests"]: return None
+    avg=(st["connect_secs"]/st["connections"]) if st["connections"] else 0.0
+    return f"HTTP: {st['requests']} request(s) over {st['connections']} connection(s), connect avg {_fmt_secs(avg)} total {_fmt_secs(st['connect_secs'])}"
+
+def _retry_after_secs(resp):
+    v=(resp.headers.get("Retry-After") if resp is not None else None) or ""
+    v=str(v).strip()
+    if not v: return None
+    try:
+        return max(0.0, float(v))
+    except ValueError:
+        pass
+    try:
+        from email.utils import parsedate_to_datetime
+        dt=parsedate_to_datetime(v)
+        return max(0.0, dt.timestamp()-time.time())
+    except Exception:
+        return None
+
+def _backoff_delay(attempt, retry_after=None, base=None, cap=None):
+    # Server-provided Retry-After wins; otherwise "full jitter" exponential backoff.
+    if retry_after is not None:
+        return min(float(retry_after), float(cap if cap is not None else LLM_BACKOFF_CAP))
+    base=float(base if base is not None else LLM_BACKOFF_BASE)
+    cap=float(cap if cap is not None else LLM_BACKOFF_CAP)
+    return random.uniform(0, min(cap, base*(2**max(0, attempt))))
+
+class _LlmController:
+    # AIMD limit on in-flight LLM requests plus a circuit breaker.
+    # - success with latency near the best seen for that kind of request: limit += 1/limit
+    # - success that is much slower than that (queueing on the server): limit *= 0.9
+    # - 429/503 overload: limit *= 0.5
+    # - BREAKER_THRESHOLD consecutive connection failures: stop dispatching for a cooldown
+    #   (doubling up to LLM_BREAKER_MAX_COOLDOWN); the next request after it is a probe.
+    LATENCY_TOLERANCE=2.5
+    BREAKER_THRESHOLD=3
+
+    def __init__(self, limit, max_limit=None, min_limit=1):
+        self.max_limit=max(1, int(max_limit or limit))
+        self.min_limit=max(1, min(int(min_limit), self.max_limit))
+        self.limit=float(max(self.min_limit, min(int(limit), self.max_limit)))
+        self.inflight=0
+        self.best_latency={}
+        self.fail_streak=0
+        self.cooldown=0.0
+        self.open_until=0.0
+        self.stats={"ok":0, "overload":0, "errors":0, "breaker_trips":0, "backoff_secs":0.0, "min_limit_seen":self.limit, "max_limit_seen":self.limit}
+        self._cv=threading.Condition()
+
+    def acquire(self):
+        with self._cv:
+            while True:
+                wait=self.open_until-time.monotonic()
+                if wait > 0:
+                    self._cv.wait(wait)
+                    continue
+                if self.inflight < int(self.limit):
+                    self.inflight+=1
+                    return
+                self._cv.wait()
+
+    def release(self, outcome, latency=None, kind="text"):
+        with self._cv:
+            self.inflight=max(0, self.inflight-1)
+            if outcome == "ok":
+                self.stats["ok"]+=1
+                self.fail_streak=0
+                self.cooldown=0.0
+                best=self.best_latency.get(kind)
+                if latency is not None:
+                    self.best_latency[kind]=latency if best is None else min(best, latency)
+                if best is not None and latency is not None and latency > best*self.LATENCY_TOLERANCE:
+                    self.limit=max(self.min_limit, self.limit*0.9)
+                else:
+                    self.limit=min(self.max_limit, self.limit+1.0/max(1.0, self.limit))
+            elif outcome == "overload":
+                self.stats["overload"]+=1
+                self.limit=max(self.min_limit, self.limit*0.5)
+            elif outcome == "conn":
+                self.stats["errors"]+=1
+                self.fail_streak+=1
+                if self.fail_streak >= self.BREAKER_THRESHOLD:
+                    self.cooldown=min(LLM_BREAKER_MAX_COOLDOWN, max(LLM_BREAKER_COOLDOWN, self.cooldown*2))
+                    self.open_until=time.monotonic()+self.cooldown
+                    self.limit=float(self.min_limit)  # one probe at a time once the cooldown ends
+                    self.fail_streak=self.BREAKER_THRESHOLD-1  # next failure (the probe) re-trips
+                    self.stats["breaker_trips"]+=1
+                    _progress(f"  LLM endpoint unreachable; pausing dispatch for {_fmt_secs(self.cooldown)}")
+            else:
+                self.stats["errors"]+=1
+            self.stats["min_limit_seen"]=min(self.stats["min_limit_seen"], self.limit)
+            self.stats["max_limit_seen"]=max(self.stats["max_limit_seen"], self.limit)
+            self._cv.notify_all()
+
+    def note_backoff(self, secs):
+        with self._cv:
+            self.stats["backoff_secs"]+=secs
+
+    def summary(self):
+        with self._cv:
+            st=dict(self.stats)
+            limit=self.limit
+        return (f"LLM: concurrency {int(limit)} (range {int(st['min_limit_seen'])}-{int(st['max_limit_seen'])}, max {self.max_limit}), "
+                f"{st['ok']} ok, {st['overload']} overloaded, {st['errors']} error(s), "
+                f"{st['breaker_trips']} breaker trip(s), backoff {_fmt_secs(st['backoff_secs'])}")
+
+# Set by main(); None (library use) means no concurrency cap, backoff still applies.
+_LLM_CONTROLLER=None
+
+# --- Several endpoints (LLM_ENDPOINTS / --lm-endpoint): each request goes to the healthy endpoint
+# with the fewest requests in flight, within its own max. A background thread GETs /v1/models on
+# every endpoint each LLM_HEALTH_INTERVAL seconds; a failing endpoint is left out until it answers
+# again, and a connection error fails the request over to another endpoint at once. The smallest
+# context window the endpoints report is the one prompts are planned for.
+LLM_ENDPOINTS=_env_first(("LLM_ENDPOINTS",), "")
+LLM_HEALTH_INTERVAL=float(os.getenv("LLM_HEALTH_INTERVAL","30"))
+
+def _parse_endpoint(spec):
+    # "URL[,model=NAME][,max=N]" -> {"url", "model", "max"}; max 0 = no per-endpoint limit.
+    parts=[p.strip() for p in str(spec or "").split(",") if p.strip()]
+    if not parts or "=" in parts[0]:
+        raise ValueError(f"bad endpoint {spec!r}: expected URL[,model=NAME][,max=N]")
+    ep={"url":_normalize_chat_completions_endpoint(parts[0]), "model":LLM_MODEL, "max":0}
+    for p in parts[1:]:
+        k, _, v=p.partition("=")
+        k=k.strip().lower()
+        if k == "model" and v.strip():
+            ep["model"]=v.strip()
+        elif k == "max" and v.strip().isdigit():
+            ep["max"]=int(v)
+        else:
+            raise ValueError(f"bad endpoint option {p!r} in {spec!r}")
+    return ep
+
+def _endpoint_arg(s):
+    try:
+        return _parse_endpoint(s)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+class _LlmEndpoint:
+    # One entry of the router; the state and counters below are only changed under the router's lock.
+    __slots__=("url", "model", "max", "name", "inflight", "healthy", "ctx", "ewma",
+               "requests", "ok", "errors", "failovers", "latencies", "completion_tokens")
+
+    def __init__(self, url: str, model: str, max: int=0):
+        self.url=url
+        self.model=model
+        self.max=max  # 0 = no per-endpoint limit
+        self.name=re.sub(r"^\w+://|/v1/chat/completions$", "", url)
+        self.inflight=0
+        self.healthy=True
+        self.ctx: typing.Optional[int]=None       # context window from /v1/models
+        self.ewma: typing.Optional[float]=None    # smoothed latency of successful requests
+        self.requests=0
+        self.ok=0
+        self.errors=0
+        self.failovers=0
+        self.latencies: typing.List[float]=[]
+        self.completion_tokens=0
+
+class _LlmRouter:
+    def __init__(self, endpoints, health_interval=LLM_HEALTH_INTERVAL):
+        # endpoints: _parse_endpoint dicts.
+        self.endpoints=[_LlmEndpoint(ep["url"], ep["model"], ep["max"]) for ep in endpoints]
+        self.health_interval=health_interval
+        self._cv=threading.Condition()
+        self._stop=threading.Event()
+        self._thread=None
+        self._t0=time.monotonic()
+
+    def start(self):
+        self.check()
+        if self.health_interval > 0:
+            self._thread=threading.Thread(target=self._health_loop, name="scanfile-llm-health", daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(5)
+
+    def _health_loop(self):
+        while not self._stop.wait(self.health_interval):
+            self.check()
+
+    def check(self):
+        # Health-checks every endpoint in parallel; a 200 from /v1/models is healthy and may carry the context window.
+        def one(ep):
+            ok, ctx=False, None
+            try:
+                r=_http_session().get(_models_url(ep.url), timeout=5)
+                ok=r.status_code == 200
+                data=r.json() if ok else {}
+                entries=data.get("data") if isinstance(data, dict) else data
+                for entry in (entries or []):
+                    if isinstance(entry, dict) and entry.get("id") == ep.model:
+                        ctx=_context_from_model_entry(entry)
+            except Exception:
+                pass
+            with self._cv:
+                if ok != ep.healthy:
+                    _progress(f"  LLM endpoint {ep.name} is {'back' if ok else 'down'}")
+                ep.healthy=ok
+                if ctx: ep.ctx=ctx
+                self._cv.notify_all()
+        ts=[threading.Thread(target=one, args=(ep,), daemon=True) for ep in self.endpoints]
+        for t in ts: t.start()
+        for t in ts: t.join(10)
+
+    def context_window(self):
+        with self._cv:
+            known=[ep.ctx for ep in self.endpoints if ep.ctx]
+        return min(known) if known else None
+
+    def acquire(self, exclude=()):
+        # Least-loaded healthy endpoint not in exclude, waiting while all of them are at their max.
+        # With none healthy, the least-loaded of the rest is tried anyway, so requests fail (and back off) instead of hanging.
+        with self._cv:
+            while True:
+                cands=[ep for ep in self.endpoints if ep.url not in exclude] or list(self.endpoints)
+                healthy=[ep for ep in cands if ep.healthy] or cands
+                free=[ep for ep in healthy if not ep.max or ep.inflight < ep.max]
+                if free:
+                    ep=min(free, key=lambda e: (e.inflight, e.ewma or 0.0))
+                    ep.inflight+=1
+                    ep.requests+=1
+                    return ep
+                self._cv.wait()
+
+    def release(self, ep, outcome, latency=None, usage=None):
+        with self._cv:
+            ep.inflight=max(0, ep.inflight-1)
+            if outcome == "ok":
+                ep.ok+=1
+                ep.healthy=True
+                if latency is not None:
+                    ep.latencies.append(latency)
+                    ep.ewma=latency if ep.ewma is None else 0.8*ep.ewma+0.2*latency
+                if isinstance(usage, dict):
+                    ep.completion_tokens+=int(usage.get("completion_tokens") or 0)
+            else:
+                ep.errors+=1
+                if outcome == "conn":
+                    ep.healthy=False
+                    ep.failovers+=1
+            self._cv.notify_all()
+
+    def has_alternative(self, exclude):
+        with self._cv:
+            return any(ep.healthy and ep.url not in exclude for ep in self.endpoints)
+
+    def summary_lines(self):
+        secs=max(1e-9, time.monotonic()-self._t0)
+        out=[]
+        with self._cv:
+            for ep in self.endpoints:
+                if not ep.requests: continue
+                lat=sorted(ep.latencies)
+                pct=lambda q: lat[min(len(lat)-1, int(q*len(lat)))] if lat else 0.0
+                tps=ep.completion_tokens/sum(lat) if lat and sum(lat) > 0 else 0.0
+                out.append(f"LLM endpoint {ep.name} ({ep.model}): {ep.requests} request(s), {ep.ok} ok, {ep.errors} error(s), "
+                           f"latency p50 {_fmt_secs(pct(0.5))} p95 {_fmt_secs(pct(0.95))}, {ep.ok/secs:.2f} req/s, {tps:.0f} completion tok/s"
+                           +("" if ep.healthy else ", down"))
+        return out
+
+# Set by main() from --lm-endpoint or LLM_ENDPOINTS; None means LLM_ENDPOINT/LLM_MODEL.
+_LLM_ROUTER=None
+
 def _call_llm(messages, max_tokens=350, timeout=LLM_TIMEOUT, retries=LLM_MAX_RETRIES):
     import requests
     payload={"model":LLM_MODEL,"messages":messages,"temperature":0.0,"max_tokens":max_tokens}
+    kind="vision" if any(isinstance(m.get("content"), list) for m in messages if isinstance(m, dict)) else "text"
+    ctl=_LLM_CONTROLLER
+    router=_LLM_ROUTER
+    _TLS.last_usage=None
     last_err=None
-    for attempt in range(retries+1):
+    attempt=0           # retries so far, all counted against `retries` (network errors, 429/503, 5xx, bad bodies)
+    overloads=0         # 429/503 answers; also bounded by LLM_BACKOFF_MAX_WAIT
+    sends=0
+    waited=0.0
+    tried=set()         # endpoints that refused a connection since the last backoff
+
+    def _wait(delay):
+        nonlocal waited
+        if delay <= 0: return
+        _progress(f"  backing off {_fmt_secs(delay)}")
+        time.sleep(delay)
+        waited+=delay
+        if ctl: ctl.note_backoff(delay)
+
+    while True:
+        _TLS.http_connects=[]
+        ep=None
+        resp=None
+        content=None
+        latency=None
+        failover=False
+        outcome="error"     # the controller slot and the endpoint are released with this even if the attempt raises
+        if ctl: ctl.acquire()
         try:
-            resp=requests.post(LLM_ENDPOINT, headers={"Content-Type":"application/json"}, json=payload, timeout=timeout)
-        except requests.RequestException as e:
-            last_err=f"RequestException: {e}"
-            if attempt < retries: continue
-            return None, last_err
-        if resp.status_code >= 500:
+            ep=router.acquire(exclude=tried) if router else None
+            if ep: payload["model"]=ep.model
+            sends+=1
+            t0=time.monotonic()
+            body=_JsonBody(payload)
+            with _span("http", kind=kind, attempt=sends, bytes=len(body), **({"endpoint":ep.name} if ep else {})) as sp:
+                try:
+                    resp=_http_session().post(ep.url if ep else LLM_ENDPOINT, data=body, timeout=timeout)
+                except requests.RequestException as e:
+                    resp=None
+                    last_err=f"RequestException: {e}"
+                    sp["outcome"]="conn"
+                finally:
+                    conns=_TLS.http_connects
+                    _TLS.http_connects=None
+                    with _HTTP_LOCK:
+                        _HTTP_STATS["requests"]+=1
+                if resp is not None:
+                    sp.update(http_status=resp.status_code, connection="new" if conns else "reused", resp_bytes=len(resp.content or b""),
+                              outcome="ok" if resp.status_code < 400 else ("overload" if resp.status_code in (429, 503) else "error"))
+            if resp is None:
+                outcome="conn"
+            else:
+                latency=time.monotonic()-t0
+                conn_desc=f"new connection {_fmt_secs(sum(conns))}" if conns else "reused connection"
+                _progress(f"  http {resp.status_code} in {_fmt_secs(latency)} ({conn_desc}{', '+ep.name if ep else ''})")
+                if resp.status_code in (429, 503):
+                    outcome="overload"
+                elif resp.status_code < 400:
+                    try:
+                        j=resp.json()
+                        _TLS.last_usage=j.get("usage") if isinstance(j, dict) else None
+                        content=j["choices"][0]["message"]["content"]
+                        outcome="ok"
+                    except Exception as e:
+                        outcome="bad_body"
+                        last_err=f"BadResponse: {e} | body={(resp.text or '')[:2000]}"
+        finally:
+            if ep:
+                router.release(ep, outcome if outcome in ("ok", "conn") else "error", latency=latency, usage=_TLS.last_usage if outcome == "ok" else None)
+                if outcome == "conn":
+                    tried.add(ep.url)
+                    failover=router.has_alternative(tried)
+                    if not failover: tried.clear()
+            if ctl:
+                if outcome in ("ok", "bad_body"):  # the server answered; a bad body is not an overload signal
+                    ctl.release("ok", latency=latency, kind=kind)
+                else:
+                    # Only one endpoint unreachable: fail over without a breaker strike.
+                    ctl.release("error" if failover else outcome)
+
+        if outcome == "ok":
+            _TLS.last_model=payload["model"]
+            return content, None
+        if failover:
+            _progress(f"  {ep.name if ep else 'endpoint'} unreachable; failing over")
+            continue
+        if resp is not None and outcome != "bad_body":
             last_err=str(_clean_err(resp))
-            if attempt < retries: continue
+            if outcome == "error" and resp.status_code < 500:
+                return None, _clean_err(resp)
+        if attempt >= retries:
             return None, last_err
-        if resp.status_code >= 400:
-            return None, _clean_err(resp)
+        if outcome == "overload":
+            delay=_backoff_delay(overloads, retry_after=_retry_after_secs(resp))
+            if waited+delay > LLM_BACKOFF_MAX_WAIT:
+                return None, last_err
+            overloads+=1
+            _wait(delay)
+        elif outcome != "bad_body":
+            _wait(_backoff_delay(attempt))
+        attempt+=1
+
+# --- Token budgeting: size the first request to the model's context window instead of
+# discovering it through overflow errors. Context size and calibration are learned per
+# LLM_MODEL (from /v1/models, overflow errors and response usage) and persisted.
+_MODEL_STATE_LOCK=threading.Lock()
+_MODEL_STATE=None
+_CONTEXT_PROBED=set()
+_TOKEN_COUNTER=None
+_TOKEN_COUNTER_RESOLVED=False
+_CONTEXT_SAFETY=0.9         # fraction of the context window we plan to fill
+_MESSAGE_OVERHEAD_TOKENS=16 # chat template tokens per request
+
+def _model_state_path():
+    return os.path.join(CACHE_DIR, "models.json")
+
+def _model_state(model=None):
+    global _MODEL_STATE
+    with _MODEL_STATE_LOCK:
+        if _MODEL_STATE is None:
+            _MODEL_STATE={}
+            if CACHE_ENABLED:
+                try:
+                    with open(_model_state_path(), "r", encoding="utf-8") as f:
+                        d=json.load(f)
+                    if isinstance(d, dict): _MODEL_STATE=d
+                except (OSError, ValueError):
+                    pass
+        return dict(_MODEL_STATE.get(model or LLM_MODEL) or {})
+
+def _update_model_state(model=None, **values):
+    _model_state(model)
+    with _MODEL_STATE_LOCK:
+        st=_MODEL_STATE.setdefault(model or LLM_MODEL, {})
+        st.update({k:v for k, v in values.items() if v is not None})
+        if not CACHE_ENABLED: return
         try:
-            j=resp.json()
-            return j["choices"][0]["message"]["content"], None
-        except Exception as e:
-            last_err=f"BadResponse: {e} | body={(resp.text or '')[:2000]}"
-            if attempt < retries: continue
-            return None, last_err
-    return None, last_err or "UnknownError"
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            fd, tmp=tempfile.mkstemp(prefix=".models_", suffix=".json", dir=CACHE_DIR)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(_MODEL_STATE, f, indent=2, sort_keys=True)
+            os.replace(tmp, _model_state_path())
+        except OSError:
+            pass
+
+def _resolve_token_counter():
+    # LLM_TOKENIZER: "tiktoken:<encoding>" or "hf:<tokenizer.json path or hub id>" (optional packages).
+    global _TOKEN_COUNTER, _TOKEN_COUNTER_RESOLVED
+    if _TOKEN_COUNTER_RESOLVED: return _TOKEN_COUNTER
+    _TOKEN_COUNTER_RESOLVED=True
+    spec=str(LLM_TOKENIZER or "").strip()
+    kind, _, name=spec.partition(":")
+    try:
+        if kind == "tiktoken":
+            import tiktoken  # pyright: ignore[reportMissingImports]
+            enc=tiktoken.get_encoding(name or "cl100k_base")
+            _TOKEN_COUNTER=lambda s: len(enc.encode(s, disallowed_special=()))
+        elif kind == "hf":
+            from tokenizers import Tokenizer  # pyright: ignore[reportMissingImports]
+            tok=Tokenizer.from_file(name) if os.path.isfile(name) else Tokenizer.from_pretrained(name)
+            _TOKEN_COUNTER=lambda s: len(tok.encode(s).ids)
+    except Exception as e:
+        _progress(f"  tokenizer {spec!r} unavailable ({type(e).__name__}); using chars-per-token estimate")
+        _TOKEN_COUNTER=None
+    return _TOKEN_COUNTER
+
+def _estimate_tokens(text):
+    text=text or ""
+    counter=_resolve_token_counter()
+    if counter is not None:
+        return counter(text)
+    cpt=float(_model_state().get("chars_per_token") or LLM_CHARS_PER_TOKEN)
+    return int(len(text)/max(0.5, cpt))+1
+
+def _models_url(endpoint=None):
+    e=(endpoint or LLM_ENDPOINT).rstrip("/")
+    if e.endswith("/chat/completions"): e=e[:-len("/chat/completions")]
+    return e+"/models"
+
+_CONTEXT_KEYS=("loaded_context_length", "context_length", "max_context_length", "context_window", "max_model_len", "n_ctx", "n_ctx_train")
+
+def _context_from_model_entry(entry):
+    if not isinstance(entry, dict): return None
+    for k in _CONTEXT_KEYS:
+        for d in (entry, entry.get("meta") or {}, entry.get("metadata") or {}):
+            v=d.get(k) if isinstance(d, dict) else None
+            try:
+                if v and int(v) > 0: return int(v)
+            except (TypeError, ValueError):
+                pass
+    return None
+
+def _probe_context_window(model=None, timeout=5):
+    model=model or LLM_MODEL
+    try:
+        r=_http_session().get(_models_url(), timeout=timeout)
+        data=r.json() if r.status_code == 200 else {}
+    except Exception:
+        return None
+    entries=data.get("data") if isinstance(data, dict) else data
+    for entry in (entries or []):
+        if isinstance(entry, dict) and entry.get("id") == model:
+            return _context_from_model_entry(entry)
+    return None
+
+def _context_window(model=None):
+    model=model or LLM_MODEL
+    if LLM_CONTEXT_WINDOW > 0:
+        return LLM_CONTEXT_WINDOW
+    ctx=_model_state(model).get("context_window")
+    if _LLM_ROUTER is not None:
+        # Plan for the smallest window: a request may land on any endpoint.
+        known=[int(c) for c in (ctx, _LLM_ROUTER.context_window()) if c]
+        return min(known) if known else None
+    if ctx: return int(ctx)
+    with _MODEL_STATE_LOCK:
+        if model in _CONTEXT_PROBED or not LLM_CONTEXT_PROBE: return None
+        _CONTEXT_PROBED.add(model)
+    ctx=_probe_context_window(model)
+    if ctx:
+        _progress(f"  context window for {model}: {ctx} tokens (from /v1/models)")
+        _update_model_state(model, context_window=ctx)
+    return ctx
+
+_OVERFLOW_CTX_RX=[
+    re.compile(r"context length of only (\d+)", re.I),
+    re.compile(r"maximum context length is (\d+)", re.I),
+    re.compile(r"context (?:size|window|length) (?:is |of )?\(?(\d+)(?: tokens)?\)?", re.I),
+    re.compile(r"n_ctx(?:_slot)?\s*[=:]\s*(\d+)", re.I),
+]
+_OVERFLOW_REQ_RX=[
+    re.compile(r"keep the first (\d+) tokens", re.I),
+    re.compile(r"request \((\d+) tokens\)", re.I),
+    re.compile(r"requested (\d+) tokens", re.I),
+    re.compile(r"(\d+) tokens in the messages", re.I),
+]
+
+def _parse_overflow(err):
+    s=str(err or "")
+    ctx=None
+    req=None
+    for rx in _OVERFLOW_CTX_RX:
+        m=rx.search(s)
+        if m:
+            ctx=int(m.group(1))
+            break
+    for rx in _OVERFLOW_REQ_RX:
+        m=rx.search(s)
+        if m:
+            req=int(m.group(1))
+            break
+    return ctx, req
+
+def _learn_from_overflow(err, model=None):
+    ctx, req=_parse_overflow(err)
+    if ctx and LLM_CONTEXT_WINDOW <= 0:
+        known=_model_state(model).get("context_window")
+        if known != ctx:
+            _progress(f"  learned context window: {ctx} tokens")
+            _update_model_state(model, context_window=ctx)
+    return ctx, req
+
+def _calibrate_from_usage(usage, prompt_chars=0, n_images=0, text_tokens_est=None, model=None):
+    # EWMA of observed chars/token (text requests) and tokens/image (vision requests).
+    try:
+        pt=int((usage or {}).get("prompt_tokens") or 0)
+    except (TypeError, ValueError):
+        pt=0
+    if pt <= 0: return
+    st=_model_state(model)
+    if n_images <= 0 and prompt_chars > 0 and _resolve_token_counter() is None:
+        obs=prompt_chars/max(1, pt-_MESSAGE_OVERHEAD_TOKENS)
+        old=st.get("chars_per_token")
+        _update_model_state(model, chars_per_token=round(obs if not old else (0.7*float(old)+0.3*obs), 3))
+    elif n_images > 0 and text_tokens_est is not None:
+        obs=max(1, (pt-int(text_tokens_est))//n_images)
+        old=st.get("tokens_per_image")
+        _update_model_state(model, tokens_per_image=int(obs if not old else (0.7*float(old)+0.3*obs)))
+
+def _request_tokens(system, prompt):
+    return _estimate_tokens(system)+_estimate_tokens(prompt)+_MESSAGE_OVERHEAD_TOKENS
+
+def _fits_context(tokens, max_tokens, ctx):
+    return ctx is None or tokens+max_tokens <= ctx*_CONTEXT_SAFETY
+
+_TEXT_BUDGETS=(7000, 4500, 2800, 1600)
+
+def _plan_text_budgets(text, keywords_count=5, max_tokens=350, below=None, model=None):
+    # The usual char-budget ladder, minus the rungs whose estimated prompt cannot fit the
+    # context window; if even the smallest cannot, one budget sized from the estimate.
+    ladder=[b for b in _TEXT_BUDGETS if below is None or b < below]
+    ctx=_context_window(model)
+    if not ctx: return ladder
+    fit=[]
+    for b in ladder:
+        prompt=_prompt_from_text(_compact_text(text, b), keywords_count=keywords_count)
+        if _fits_context(_request_tokens(_SYSTEM_PROMPT, prompt), max_tokens, ctx):
+            fit.append(b)
+    if fit:
+        if len(fit) < len(ladder):
+            _progress(f"  text budget sized to {fit[0]} chars for a {ctx}-token context")
+        return fit
+    overhead=_request_tokens(_SYSTEM_PROMPT, _prompt_from_text("", keywords_count=keywords_count))
+    spare=int(ctx*_CONTEXT_SAFETY)-max_tokens-overhead
+    cpt=float(_model_state(model).get("chars_per_token") or LLM_CHARS_PER_TOKEN)
+    chars=int(spare*cpt)
+    smallest=min(ladder) if ladder else (below if below is not None else _TEXT_BUDGETS[-1])
+    chars=min(int(smallest*0.6), chars)
+    return [chars] if chars >= 200 else []
+
+def _plan_vision_pages(prompt, max_pages, max_tokens=450, model=None):
+    # Largest page count whose estimated prompt fits; max_pages when nothing is known yet.
+    ctx=_context_window(model)
+    tpi=_model_state(model).get("tokens_per_image")
+    if not ctx or not tpi: return max_pages
+    base=_request_tokens(_SYSTEM_PROMPT, prompt)
+    for pages in range(max_pages, 0, -1):
+        if _fits_context(base+pages*int(tpi), max_tokens, ctx): return pages
+    return 1
+
+_SYSTEM_PROMPT="You extract metadata for naming scanned documents and output strict JSON only."
 
 def _prompt_from_text(t, keywords_count=5):
     return f"""You rename scanned documents by extracting filename metadata.
@@ -225,22 +1706,68 @@ Return ONLY valid JSON (no markdown, no extra text) with:
 - confidence: number 0 to 1
 """
 
-def _compact_text(text, max_chars):
+def _prompt_for_mixed(t, image_pages, keywords_count=5):
+    pages=", ".join(str(p) for p in image_pages)
+    return f"""You rename scanned documents by extracting filename metadata.
+
+Text from the pages of a scanned document that have a text layer:
+{t}
+
+The attached images are page(s) {pages} of the same document, which have no text layer. Use both the text and the images.
+
+Return ONLY valid JSON (no markdown, no extra text) with:
+- date: best single date for the filename in YYYY-MM-DD (prefer date of service if this doc is about a service/appointment/delivery; otherwise prefer the document/issue date). null if unknown.
+- date_basis: "service" | "document" | "unknown"
+- provider: short issuer/vendor/provider/organization name (e.g., bank, utility, clinic, school). null if unknown.
+- document_type: short type like "Statement", "Invoice", "Receipt", "Bill", "Report", "Letter", "Notice", "Contract", "Policy", "Form", "Tax Document", or similar. null if unknown.
+- title: short human-readable title (max ~8 words). If the document already has a clear title, use it; otherwise infer one from content. null if unknown.
+- author: short author (person or organization) if clear from the document. null if unknown.
+- subject: short subject line if clear from the document. null if unknown.
+- keywords: array of strings (max {keywords_count} items). Each keyword should be a short topic phrase. [] if none.
+- confidence: number 0 to 1
+"""
+
+def _prompt_from_text_batch(docs, keywords_count=5):
+    # docs: [(id, compacted text)]; the answer is one JSON object per document, keyed by its id.
+    body="\n\n".join(f"=== DOCUMENT {i} ===\n{t}" for i, t in docs)
+    return f"""You rename scanned documents by extracting filename metadata.
+
+Text from {len(docs)} separate scanned documents, each starting with a "=== DOCUMENT <id> ===" line:
+{body}
+
+Return ONLY a valid JSON array (no markdown, no extra text) with one object per document, each with:
+- id: the document's id from its "=== DOCUMENT <id> ===" line
+- date: best single date for the filename in YYYY-MM-DD (prefer date of service if this doc is about a service/appointment/delivery; otherwise prefer the document/issue date). null if unknown.
+- date_basis: "service" | "document" | "unknown"
+- provider: short issuer/vendor/provider/organization name (e.g., bank, utility, clinic, school). null if unknown.
+- document_type: short type like "Statement", "Invoice", "Receipt", "Bill", "Report", "Letter", "Notice", "Contract", "Policy", "Form", "Tax Document", or similar. null if unknown.
+- title: short human-readable title (max ~8 words). If the document already has a clear title, use it; otherwise infer one from content. null if unknown.
+- author: short author (person or organization) if clear from the document. null if unknown.
+- subject: short subject line if clear from the document. null if unknown.
+- keywords: array of strings (max {keywords_count} items). Each keyword should be a short topic phrase. [] if none.
+- confidence: number 0 to 1
+Treat every document on its own; never mix information between documents.
+"""
+
+_MONTHS=r"(?:jan|feb|mar|apr|may|jun|jul|aug|sep|sept|oct|nov|dec)[a-z]*\.?"
+_DATE_RX=re.compile(
+    r"\b\d{4}-\d{1,2}-\d{1,2}\b|\b\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}\b|"
+    rf"\b{_MONTHS}\s+\d{{1,2}}(?:st|nd|rd|th)?,?\s+\d{{4}}\b|\b\d{{1,2}}(?:st|nd|rd|th)?\s+{_MONTHS}\s+\d{{4}}\b|\b{_MONTHS}\s+\d{{4}}\b",
+    re.I)
+_DATE_LABEL_RX=re.compile(r"\b(date|dated|issued|as of|statement date|invoice date|date of service|dos|service date|period|billing)\b", re.I)
+_DOCTYPE_CUE_RX=re.compile(r"\b(invoice|statement|receipt|bill|report|letter|notice|contract|agreement|policy|form|summary|renewal|tax|1099|w-2|explanation of benefits)\b", re.I)
+_TOTAL_RX=re.compile(r"\b(total|amount due|balance|due date|paid|payment|amount)\b", re.I)
+_ORG_RX=re.compile(r"\b(inc|llc|ltd|corp|co|company|bank|credit union|university|school|hospital|clinic|medical|insurance|services?|group|utilities|energy|electric|water|gas)\b\.?", re.I)
+COMPACT_MODE=os.getenv("COMPACT_MODE","legacy").strip().lower()
+COMPACT_TARGET_CHARS=int(os.getenv("COMPACT_TARGET_CHARS","1500"))
+_HEADER_LINES=15
+
+def _compact_text_legacy(text, max_chars):
     t=(text or "").strip()
     if len(t) <= max_chars: return t
     lines=[ln.strip() for ln in t.splitlines() if ln.strip()]
     if not lines: return t[:max_chars]
-    pats=[
-        r"\b\d{1,2}/\d{1,2}/\d{2,4}\b",
-        r"\b\d{4}-\d{2}-\d{2}\b",
-        r"\b(jan|feb|mar|apr|may|jun|jul|aug|sep|sept|oct|nov|dec)[a-z]*\b",
-        r"\b(invoice|statement|receipt|bill|balance|amount|total|due|paid|payment|account|acct|order|purchase)\b",
-        r"\b(service|date of service|dos|appointment|visit|delivered|shipped)\b",
-        r"\b(policy|contract|agreement|notice|letter|form|report|summary|renewal)\b",
-        r"\b(tax|irs|1099|w-2|utility|electric|gas|water|internet|insurance|mortgage|bank|credit)\b",
-    ]
-    rx=re.compile("|".join(pats), re.I)
-    picked=[ln for ln in lines if rx.search(ln)]
+    picked=[ln for ln in lines if _KEYWORD_RX.search(ln)]
     s="\n".join(picked)
     if len(s) >= max_chars: return s[:max_chars]
     head="\n".join(lines[:250])
@@ -248,6 +1775,86 @@ def _compact_text(text, max_chars):
     combo=(s+"\n\n"+head+"\n\n"+tail).strip()
     return combo[:max_chars]
 
+def _score_line(ln, page, idx, n_pages):
+    # Higher = more likely to carry one of the fields _unknown_count checks.
+    score=0.0
+    header=(page == 0 and idx < _HEADER_LINES)
+    last_page=(n_pages > 1 and page == n_pages-1)
+    if header: score+=3.0-idx*0.1
+    if _DATE_RX.search(ln):
+        score+=3.0+(1.0 if _DATE_LABEL_RX.search(ln) else 0.0)+(0.5 if last_page else 0.0)
+    if _DOCTYPE_CUE_RX.search(ln):
+        score+=2.5+(1.0 if header else 0.0)
+    if _TOTAL_RX.search(ln):
+        score+=1.0+(0.5 if last_page else 0.0)
+    if page == 0 and idx < 20 and _ORG_RX.search(ln):
+        score+=1.5
+    if len(ln) > 160: score-=1.0
+    alnum=sum(ch.isalnum() for ch in ln)
+    if alnum < 0.4*len(ln): score-=1.5
+    return score
+
+def _compact_text_ranked(text, max_chars, target_chars=None):
+    # Page-aware excerpt: page-1 header (provider/title), the best dated lines and
+    # document-type cues, then the highest-scoring remaining lines up to target_chars.
+    target=min(max_chars, COMPACT_TARGET_CHARS if target_chars is None else int(target_chars))
+    t=(text or "").strip()
+    if len(t) <= target: return t
+    pages=t.split("\f")
+    n_pages=len(pages)
+    cands=[]
+    seen=set()
+    for p, page_text in enumerate(pages):
+        idx=0
+        for raw in page_text.splitlines():
+            ln=re.sub(r"\s{2,}", " ", raw).strip()
+            if len(ln) < 2: continue
+            key=ln.lower()
+            if key in seen:
+                idx+=1
+                continue
+            seen.add(key)
+            cands.append({"page":p, "idx":idx, "line":ln, "score":_score_line(ln, p, idx, n_pages)})
+            idx+=1
+    if not cands: return t[:max_chars]
+
+    chosen={}
+    used=0
+
+    def _take(c):
+        nonlocal used
+        k=(c["page"], c["idx"])
+        if k in chosen or used+len(c["line"])+1 > max_chars: return False
+        chosen[k]=c
+        used+=len(c["line"])+1
+        return True
+
+    header=[c for c in cands if c["page"] == 0 and c["idx"] < _HEADER_LINES][:8]
+    for c in header: _take(c)
+    dated=sorted([c for c in cands if _DATE_RX.search(c["line"])], key=lambda c: -c["score"])
+    for c in dated[:4]: _take(c)
+    typed=sorted([c for c in cands if _DOCTYPE_CUE_RX.search(c["line"])], key=lambda c: -c["score"])
+    for c in typed[:3]: _take(c)
+    for c in sorted(cands, key=lambda c: -c["score"]):
+        if used >= target: break
+        if c["score"] < 1.0: break
+        _take(c)
+
+    out=[]
+    cur_page=None
+    for k in sorted(chosen):
+        c=chosen[k]
+        if n_pages > 1 and c["page"] != cur_page:
+            out.append(f"[page {c['page']+1}]")
+            cur_page=c["page"]
+        out.append(c["line"])
+    return "\n".join(out)[:max_chars]
+
+def _compact_text(text, max_chars):
+    if COMPACT_MODE == "ranked":
+        return _compact_text_ranked(text, max_chars)
+    return _compact_text_legacy(text, max_chars)
+
 def _normalize_date(s):
     if not s: return None
     s=str(s).strip()
@@ -256,29 +1863,36 @@ def _normalize_date(s):
         return s
     except: return None
 
+# Canonical document types and their cue words, in priority order; shared by _normalize_doc_type,
+# the heuristic fallback and the rules engine.
+_DOC_TYPES=(
+    ("Invoice", ("invoice", "inv")),
+    ("Statement", ("statement",)),
+    ("Receipt", ("receipt",)),
+    ("Bill", ("bill",)),
+    ("Report", ("report",)),
+    ("Letter", ("letter",)),
+    ("Notice", ("notice",)),
+    ("Contract", ("contract",)),
+    ("Agreement", ("agreement",)),
+    ("Policy", ("policy",)),
+    ("Form", ("form",)),
+    ("Summary", ("summary",)),
+    ("Tax Document", ("tax",)),
+)
+_DOC_TYPE_RX=[(name, re.compile(r"\b(?:"+"|".join(re.escape(k) for k in cues)+r")\b", re.I)) for name, cues in _DOC_TYPES]
+
+def _doc_type_in(s):
+    for name, rx in _DOC_TYPE_RX:
+        if rx.search(s): return name
+    return None
+
 def _normalize_doc_type(s):
     if not s: return None
     s=re.sub(r"\s{2,}"," ",str(s)).strip()
     s=re.sub(r"[^A-Za-z0-9 &/+-]","",s).strip()
     if not s: return None
-    low=s.lower()
-    m={
-        "invoice":"Invoice","inv":"Invoice",
-        "statement":"Statement",
-        "receipt":"Receipt",
-        "bill":"Bill",
-        "report":"Report",
-        "letter":"Letter",
-        "notice":"Notice",
-        "contract":"Contract","agreement":"Agreement",
-        "policy":"Policy",
-        "form":"Form",
-        "summary":"Summary",
-        "tax":"Tax Document",
-    }
-    for k,v in m.items():
-        if re.search(rf"\b{re.escape(k)}\b", low): return v
-    return " ".join(w.capitalize() for w in s.split())[:40]
+    return _doc_type_in(s) or " ".join(w.capitalize() for w in s.split())[:40]
 
 def _unknown_count(info):
     info=info or {}
@@ -317,56 +1931,756 @@ def _safe_filename(s, max_len=80):
     s=s.strip(" .-_")
     return (s[:max_len] or "")
 
-def _unique_path(path):
-    if not os.path.exists(path): return path
+def _unique_path(path, reserved=None):
+    reserved=reserved if reserved is not None else ()
+    if not os.path.exists(path) and path not in reserved: return path
     root, ext=os.path.splitext(path)
     for i in range(2, 200):
         p=f"{root} ({i}){ext}"
-        if not os.path.exists(p): return p
+        if not os.path.exists(p) and p not in reserved: return p
     return f"{root} ({os.getpid()}){ext}"
 
+# Destinations already handed out in this run, so concurrent workers never pick the same name.
+_RESERVED_PATHS=set()
+_RESERVED_LOCK=threading.Lock()
+
+def _reserve_unique_path(path):
+    with _RESERVED_LOCK:
+        p=_unique_path(path, reserved=_RESERVED_PATHS)
+        _RESERVED_PATHS.add(p)
+        return p
+
 def _heuristic_extract(text):
-    lines=[ln.strip() for ln in (text or "").splitlines() if ln.strip()]
-    top=lines[:60]
-    date=None
-    for ln in top:
-        m=re.search(r"\b(\d{4}-\d{2}-\d{2})\b", ln)
-        if m: date=m.group(1); break
-    if not date:
-        for ln in top:
-            m=re.search(r"\b(\d{1,2})/(\d{1,2})/(\d{2,4})\b", ln)
-            if not m: continue
-            mm,dd,yy=m.group(1),m.group(2),m.group(3)
-            yy=("20"+yy) if len(yy)==2 else yy
-            try:
-                d=datetime(int(yy),int(mm),int(dd))
-                date=d.strftime("%Y-%m-%d")
-                break
-            except: pass
-    provider=None
-    for ln in top[:15]:
-        if len(ln) >= 4 and not re.search(r"page\s+\d+", ln, re.I):
-            if re.search(r"[A-Za-z]", ln):
-                provider=ln
-                break
-    blob="\n".join(top).lower()
-    dt=None
-    for k,v in [("invoice","Invoice"),("statement","Statement"),("receipt","Receipt"),("bill","Bill"),("report","Report"),
-                ("contract","Contract"),("agreement","Agreement"),("policy","Policy"),("notice","Notice"),("letter","Letter"),("form","Form")]:
-        if k in blob: dt=v; break
-    title=None
-    for ln in top[:20]:
-        if re.search(r"\b(invoice|statement|receipt|bill|report|contract|agreement|policy|notice|letter|form)\b", ln, re.I):
-            title=ln
-            break
-    return {"date":date,"date_basis":"unknown","provider":provider,"document_type":dt,"title":title,"confidence":0.25}
+    # Fallback after the LLM failed: the rules engine's best guess for every field, however unsure.
+    info, _scores=_rules_extract(text)
+    info.pop("source", None)
+    return info
 
-def extract_information(pdf_input: str, lm_timeout: int=LLM_TIMEOUT, lm_retries: int=LLM_MAX_RETRIES, allow_repair: bool=True, keywords_count: int=5) -> typing.Tuple[typing.Optional[typing.Dict[str, typing.Any]], str]:
-    repair_ctx=None
-    work_pdf=pdf_input
+# --- Rules engine: a deterministic pass over the text layer. Every field _unknown_count checks gets a
+# score in [0, 1]; when all of them reach RULES_MIN_CONFIDENCE the document is finalized without the LLM.
+RULES_ENABLED=os.getenv("RULES_ENGINE","1").strip().lower() in ("1","true","yes","y","on")
+RULES_MIN_CONFIDENCE=float(os.getenv("RULES_MIN_CONFIDENCE","0.8"))
+RULES_PROVIDERS_FILE=os.getenv("RULES_PROVIDERS_FILE","")
+_RULES_LOCK=threading.Lock()
+_RULES_STATS={"checked":0, "final":0}
+_PROVIDERS=None            # learned lexicon {lowercase name: {"name", "seen"}}, persisted next to models.json
+_PROVIDERS_FILE_CACHE=None # (path, mtime_ns, [(name, [aliases])])
+_PROVIDER_MIN_SEEN=2       # LLM sightings (with the name in the page-1 header) before a learned provider is trusted
+_RULES_HEADER_LINES=15
+_PROVIDER_RX={}
 
-    def _postprocess_llm_info(info):
-        if not isinstance(info, dict):
+_MONTH_WORDS={w:i for i, names in enumerate((("jan", "january"), ("feb", "february"), ("mar", "march"), ("apr", "april"), ("may",),
+              ("jun", "june"), ("jul", "july"), ("aug", "august"), ("sep", "sept", "september"), ("oct", "october"),
+              ("nov", "november"), ("dec", "december")), 1) for w in names}
+_RULE_DATE_RX=re.compile(
+    r"(?P<iso>\b(?P<iy>\d{4})[-/.](?P<im>\d{1,2})[-/.](?P<id>\d{1,2})\b)"
+    r"|(?P<num>\b(?P<na>\d{1,2})(?P<sep>[/.-])(?P<nb>\d{1,2})(?P=sep)(?P<ny>\d{4}|\d{2})\b)"
+    r"|(?P<mdy>\b(?P<mm>[a-z]{3,9})\.?\s+(?P<md>\d{1,2})(?:st|nd|rd|th)?,?\s+(?P<my>\d{4})\b)"
+    r"|(?P<dmy>\b(?P<dd>\d{1,2})(?:st|nd|rd|th)?\s+(?P<dm>[a-z]{3,9})\.?,?\s+(?P<dy>\d{4})\b)", re.I)
+_RULE_DATE_LABEL_RX=re.compile(r"\b(statement date|invoice date|bill(?:ing)? date|issue date|date issued|issued(?: on)?|dated|as of|document date|"
+                               r"letter date|notice date|date of service|service date|dos|date)\b", re.I)
+_RULE_DATE_OTHER_RX=re.compile(r"\b(due|pay by|payment due|expir\w*|birth|dob|born|since|opened|from|through|thru|until|period|effective|valid)\b", re.I)
+_RULE_SERVICE_RX=re.compile(r"\b(date of service|service date|dos|visit|appointment|delivered)\b", re.I)
+
+def _rules_pages(text):
+    # [[line, ...] per page], blank lines and whitespace runs dropped.
+    return [[re.sub(r"\s{2,}", " ", ln).strip() for ln in page.splitlines() if ln.strip()] for page in (text or "").split("\f")]
+
+def _rules_date_value(m):
+    # (YYYY-MM-DD, format score, ambiguous) for one _RULE_DATE_RX match, or None. Ambiguous: a numeric
+    # date whose day and month could be swapped (03/04/2024), which labels and position cannot settle.
+    ambiguous=False
+    try:
+        if m["iso"]:
+            y, mo, d, base=int(m["iy"]), int(m["im"]), int(m["id"]), 0.6
+        elif m["num"]:
+            a, b, y=int(m["na"]), int(m["nb"]), int(m["ny"])
+            y=y+2000 if y < 100 else y
+            if m["sep"] == "." or a > 12: mo, d=b, a    # 31.01.2024 / 31/01/2024
+            else: mo, d=a, b                            # US month first, as the heuristics always assumed
+            ambiguous=not (a > 12 or b > 12 or a == b)
+            base=0.4 if ambiguous else 0.5
+        else:
+            word, d, y=(m["mm"], m["md"], m["my"]) if m["mdy"] else (m["dm"], m["dd"], m["dy"])
+            mo=_MONTH_WORDS.get(word.lower())
+            if mo is None: return None
+            d, y, base=int(d), int(y), 0.6
+        dt=datetime(y, mo, d)
+    except (TypeError, ValueError):
+        return None
+    if not (1990 <= dt.year <= datetime.now().year+1): return None
+    return dt.strftime("%Y-%m-%d"), base, ambiguous
+
+def _rules_date(pages):
+    cands={}
+    for p, lines in enumerate(pages):
+        for i, ln in enumerate(lines):
+            for m in _RULE_DATE_RX.finditer(ln):
+                v=_rules_date_value(m)
+                if not v: continue
+                day, score, ambiguous=v
+                # A label on this line before the date, or alone on the line above it.
+                ctx=ln[:m.start()] or (lines[i-1] if i else "")
+                if _RULE_DATE_OTHER_RX.search(ctx) and not re.search(r"\b(statement|invoice|bill|issue|service) date\b", ctx, re.I):
+                    score-=0.4
+                elif _RULE_DATE_LABEL_RX.search(ctx):
+                    score+=0.35
+                if p == 0 and i < _RULES_HEADER_LINES: score+=0.1
+                if day > datetime.now().strftime("%Y-%m-%d"): score-=0.3
+                c=cands.setdefault(day, {"score":0.0, "n":0, "service":False, "ambiguous":True})
+                c["n"]+=1
+                c["score"]=max(c["score"], score)
+                c["ambiguous"]=c["ambiguous"] and ambiguous
+                c["service"]=c["service"] or bool(_RULE_SERVICE_RX.search(ctx))
+    if not cands: return None, "unknown", 0.0
+    for c in cands.values():
+        c["score"]=min(1.0, c["score"]+0.05*min(2, c["n"]-1))
+        if c["ambiguous"]:  # DD/MM vs MM/DD is a guess: never certain enough to skip the LLM
+            c["score"]=min(c["score"], 0.6, RULES_MIN_CONFIDENCE-0.01)
+    ranked=sorted(cands.items(), key=lambda kv: -kv[1]["score"])
+    day, best=ranked[0]
+    score=best["score"]
+    if len(ranked) > 1 and ranked[1][1]["score"] >= score-0.1:
+        score=min(score, 0.6)  # two different dates look equally likely
+    return day, ("service" if best["service"] else "document"), max(0.0, min(1.0, score))
+
+def _providers_path():
+    return os.path.join(CACHE_DIR, "providers.json")
+
+def _learned_providers():
+    global _PROVIDERS
+    with _RULES_LOCK:
+        if _PROVIDERS is None:
+            _PROVIDERS={}
+            if CACHE_ENABLED:
+                try:
+                    with open(_providers_path(), "r", encoding="utf-8") as f:
+                        d=json.load(f)
+                    if isinstance(d, dict): _PROVIDERS=d
+                except (OSError, ValueError):
+                    pass
+        return dict(_PROVIDERS)
+
+def _learn_provider(name, text):
+    # Remember an LLM-extracted provider that literally appears in the page-1 header (letterhead) of
+    # the text, for the rules engine. A name found only further down may be a payee or merchant line.
+    name=re.sub(r"\s{2,}", " ", str(name or "")).strip()
+    pages=_rules_pages(text)
+    header="\n".join(pages[0][:_RULES_HEADER_LINES]) if pages else ""
+    if len(name) < 3 or not re.search(rf"(?<!\w){re.escape(name)}(?!\w)", header, re.I): return
+    _learned_providers()
+    with _RULES_LOCK:
+        e=_PROVIDERS.setdefault(name.lower(), {"name":name, "seen":0})
+        e["seen"]+=1
+        if not CACHE_ENABLED: return
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            fd, tmp=tempfile.mkstemp(prefix=".providers_", suffix=".json", dir=CACHE_DIR)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(_PROVIDERS, f, indent=2, sort_keys=True)
+            os.replace(tmp, _providers_path())
+        except OSError:
+            pass
+
+def _provider_lexicon():
+    # [(name, [aliases], learned)]: RULES_PROVIDERS_FILE lines ("Name" or "Name = alias, alias") plus trusted learned names.
+    global _PROVIDERS_FILE_CACHE
+    out=[]
+    if RULES_PROVIDERS_FILE:
+        try:
+            mt=os.stat(RULES_PROVIDERS_FILE).st_mtime_ns
+            if _PROVIDERS_FILE_CACHE is None or _PROVIDERS_FILE_CACHE[:2] != (RULES_PROVIDERS_FILE, mt):
+                entries=[]
+                with open(RULES_PROVIDERS_FILE, "r", encoding="utf-8") as f:
+                    for ln in f:
+                        ln=ln.split("#", 1)[0].strip()
+                        if not ln: continue
+                        name, _, aliases=ln.partition("=")
+                        name=name.strip()
+                        entries.append((name, [name]+[a.strip() for a in aliases.split(",") if a.strip()], False))
+                _PROVIDERS_FILE_CACHE=(RULES_PROVIDERS_FILE, mt, entries)
+            out+=_PROVIDERS_FILE_CACHE[2]
+        except OSError:
+            pass
+    known={n.lower() for n, _a, _l in out}
+    out+=[(e["name"], [e["name"]], True) for k, e in _learned_providers().items() if e.get("seen", 0) >= _PROVIDER_MIN_SEEN and k not in known]
+    return out
+
+def _rules_provider(pages):
+    first=pages[0] if pages else []
+    hits=[]
+    for name, aliases, learned in _provider_lexicon():
+        rx=_PROVIDER_RX.get((name, tuple(aliases)))
+        if rx is None:
+            rx=_PROVIDER_RX[(name, tuple(aliases))]=re.compile(r"(?<!\w)(?:"+"|".join(re.escape(a) for a in aliases)+r")(?!\w)", re.I)
+        # Learned names only count in the letterhead, where they were learned.
+        for p, lines in enumerate(pages[:1] if learned else pages):
+            if learned: lines=lines[:_RULES_HEADER_LINES]
+            i=next((i for i, ln in enumerate(lines) if rx.search(ln)), None)
+            if i is not None:
+                hits.append(((0.9 if i < _RULES_HEADER_LINES else 0.75) if p == 0 else 0.6, -p, -i, name))
+                break
+    if hits:
+        hits.sort(reverse=True)
+        score, _p, _i, name=hits[0]
+        if any(h[3] != name and h[0] == 0.9 for h in hits[1:]): score=min(score, 0.6)  # two issuers in the header
+        return name, score
+    for ln in first[:_RULES_HEADER_LINES]:
+        if _ORG_RX.search(ln) and len(ln.split()) <= 6 and not _RULE_DATE_RX.search(ln):
+            return ln.strip(" ,.:"), 0.6
+    for ln in first[:_RULES_HEADER_LINES]:
+        if len(ln) >= 4 and re.search(r"[A-Za-z]", ln) and not re.search(r"page\s+\d+", ln, re.I):
+            return ln, 0.3
+    return None, 0.0
+
+def _rules_doc_type(pages):
+    # (type, score, title line): a short header line naming the type is the strongest cue.
+    first=pages[0] if pages else []
+    titles=[]
+    for ln in first[:_RULES_HEADER_LINES]:
+        dt=_doc_type_in(ln)
+        if dt and len(ln.split()) <= 5 and not _RULE_DATE_RX.search(ln):
+            titles.append((dt, ln))
+    if titles:
+        dt, ln=titles[0]
+        return dt, (0.6 if any(t[0] != dt for t in titles[1:]) else 0.9), ln
+    dt=_doc_type_in("\n".join(first[:_RULES_HEADER_LINES]))
+    if dt: return dt, 0.7, None
+    dt=_doc_type_in("\n".join(ln for lines in pages for ln in lines))
+    return dt, (0.5 if dt else 0.0), None
+
+def _rules_extract(text):
+    # (info, {field: score}); info["confidence"] is the weakest field's score.
+    pages=_rules_pages(text)
+    date, basis, s_date=_rules_date(pages)
+    provider, s_prov=_rules_provider(pages)
+    dt, s_type, title_line=_rules_doc_type(pages)
+    if title_line and len(title_line.split()) >= 2:
+        title=title_line.title() if title_line.isupper() else title_line
+        s_title=s_type
+    elif dt and date:
+        title=f"{dt} {datetime.strptime(date, '%Y-%m-%d').strftime('%B %Y')}"
+        s_title=min(s_type, s_date)
+    else:
+        title, s_title=None, 0.0
+    scores={"date":s_date, "provider":s_prov, "document_type":s_type, "title":s_title}
+    info={"date":date, "date_basis":basis, "provider":provider, "document_type":dt, "title":title, "keywords":[],
+          "confidence":round(min(scores.values()), 2), "source":"rules"}
+    return info, scores
+
+def _rules_note(final):
+    with _RULES_LOCK:
+        _RULES_STATS["checked"]+=1
+        if final: _RULES_STATS["final"]+=1
+
+def _rules_stats_line():
+    with _RULES_LOCK:
+        st=dict(_RULES_STATS)
+    if not st["checked"]: return None
+    return f"Rules engine: {st['final']} of {st['checked']} document(s) finalized without the LLM ({st['final']} LLM call(s) avoided)"
+
+# --- Template index: documents with the same layout (next month's statement from the same bank) share
+# a 64-bit SimHash of their page-1 header. The index maps it to the provider, type and title pattern
+# the LLM gave earlier copies; a match only needs the date. Four 16-bit bands are indexed columns, so
+# any hash within 3 bits of a stored one shares at least one band and is found by one indexed query.
+TEMPLATE_INDEX=_env_first(("SCANFILE_TEMPLATES",), os.path.join(CACHE_DIR, "templates.sqlite3"))
+TEMPLATES_ENABLED=TEMPLATE_INDEX.strip().lower() not in ("0","false","no","n","off")
+TEMPLATE_MAX_DISTANCE=min(3, _env_int_first(("TEMPLATE_MAX_DISTANCE",), 3))  # bits; more than 3 would need more bands
+TEMPLATE_MIN_SEEN=_env_int_first(("TEMPLATE_MIN_SEEN",), 2)                  # agreeing LLM results before a template is reused
+_TEMPLATE_HEADER_LINES=25
+_TEMPLATE_MIN_SHINGLES=8
+_TEMPLATE_DATE_CHARS=1200
+_TEMPLATE_LOCK=threading.Lock()
+_TEMPLATE_DB=None
+_TEMPLATE_STATS={"checked":0, "matched":0, "local_date":0}
+
+def _template_fingerprint(text):
+    # SimHash over word 3-grams of the page-1 header; digits and month names are folded so dates and amounts don't count.
+    first=(text or "").split("\f", 1)[0]
+    shingles=set()
+    for ln in [ln for ln in first.splitlines() if ln.strip()][:_TEMPLATE_HEADER_LINES]:
+        w=["#" if x in _MONTH_WORDS else x for x in re.findall(r"[^\W\d_]+|#", re.sub(r"\d+", "#", ln.lower()))]
+        if len(w) < 3:
+            if w: shingles.add(" ".join(w))
+            continue
+        shingles.update(" ".join(w[i:i+3]) for i in range(len(w)-2))
+    if len(shingles) < _TEMPLATE_MIN_SHINGLES: return None
+    return _simhash(shingles)
+
+def _simhash(shingles):
+    hs=[int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big") for s in shingles]
+    half=len(hs)/2
+    out=0
+    for i in range(64):
+        if sum((h >> i) & 1 for h in hs) > half: out|=1 << i
+    return out
+
+def _hash_bands(h):
+    # Four 16-bit bands: hashes at most 3 bits apart share at least one.
+    return [(h >> (16*i)) & 0xFFFF for i in range(4)]
+
+def _signed64(h):
+    return h-(1 << 64) if h >= 1 << 63 else h
+
+_TITLE_DATE_FORMS=(("{ymd}", "%Y-%m-%d"), ("{ym}", "%Y-%m"), ("{month}", "%B"), ("{mon}", "%b"), ("{year}", "%Y"))
+
+def _title_pattern(title, date):
+    # The document date's parts in a title become placeholders, so the pattern fits next month's copy.
+    try:
+        d=datetime.strptime(str(date), "%Y-%m-%d")
+    except ValueError:
+        return title
+    out=str(title or "")
+    for ph, fmt in _TITLE_DATE_FORMS:
+        out=re.sub(rf"(?<![\w-]){re.escape(d.strftime(fmt))}(?![\w-])", ph, out, flags=re.I)
+    return out
+
+def _title_from_pattern(pattern, date):
+    d=datetime.strptime(date, "%Y-%m-%d")
+    out=str(pattern or "")
+    for ph, fmt in _TITLE_DATE_FORMS:
+        out=out.replace(ph, d.strftime(fmt))
+    return out
+
+class _TemplateIndex:
+    def __init__(self, path):
+        import sqlite3
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path=path
+        self._lock=threading.Lock()
+        self._db=sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS templates(
+            id INTEGER PRIMARY KEY, simhash INTEGER NOT NULL, b0 INTEGER NOT NULL, b1 INTEGER NOT NULL, b2 INTEGER NOT NULL, b3 INTEGER NOT NULL,
+            provider TEXT, document_type TEXT, title TEXT, seen INTEGER NOT NULL, hits INTEGER NOT NULL DEFAULT 0, updated REAL NOT NULL)""")
+        # Descriptive fields of the latest agreeing result (keywords as a JSON list, subject as a pattern like title).
+        cols={r[1] for r in self._db.execute("PRAGMA table_info(templates)")}
+        for col in ("keywords", "subject", "author"):
+            if col not in cols: self._db.execute(f"ALTER TABLE templates ADD COLUMN {col} TEXT")
+        for i in range(4):
+            self._db.execute(f"CREATE INDEX IF NOT EXISTS templates_b{i} ON templates(b{i})")
+
+    def nearest(self, h, max_distance=TEMPLATE_MAX_DISTANCE):
+        # {"id", "distance", "provider", "document_type", "title", "seen", "keywords", "subject", "author"} of the closest template, or None.
+        with self._lock:
+            rows=self._db.execute("""SELECT id, simhash, provider, document_type, title, seen, keywords, subject, author FROM templates
+                WHERE b0=? OR b1=? OR b2=? OR b3=?""", _hash_bands(h)).fetchall()
+        best=None
+        for r in rows:
+            dist=((r[1] & ((1 << 64)-1)) ^ h).bit_count()
+            if dist <= max_distance and (best is None or (dist, -r[5]) < (best["distance"], -best["seen"])):
+                best={"id":r[0], "distance":dist, "provider":r[2], "document_type":r[3], "title":r[4], "seen":r[5],
+                      "keywords":json.loads(r[6]) if r[6] else [], "subject":r[7], "author":r[8]}
+        return best
+
+    def record(self, h, provider, document_type, title, keywords=None, subject=None, author=None):
+        # An agreeing result strengthens the nearest template; a different one replaces its fields. Either way the
+        # descriptive fields are the latest result's.
+        hit=self.nearest(h)
+        fields=(provider, document_type, title)
+        extra=(json.dumps(list(keywords or []), ensure_ascii=False), subject, author)
+        with self._lock:
+            if hit is None:
+                self._db.execute("""INSERT INTO templates(simhash, b0, b1, b2, b3, provider, document_type, title, keywords, subject, author, seen, updated)
+                    VALUES(?,?,?,?,?,?,?,?,?,?,?,1,?)""", (_signed64(h), *_hash_bands(h), *fields, *extra, time.time()))
+            elif [str(x or "").lower() for x in fields] == [str(hit[k] or "").lower() for k in ("provider", "document_type", "title")]:
+                self._db.execute("UPDATE templates SET seen=seen+1, keywords=?, subject=?, author=?, updated=? WHERE id=?", (*extra, time.time(), hit["id"]))
+            else:
+                self._db.execute("UPDATE templates SET provider=?, document_type=?, title=?, keywords=?, subject=?, author=?, seen=1, updated=? WHERE id=?",
+                                 (*fields, *extra, time.time(), hit["id"]))
+
+    def note_hit(self, tid):
+        with self._lock:
+            self._db.execute("UPDATE templates SET hits=hits+1, updated=? WHERE id=?", (time.time(), tid))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+def _template_index(create=False):
+    # Opened on first use; lookups never create the file.
+    global _TEMPLATE_DB
+    if not (TEMPLATES_ENABLED and CACHE_ENABLED): return None
+    with _TEMPLATE_LOCK:
+        if _TEMPLATE_DB is None and (create or os.path.exists(TEMPLATE_INDEX)):
+            try:
+                _TEMPLATE_DB=_TemplateIndex(TEMPLATE_INDEX)
+            except Exception as e:
+                _progress(f"  template index unavailable: {type(e).__name__}: {e}")
+                return None
+        return _TEMPLATE_DB
+
+def _template_record(info, text):
+    if not _normalize_date(info.get("date")) or not info.get("provider") or not info.get("document_type"): return
+    h=_template_fingerprint(text)
+    db=_template_index(create=True) if h is not None else None
+    if db is None: return
+    # Keywords and subject follow the title's date placeholders; keywords still holding digits (amounts, account
+    # numbers) belong to this one document and are dropped.
+    keywords=[_title_pattern(str(k), info["date"]) for k in (info.get("keywords") or []) if str(k).strip()]
+    keywords=[k for k in keywords if not re.search(r"\d", k)]
+    subject=_title_pattern(info["subject"], info["date"]) if info.get("subject") else None
+    try:
+        db.record(h, str(info["provider"]).strip(), str(info["document_type"]).strip(), _title_pattern(info.get("title"), info["date"]),
+                  keywords=keywords, subject=subject, author=info.get("author"))
+    except Exception as e:
+        _progress(f"  template index write failed: {type(e).__name__}: {e}")
+
+def _learn_from_result(info, text):
+    # What an LLM result teaches the local passes: its provider for the rules engine, its layout for the template index.
+    _learn_provider(info.get("provider"), text)
+    _template_record(info, text)
+
+def _prompt_for_date(t):
+    return f"""Text from a scanned document:
+{t}
+
+Return ONLY valid JSON (no markdown, no extra text) with:
+- date: best single date for the filename in YYYY-MM-DD (prefer date of service if this doc is about a service/appointment/delivery; otherwise prefer the document/issue date). null if unknown.
+- date_basis: "service" | "document" | "unknown"
+"""
+
+def _template_extract(text, lm_timeout=LLM_TIMEOUT, lm_retries=LLM_MAX_RETRIES):
+    # Info for a document whose layout is a confirmed template: its fields plus a locally found or date-only-prompt date.
+    h=_template_fingerprint(text)
+    db=_template_index() if h is not None else None
+    if db is None: return None
+    with _span("template") as sp:
+        try:
+            hit=db.nearest(h)
+        except Exception as e:
+            sp["outcome"]="error"
+            _progress(f"  template lookup failed: {type(e).__name__}: {e}")
+            return None
+        if hit is None or hit["seen"] < TEMPLATE_MIN_SEEN:
+            sp["outcome"]="miss" if hit is None else "unconfirmed"
+            _template_note(False)
+            return None
+        sp.update(distance=hit["distance"], seen=hit["seen"])
+        _progress(f"[3/4] Known layout: {hit['provider']} / {hit['document_type']} (distance {hit['distance']}, seen {hit['seen']}x)")
+        day, basis, score=_rules_date(_rules_pages(text))
+        local=day is not None and score >= RULES_MIN_CONFIDENCE
+        if not local:
+            prompt=_prompt_for_date(_compact_text(text, _TEMPLATE_DATE_CHARS))
+            _progress(f"  calling LLM (date only) model={LLM_MODEL}")
+            with _span("llm", kind="date", bytes=len(prompt.encode("utf-8"))) as lsp:
+                out, err=_call_llm([
+                    {"role":"system","content":_SYSTEM_PROMPT},
+                    {"role":"user","content":prompt}
+                ], max_tokens=60, timeout=lm_timeout, retries=lm_retries)
+                data=_extract_json_loose(out) if out else None
+                lsp["outcome"]="ok" if data else ("bad_json" if out else "error")
+            day=_normalize_date((data or {}).get("date"))
+            basis=(data or {}).get("date_basis") or "unknown"
+            score=0.8
+            if not day:
+                sp["outcome"]="no_date"
+                _template_note(False)
+                _progress("  no date from the date-only prompt; running the full extraction")
+                return None
+        sp["outcome"]="local" if local else "date_prompt"
+    _template_note(True, local)
+    try:
+        db.note_hit(hit["id"])
+    except Exception:
+        pass
+    info={"date":day, "date_basis":basis, "provider":hit["provider"], "document_type":hit["document_type"],
+          "title":_title_from_pattern(hit["title"], day) or hit["document_type"],
+          "keywords":[_title_from_pattern(k, day) for k in hit["keywords"]], "confidence":round(score, 2), "source":"template"}
+    if hit["subject"]: info["subject"]=_title_from_pattern(hit["subject"], day)
+    if hit["author"]: info["author"]=hit["author"]
+    return info
+
+def _template_note(matched, local_date=False):
+    with _TEMPLATE_LOCK:
+        _TEMPLATE_STATS["checked"]+=1
+        if matched: _TEMPLATE_STATS["matched"]+=1
+        if local_date: _TEMPLATE_STATS["local_date"]+=1
+
+def _template_stats_line():
+    with _TEMPLATE_LOCK:
+        st=dict(_TEMPLATE_STATS)
+    if not st["checked"]: return None
+    return (f"Templates: {st['matched']} of {st['checked']} document(s) matched a known layout "
+            f"({st['local_date']} with no LLM call, {st['matched']-st['local_date']} with a date-only prompt)")
+
+# --- Batched text requests (--lm-batch N): short documents' compacted text is packed into one chat
+# completion answered with a JSON array keyed by document id, so fixed per-request overhead is paid
+# once per batch. Extract workers hand their excerpt to the batcher and wait; the first of them
+# leads, lingering up to LLM_BATCH_LINGER for company, and sends as many excerpts as fit the context
+# window. A document whose element is missing or malformed gets None back and takes the usual
+# single-document path; a batch of one is never sent.
+LLM_BATCH=_env_int_first(("LLM_BATCH",), 0)                            # max documents per request; <2 = off
+LLM_BATCH_DOC_TOKENS=_env_int_first(("LLM_BATCH_DOC_TOKENS",), 600)    # longer excerpts are sent on their own
+LLM_BATCH_LINGER=float(os.getenv("LLM_BATCH_LINGER","0.3"))
+_BATCH_REPLY_TOKENS=300  # max_tokens per document in a batch
+_BATCH_IDS=itertools.count(1)
+_BATCH_LOCK=threading.Lock()
+_BATCH_STATS={"requests":0, "docs":0, "failed":0}
+
+def _json_objects_loose(s):
+    # Every JSON object at the top level of s (array or not), so a truncated array keeps its complete elements.
+    dec=json.JSONDecoder()
+    s=s or ""
+    out=[]
+    i=s.find("{")
+    while i != -1:
+        try:
+            obj, end=dec.raw_decode(s, i)
+        except ValueError:
+            i=s.find("{", i+1)
+            continue
+        if isinstance(obj, dict): out.append(obj)
+        i=s.find("{", end)
+    return out
+
+class _LlmBatcher:
+    def __init__(self, max_docs, linger=LLM_BATCH_LINGER):
+        self.max_docs=max(2, int(max_docs))
+        self.linger=max(0.0, float(linger))
+        self._cv=threading.Condition()
+        self._pending=[]
+        self._leading=False
+
+    def submit(self, text, keywords_count=5, timeout=LLM_TIMEOUT, retries=LLM_MAX_RETRIES):
+        # Parsed info for text from a shared request, or None: send it on its own.
+        entry={"id":next(_BATCH_IDS), "text":text, "kw":keywords_count, "tokens":_estimate_tokens(text), "taken":False, "done":False, "result":None}
+        ctx=_context_window()  # outside the lock: the first call may query /v1/models
+        with self._cv:
+            self._pending.append(entry)
+            self._cv.notify_all()
+            deadline=time.monotonic()+self.linger
+            while not entry["taken"] and self._leading:
+                self._cv.wait()
+            if entry["taken"]:  # in another leader's batch
+                while not entry["done"]:
+                    self._cv.wait()
+                if entry["result"] is not None: _TLS.last_model=entry.get("model")
+                return entry["result"]
+            self._leading=True
+            while len(self._pending) < self.max_docs and (left := deadline-time.monotonic()) > 0:
+                self._cv.wait(left)
+            batch=self._take(entry, ctx)
+            self._leading=False  # the next batch can gather while this one is in flight
+            self._cv.notify_all()
+        try:
+            if len(batch) > 1:
+                self._send(batch, keywords_count, timeout, retries)
+        finally:
+            with self._cv:
+                for e in batch:
+                    e["done"]=True
+                self._cv.notify_all()
+        return entry["result"]
+
+    def _take(self, first, ctx):
+        # first plus the oldest pending entries with the same keywords count that fit the context window.
+        per_doc=_BATCH_REPLY_TOKENS
+        base=_request_tokens(_SYSTEM_PROMPT, _prompt_from_text_batch([], first["kw"]))
+        batch=[first]
+        used=base+first["tokens"]+per_doc
+        for e in self._pending:
+            if len(batch) >= self.max_docs: break
+            if e is first or e["kw"] != first["kw"]: continue
+            cost=e["tokens"]+_estimate_tokens(f"=== DOCUMENT {e['id']} ===")+per_doc
+            if ctx and used+cost > ctx*_CONTEXT_SAFETY: continue
+            batch.append(e)
+            used+=cost
+        for e in batch:
+            self._pending.remove(e)
+            e["taken"]=True
+        return batch
+
+    def _send(self, batch, keywords_count, timeout, retries):
+        prompt=_prompt_from_text_batch([(e["id"], e["text"]) for e in batch], keywords_count=keywords_count)
+        _progress(f"  calling LLM (batch of {len(batch)}) model={LLM_MODEL}")
+        with _span("llm", kind="batch", docs=len(batch), bytes=len(prompt.encode("utf-8"))) as sp:
+            out, err=_call_llm([
+                {"role":"system","content":_SYSTEM_PROMPT},
+                {"role":"user","content":prompt}
+            ], max_tokens=_BATCH_REPLY_TOKENS*len(batch), timeout=timeout*len(batch), retries=retries)
+            by_id={}
+            for obj in _json_objects_loose(out):
+                try:
+                    by_id.setdefault(int(obj.pop("id")), obj)
+                except (KeyError, TypeError, ValueError):
+                    continue
+            ok=0
+            model=getattr(_TLS, "last_model", None) if out else None
+            for e in batch:
+                e["model"]=model
+                data=by_id.get(e["id"])
+                if isinstance(data, dict) and any(data.get(k) for k in ("date", "provider", "document_type", "title")):
+                    e["result"]=data
+                    ok+=1
+            sp.update(outcome="ok" if ok == len(batch) else ("partial" if ok else ("bad_json" if out else ("overflow" if _is_context_overflow(err) else "error"))), ok=ok)
+        if out:
+            _calibrate_from_usage(getattr(_TLS, "last_usage", None), prompt_chars=len(_SYSTEM_PROMPT)+len(prompt))
+        elif _is_context_overflow(err):
+            _learn_from_overflow(err)
+        if ok < len(batch):
+            _progress(f"  batch: {len(batch)-ok} of {len(batch)} document(s) without a usable answer; sending them on their own")
+        with _BATCH_LOCK:
+            _BATCH_STATS["requests"]+=1
+            _BATCH_STATS["docs"]+=len(batch)
+            _BATCH_STATS["failed"]+=len(batch)-ok
+
+# Set by main() when --lm-batch is above 1 and documents run concurrently.
+_LLM_BATCHER=None
+
+def _batch_stats_line():
+    with _BATCH_LOCK:
+        st=dict(_BATCH_STATS)
+    if not st["requests"]: return None
+    return (f"Batched LLM: {st['docs']} document(s) in {st['requests']} request(s), "
+            f"{st['failed']} sent again on their own")
+
+def _file_sha256(path, chunk_size=1<<20):
+    h=hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            b=f.read(chunk_size)
+            if not b: break
+            h.update(b)
+    return h.hexdigest()
+
+def _prompt_version(keywords_count=5):
+    blob="\0".join([_SYSTEM_PROMPT, _prompt_from_text("", keywords_count=keywords_count), _prompt_for_vision(None, keywords_count=keywords_count),
+                   _prompt_for_mixed("", [], keywords_count=keywords_count), _prompt_for_date(""),
+                   _prompt_from_text_batch([], keywords_count=keywords_count)])
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()[:16]
+
+def _extraction_cache_key(pdf_sha256, keywords_count=5, model=None):
+    k={"v":_CACHE_VERSION, "pdf":pdf_sha256, "model":model or LLM_MODEL, "keywords_count":int(keywords_count), "prompt":_prompt_version(keywords_count)}
+    return hashlib.sha256(json.dumps(k, sort_keys=True).encode("utf-8")).hexdigest()
+
+def _cache_models():
+    # Models whose answers may be cached for this run: each endpoint's, then LLM_MODEL.
+    models=[ep.model for ep in _LLM_ROUTER.endpoints] if _LLM_ROUTER is not None else []
+    return list(dict.fromkeys(models+[LLM_MODEL]))
+
+def _cache_entry_path(cache_dir, key):
+    return os.path.join(cache_dir, "extract", key[:2], key+".json")
+
+_CACHE_LOCK=threading.Lock()
+# Running byte total per cache dir; computed by one scan, then kept up to date on put/evict.
+_CACHE_BYTES={}
+
+def _cache_get(cache_dir, key):
+    p=_cache_entry_path(cache_dir, key)
+    try:
+        with open(p, "r", encoding="utf-8") as f:
+            entry=json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(entry, dict) or not isinstance(entry.get("info"), dict):
+        return None
+    try:
+        os.utime(p, None)  # mtime is the LRU clock
+    except OSError:
+        pass
+    return entry["info"]
+
+def _cache_scan(cache_dir):
+    out=[]
+    for root, _dirs, files in os.walk(os.path.join(cache_dir, "extract")):
+        for f in files:
+            if not f.endswith(".json"): continue
+            p=os.path.join(root, f)
+            try:
+                st=os.stat(p)
+            except OSError:
+                continue
+            out.append((st.st_mtime, st.st_size, p))
+    return out
+
+def _cache_evict(cache_dir, max_bytes):
+    entries=sorted(_cache_scan(cache_dir))
+    total=sum(e[1] for e in entries)
+    for _mtime, size, p in entries:
+        if total <= max_bytes: break
+        try:
+            os.unlink(p)
+            total-=size
+        except OSError:
+            pass
+    return total
+
+def _cache_put(cache_dir, key, info, max_bytes=None, model=None):
+    max_bytes=int(CACHE_MAX_MB)*1024*1024 if max_bytes is None else int(max_bytes)
+    p=_cache_entry_path(cache_dir, key)
+    data=json.dumps({"v":_CACHE_VERSION, "model":model or LLM_MODEL, "created":int(time.time()), "info":info}, ensure_ascii=False).encode("utf-8")
+    try:
+        os.makedirs(os.path.dirname(p), exist_ok=True)
+        fd, tmp=tempfile.mkstemp(prefix=".tmp_", suffix=".json", dir=os.path.dirname(p))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+    except OSError:
+        return False
+    with _CACHE_LOCK:
+        try:
+            old=os.path.getsize(p)  # an overwritten entry no longer counts
+        except OSError:
+            old=0
+        try:
+            os.replace(tmp, p)
+        except OSError:
+            return False
+        total=_CACHE_BYTES.get(cache_dir)
+        if total is None:
+            total=sum(e[1] for e in _cache_scan(cache_dir))
+        else:
+            total+=len(data)-old
+        if total > max_bytes:
+            total=_cache_evict(cache_dir, max_bytes)
+        _CACHE_BYTES[cache_dir]=total
+    return True
+
+def _cache_lookup(pdf_input, cache_dir, keywords_count=5, refresh=False, sha256=None):
+    # Returns (pdf_sha256, info); the hash is None when caching is off or the file can't be hashed.
+    if not cache_dir:
+        return None, None
+    try:
+        sha256=sha256 or _file_sha256(pdf_input)
+    except OSError:
+        return None, None
+    if refresh:
+        return sha256, None
+    t0=time.monotonic()
+    for model in _cache_models():
+        key=_extraction_cache_key(sha256, keywords_count, model=model)
+        info=_cache_get(cache_dir, key)
+        if info is not None:
+            _progress(f"[1/4] Cache hit: {key[:12]} in {_fmt_secs(time.monotonic()-t0)}")
+            return sha256, info
+    return sha256, None
+
+def _cache_store(cache_dir, pdf_sha256, keywords_count, info):
+    # Keyed by the model that answered in this thread (see _call_llm), so endpoints serving
+    # different models never share entries.
+    model=getattr(_TLS, "last_model", None) or LLM_MODEL
+    return _cache_put(cache_dir, _extraction_cache_key(pdf_sha256, keywords_count, model=model), info, model=model)
+
+def cached_extract_information(pdf_input: str, cache_dir: typing.Optional[str]=None, refresh: bool=False, **kwargs) -> typing.Tuple[typing.Optional[typing.Dict[str, typing.Any]], str]:
+    keywords_count=kwargs.get("keywords_count", 5)
+    sha256, info=_cache_lookup(pdf_input, cache_dir, keywords_count, refresh=refresh)
+    if info is not None:
+        return info, ""
+    _TLS.last_model=None
+    info, text=extract_information(pdf_input, **kwargs)
+    if isinstance(info, dict) and info.get("source") != "rules":
+        if info.get("source") != "template": _learn_from_result(info, text)
+        if sha256: _cache_store(cache_dir, sha256, keywords_count, info)
+    return info, text
+
+def extract_information(pdf_input: str, lm_timeout: int=LLM_TIMEOUT, lm_retries: int=LLM_MAX_RETRIES, allow_repair: bool=True, keywords_count: int=5, prepared_text: typing.Optional[typing.Tuple[str, int, str]]=None) -> typing.Tuple[typing.Optional[typing.Dict[str, typing.Any]], str]:
+    repair_ctx=None
+    work_pdf=pdf_input
+    render_cache={}
+
+    def _postprocess_llm_info(info):
+        if not isinstance(info, dict):
             return info
 
         if "subject" in info:
@@ -422,6 +2736,7 @@ def extract_information(pdf_input: str, lm_timeout: int=LLM_TIMEOUT, lm_retries:
         ok, err=_repair_pdf_to(pdf_input, repaired)
         if ok:
             work_pdf=repaired
+            render_cache.clear()
             _progress("  using repaired PDF for extraction")
             return True
         _progress(f"  repair not available/failed: {err}")
@@ -430,74 +2745,201 @@ def extract_information(pdf_input: str, lm_timeout: int=LLM_TIMEOUT, lm_retries:
         return False
 
     try:
-        text, rc, err=_pdftotext(work_pdf)
+        # prepared_text: (text, rc, err) from an earlier _pdftotext(pdf_input), e.g. the batch prepare stage.
+        text, rc, err=prepared_text if prepared_text is not None else _pdftotext(work_pdf)
         if rc != 0 and work_pdf == pdf_input:
             if _try_repair(err):
                 text, rc, err=_pdftotext(work_pdf)
 
         def _vision_extract(partial_hint=None):
-            page_tries=[VISION_MAX_PAGES, max(1, VISION_MAX_PAGES-1), 1]
+            prompt=_prompt_for_vision(partial_hint, keywords_count=keywords_count)
+            first=_plan_vision_pages(prompt, VISION_MAX_PAGES)
+            if first < VISION_MAX_PAGES:
+                _progress(f"  vision sized to {first} page(s) for the context window")
+            page_tries=list(dict.fromkeys([first, max(1, first-1), 1]))
             for idx, pages in enumerate(page_tries, start=1):
                 _progress(f"[3/4] Vision pass {idx}/{len(page_tries)}: pages={pages}")
                 try:
-                    imgs=_render_pdf_to_images(work_pdf, max_pages=pages, dpi=VISION_DPI)
+                    imgs=_render_pdf_to_images(work_pdf, max_pages=pages, dpi=_vision_dpi(), cache=render_cache)
                 except RuntimeError as e:
                     if work_pdf == pdf_input and _try_repair(e):
                         return _vision_extract(partial_hint=partial_hint)
                     raise
-                prompt=_prompt_for_vision(partial_hint, keywords_count=keywords_count)
                 content=[{"type":"text","text":prompt}] + [{"type":"image_url","image_url":{"url":u}} for u in imgs]
                 t0=time.monotonic()
                 _progress(f"  calling LLM (vision) model={LLM_MODEL}")
-                out, err=_call_llm([
-                    {"role":"system","content":"You extract metadata for naming scanned documents and output strict JSON only."},
-                    {"role":"user","content":content}
-                ], max_tokens=450, timeout=lm_timeout, retries=lm_retries)
+                with _span("llm", kind="vision", attempt=idx, pages=len(imgs), bytes=sum(len(u) for u in imgs)) as sp:
+                    out, err=_call_llm([
+                        {"role":"system","content":_SYSTEM_PROMPT},
+                        {"role":"user","content":content}
+                    ], max_tokens=450, timeout=lm_timeout, retries=lm_retries)
+                    data=_extract_json_loose(out) if out else None
+                    sp["outcome"]="ok" if data else ("bad_json" if out else ("overflow" if _is_context_overflow(err) else "error"))
                 if out:
-                    data=_extract_json_loose(out)
+                    _calibrate_from_usage(getattr(_TLS, "last_usage", None), n_images=len(imgs), text_tokens_est=_request_tokens(_SYSTEM_PROMPT, prompt))
                     if data:
                         _postprocess_llm_info(data)
+                        if VISION_DPI_LEARN: _learn_vision_dpi(content[:1], len(imgs), data)
                         return data
                     return None
                 _progress(f"  LLM (vision) no result in {_fmt_secs(time.monotonic()-t0)}")
                 if not _is_context_overflow(err):
                     _progress(f"  vision stopped: {str(err)[:200]}")
                     return None
+                _ctx, req=_learn_from_overflow(err)
+                if req and len(imgs):
+                    _update_model_state(tokens_per_image=max(1, (req-_request_tokens(_SYSTEM_PROMPT, prompt))//len(imgs)))
             return None
 
+        def _learn_vision_dpi(head, pages, data):
+            # Same request one DPI rung lower: keep the lower DPI for this model if the key fields don't change.
+            lower=_next_learn_dpi()
+            if lower is None: return
+            _progress(f"  DPI learning: repeating the vision request at {lower} dpi")
+            with _span("dpi_learn", dpi=lower, pages=pages) as sp:
+                try:
+                    imgs=_render_pdf_to_images(work_pdf, max_pages=pages, dpi=lower, cache=render_cache)
+                except RuntimeError:
+                    sp["outcome"]="render_failed"
+                    return
+                out, _err=_call_llm([
+                    {"role":"system","content":_SYSTEM_PROMPT},
+                    {"role":"user","content":head+[{"type":"image_url","image_url":{"url":u}} for u in imgs]}
+                ], max_tokens=450, timeout=lm_timeout, retries=lm_retries)
+                other=_extract_json_loose(out) if out else None
+                if not other:
+                    sp["outcome"]="error"
+                elif _same_fields(data, other):
+                    _update_model_state(vision_dpi=lower)
+                    _progress(f"  same fields at {lower} dpi; using it for {LLM_MODEL}")
+                    sp["outcome"]="lowered"
+                else:
+                    _update_model_state(vision_dpi_floor=lower)
+                    _progress(f"  fields changed at {lower} dpi; keeping {_vision_dpi()} dpi")
+                    sp["outcome"]="kept"
+
+        def _mixed_extract(image_pages):
+            # One request: compacted text of the text pages plus images of the textless ones.
+            budgets=_plan_text_budgets(text, keywords_count, max_tokens=450) or [_TEXT_BUDGETS[-1]]
+            n=len(image_pages)
+            for idx, b in enumerate(budgets, start=1):
+                t=_compact_text(text, b)
+                n=min(n, _plan_vision_pages(_prompt_for_mixed(t, image_pages, keywords_count=keywords_count), n))
+                prompt=_prompt_for_mixed(t, image_pages[:n], keywords_count=keywords_count)
+                _progress(f"[3/4] Mixed pass {idx}/{len(budgets)}: budget={b}, image pages={','.join(str(p) for p in image_pages[:n])}")
+                try:
+                    imgs=_render_pdf_to_images(work_pdf, dpi=_vision_dpi(), cache=render_cache, pages=image_pages[:n])
+                except RuntimeError as e:
+                    _progress(f"  render failed: {str(e)[:200]}")
+                    return None
+                content=[{"type":"text","text":prompt}] + [{"type":"image_url","image_url":{"url":u}} for u in imgs]
+                t0=time.monotonic()
+                _progress(f"  calling LLM (mixed) model={LLM_MODEL}")
+                with _span("llm", kind="mixed", attempt=idx, budget=b, excerpt_chars=len(t), pages=len(imgs), bytes=len(prompt.encode("utf-8"))+sum(len(u) for u in imgs)) as sp:
+                    out, err=_call_llm([
+                        {"role":"system","content":_SYSTEM_PROMPT},
+                        {"role":"user","content":content}
+                    ], max_tokens=450, timeout=lm_timeout, retries=lm_retries)
+                    data=_extract_json_loose(out) if out else None
+                    sp["outcome"]="ok" if data else ("bad_json" if out else ("overflow" if _is_context_overflow(err) else "error"))
+                if out:
+                    _calibrate_from_usage(getattr(_TLS, "last_usage", None), n_images=len(imgs), text_tokens_est=_request_tokens(_SYSTEM_PROMPT, prompt))
+                    if data:
+                        _progress(f"  mixed parse ok in {_fmt_secs(time.monotonic()-t0)}")
+                        _postprocess_llm_info(data)
+                    return data
+                _progress(f"  LLM (mixed) no result in {_fmt_secs(time.monotonic()-t0)}")
+                if not _is_context_overflow(err):
+                    _progress(f"  mixed stopped: {str(err)[:200]}")
+                    return None
+                _ctx, req=_learn_from_overflow(err)
+                if req and len(imgs):
+                    _update_model_state(tokens_per_image=max(1, (req-_request_tokens(_SYSTEM_PROMPT, prompt))//len(imgs)))
+                n=max(1, n-1)
+            return None
+
+        # --- Rules engine: no LLM call when every field is already certain
+        if RULES_ENABLED and len(text) >= MIN_TEXT_CHARS:
+            with _span("rules") as sp:
+                info, scores=_rules_extract(text)
+                final=min(scores.values()) >= RULES_MIN_CONFIDENCE
+                sp.update(outcome="final" if final else "not_confident", **{k:round(v, 2) for k, v in scores.items()})
+            _rules_note(final)
+            if final:
+                _progress(f"[3/4] Rules engine: all fields certain (confidence {info['confidence']:.2f}); skipping the LLM")
+                return info, text
+            weak=", ".join(k for k, v in scores.items() if v < RULES_MIN_CONFIDENCE)
+            _progress(f"  rules engine unsure about {weak}; asking the LLM")
+
+        # --- Known layout: reuse the template's fields, extract only the date
+        tpl=_template_extract(text, lm_timeout=lm_timeout, lm_retries=lm_retries)
+        if tpl:
+            return tpl, text
+
+        # --- Mixed documents: only the textless pages are rendered
+        probe=_pdf_probe(work_pdf)
+        route=_route_pages(probe.page_chars, probe.page_images) if text.strip() else None
+        if route:
+            _progress(f"[3/4] Mixed document: sending text pages as text and page(s) {','.join(str(p) for p in route)} as images")
+            data=_mixed_extract(route)
+            if data:
+                return data, text
+            _progress("  no result from the mixed request; using the text/vision path")
+
+        def _text_result(data):
+            # NEW: if too many unknowns, force vision and merge
+            if _unknown_count(data) >= 2:
+                _progress("  too many unknowns; trying vision merge")
+                with _span("vision_merge", unknown=_unknown_count(data)) as sp:
+                    v=_vision_extract(partial_hint=data)
+                    if v: data=_merge_fill_missing(data, v)
+                    sp.update(outcome="merged" if v else "none", unknown_after=_unknown_count(data))
+
+            _postprocess_llm_info(data)
+
+            return data, text
+
         # --- Text-first path
         if len(text) >= MIN_TEXT_CHARS:
-            budgets=[7000, 4500, 2800, 1600]
-            for idx, b in enumerate(budgets, start=1):
+            budgets=_plan_text_budgets(text, keywords_count)
+            if _LLM_BATCHER is not None and budgets:
+                t=_compact_text(text, budgets[0])
+                if _estimate_tokens(t) <= LLM_BATCH_DOC_TOKENS:
+                    _progress(f"[3/4] Text pass: short excerpt ({len(t)} chars); batching with other documents")
+                    data=_LLM_BATCHER.submit(t, keywords_count=keywords_count, timeout=lm_timeout, retries=lm_retries)
+                    if data:
+                        return _text_result(data)
+            idx=0
+            while idx < len(budgets):
+                b=budgets[idx]
+                idx+=1
                 _progress(f"[3/4] Text pass {idx}/{len(budgets)}: budget={b}")
                 t=_compact_text(text, b)
+                prompt=_prompt_from_text(t, keywords_count=keywords_count)
                 t0=time.monotonic()
                 _progress(f"  calling LLM (text) model={LLM_MODEL}")
-                out, err=_call_llm([
-                    {"role":"system","content":"You extract metadata for naming scanned documents and output strict JSON only."},
-                    {"role":"user","content":_prompt_from_text(t, keywords_count=keywords_count)}
-                ], max_tokens=350, timeout=lm_timeout, retries=lm_retries)
+                with _span("llm", kind="text", attempt=idx, budget=b, excerpt_chars=len(t), bytes=len(prompt.encode("utf-8"))) as sp:
+                    out, err=_call_llm([
+                        {"role":"system","content":_SYSTEM_PROMPT},
+                        {"role":"user","content":prompt}
+                    ], max_tokens=350, timeout=lm_timeout, retries=lm_retries)
+                    data=_extract_json_loose(out) if out else None
+                    sp["outcome"]="ok" if data else ("bad_json" if out else ("overflow" if _is_context_overflow(err) else "error"))
 
                 if out:
-                    data=_extract_json_loose(out)
+                    _calibrate_from_usage(getattr(_TLS, "last_usage", None), prompt_chars=len(_SYSTEM_PROMPT)+len(prompt))
                     if not data: return None, text
 
                     _progress(f"  text parse ok in {_fmt_secs(time.monotonic()-t0)}")
-
-                    # NEW: if too many unknowns, force vision and merge
-                    if _unknown_count(data) >= 2:
-                        _progress("  too many unknowns; trying vision merge")
-                        v=_vision_extract(partial_hint=data)
-                        if v: data=_merge_fill_missing(data, v)
-
-                    _postprocess_llm_info(data)
-
-                    return data, text
+                    return _text_result(data)
 
                 if not _is_context_overflow(err):
                     _progress(f"  text stopped: {str(err)[:200]}")
                     return None, text
                 _progress("  context overflow; reducing budget")
+                ctx, _req=_learn_from_overflow(err)
+                if ctx:
+                    budgets=budgets[:idx]+_plan_text_budgets(text, keywords_count, below=b)
 
         # --- Vision fallback (no/low text or persistent overflow)
         _progress("[3/4] Falling back to vision")
@@ -581,7 +3023,283 @@ def format_keywords(keywords: typing.List[str], keywords_count: int) -> typing.O
     if not out: return None
     return "; ".join(out)
 
-def _pdf_appears_signed(reader) -> bool:
+# Metadata writes: "rewrite" clones the document with pypdf into a new file; "incremental" appends an
+# update section (new /Info object, xref and trailer with /Prev) so cost scales with the metadata and
+# signed byte ranges stay intact; "auto" uses incremental for signed files and files of at least
+# METADATA_INCREMENTAL_MIN_MB.
+METADATA_MODES=("rewrite", "incremental", "auto")
+METADATA_MODE=os.getenv("METADATA_MODE","rewrite").strip().lower()
+if METADATA_MODE not in METADATA_MODES: METADATA_MODE="rewrite"
+METADATA_INCREMENTAL_MIN_MB=int(os.getenv("METADATA_INCREMENTAL_MIN_MB","32"))
+
+def _pdf_docmdp_level(reader):
+    # Certification (DocMDP) permissions: 1 = no changes allowed, 2 = form filling and signing,
+    # 3 = also annotations. None when the document is not certified.
+    try:
+        root=reader.trailer["/Root"]
+        perms=root.get("/Perms")
+        if perms is None: return None
+        sig=perms.get_object().get("/DocMDP")
+        if sig is None: return None
+        for ref in (sig.get_object().get("/Reference") or []):
+            ref=ref.get_object()
+            if str(ref.get("/TransformMethod")) != "/DocMDP": continue
+            params=ref.get("/TransformParams")
+            p=params.get_object().get("/P") if params is not None else None
+            return int(p) if p is not None else 2
+        return 2
+    except Exception:
+        return 1
+
+def _pdf_name(key):
+    out=bytearray(b"/")
+    for b in str(key).lstrip("/").encode("utf-8"):
+        if 33 <= b <= 126 and b not in b"()<>[]{}/%#":
+            out.append(b)
+        else:
+            out+=b"#%02X" % b
+    return bytes(out)
+
+def _pdf_text_string(v):
+    try:
+        raw=v.encode("ascii")
+    except UnicodeEncodeError:
+        return b"<FEFF"+v.encode("utf-16-be").hex().upper().encode("ascii")+b">"
+    for a, b in ((b"\\", b"\\\\"), (b"(", b"\\("), (b")", b"\\)"), (b"\r", b"\\r"), (b"\n", b"\\n")):
+        raw=raw.replace(a, b)
+    return b"("+raw+b")"
+
+def _pdf_string_bytes(o):
+    b=getattr(o, "original_bytes", None)
+    if b is not None: return bytes(b)
+    if isinstance(o, bytes): return bytes(o)
+    return str(o).encode("latin-1", "replace")
+
+def _pdf_value_end(raw, i):
+    # End offset of the object token starting at raw[i]: string, hex string, dictionary, array,
+    # name, reference, number or keyword. Nested strings are skipped so their brackets don't count.
+    n=len(raw)
+    if raw[i:i+1] == b"(":
+        depth=0
+        j=i
+        while j < n:
+            c=raw[j]
+            if c == 0x5C:
+                j+=2
+                continue
+            if c == 0x28: depth+=1
+            elif c == 0x29:
+                depth-=1
+                if depth == 0: return j+1
+            j+=1
+        return n
+    if raw[i:i+2] == b"<<" or raw[i:i+1] == b"[":
+        depth=0
+        j=i
+        while j < n:
+            if raw[j:j+2] in (b"<<", b">>"):
+                depth+=1 if raw[j:j+2] == b"<<" else -1
+                j+=2
+            elif raw[j:j+1] in (b"[", b"]"):
+                depth+=1 if raw[j:j+1] == b"[" else -1
+                j+=1
+            elif raw[j:j+1] in (b"(", b"<"):
+                j=_pdf_value_end(raw, j)
+                continue
+            else:
+                j+=1
+            if depth == 0: return j
+        return n
+    if raw[i:i+1] == b"<":
+        j=raw.find(b">", i)
+        return n if j == -1 else j+1
+    m=re.compile(rb"\d+\s+\d+\s+R\b").match(raw, i) or re.compile(rb"/?[^\s/<>\[\]()%]*").match(raw, i)
+    return max(m.end(), i+1)
+
+def _pdf_string_token(raw, i):
+    # (bytes, end) of the literal or hex string starting at raw[i], else None. Escapes are decoded and an
+    # odd-length hex string gets a trailing 0, as the PDF spec reads it.
+    n=len(raw)
+    if raw[i:i+1] == b"(":
+        depth=0
+        buf=bytearray()
+        j=i
+        while j < n:
+            c=raw[j]
+            if c == 0x5C and j+1 < n:  # backslash escape
+                e=raw[j+1]
+                if 0x30 <= e <= 0x37:
+                    octal=re.match(rb"[0-7]{1,3}", raw[j+1:j+4]).group(0)
+                    buf.append(int(octal, 8) & 0xFF)
+                    j+=1+len(octal)
+                    continue
+                buf+={0x6E:b"\n", 0x72:b"\r", 0x74:b"\t", 0x62:b"\b", 0x66:b"\f", 0x0A:b"", 0x0D:b""}.get(e, bytes([e]))
+                j+=2
+                continue
+            if c == 0x28:
+                depth+=1
+                if depth == 1:
+                    j+=1
+                    continue
+            elif c == 0x29:
+                depth-=1
+                if depth == 0: break
+            buf.append(c)
+            j+=1
+        return bytes(buf), j+1
+    if raw[i:i+1] == b"<" and raw[i:i+2] != b"<<":
+        j=raw.find(b">", i)
+        if j == -1: return None
+        hexs=re.sub(rb"\s", b"", raw[i+1:j])
+        if not re.fullmatch(rb"[0-9A-Fa-f]*", hexs): return None
+        return bytes.fromhex((hexs+b"0"*(len(hexs) % 2)).decode("ascii")), j+1
+    return None
+
+def _pdf_parse_info(raw):
+    # Entries of a raw Info dictionary. Literal and hex strings are decoded to str; any other value
+    # (reference, name, number, array, dictionary) is kept as its raw token bytes, so an incremental
+    # update can write it back unchanged.
+    out={}
+    i=raw.find(b"<<")
+    n=len(raw)
+    while 0 <= i < n:
+        m=re.compile(rb"/([^\s/<>\[\]()%]+)\s*").search(raw, i)
+        if not m: break
+        key="/"+re.sub(rb"#([0-9A-Fa-f]{2})", lambda h: bytes([int(h.group(1), 16)]), m.group(1)).decode("utf-8", "replace")
+        i=m.end()
+        tok=_pdf_string_token(raw, i)
+        if tok is not None:
+            val, i=tok
+        else:
+            if raw[i:i+2] == b">>": break  # end of the Info dictionary
+            if raw[i:i+1] == b"<" and raw[i:i+2] != b"<<": break  # unterminated or malformed hex string
+            j=_pdf_value_end(raw, i)
+            out[key]=raw[i:j].strip()
+            i=j
+            continue
+        if val.startswith(b"\xfe\xff"):
+            out[key]=val[2:].decode("utf-16-be", "replace")
+        else:
+            out[key]=val.decode("latin-1")
+    return out
+
+def _incremental_base(reader, probe):
+    # (root, size, info_ref, first_id, old_info) for an incremental update, from the probe's raw
+    # trailer and Info object when it has them, else from pypdf. An /ID the probe cannot read (not a
+    # direct string) gives a None root, so the caller falls back to pypdf instead of dropping it.
+    if reader is None:
+        t=probe.trailer
+        ref=lambda key: (lambda m: (int(m.group(1)), int(m.group(2))) if m else None)(re.search(key+_RX_REF, t))
+        first=None
+        if re.search(rb"/ID\b", t):
+            ids=re.search(rb"/ID\s*\[\s*", t)
+            tok=_pdf_string_token(t, ids.end()) if ids else None
+            if tok is None: return None, 0, None, None, {}
+            first=tok[0]
+        return ref(rb"/Root"), _probe_int(rb"/Size\s+(\d+)", t) or 0, ref(rb"/Info"), first, _pdf_parse_info(probe.info or b"")
+    trailer=reader.trailer
+    root=trailer.raw_get("/Root")
+    try:
+        size=int(trailer.get("/Size") or 0)
+    except Exception:
+        size=0
+    old_ref=trailer.raw_get("/Info") if "/Info" in trailer else None
+    ids=trailer.get("/ID")
+    if ids is not None: ids=ids.get_object()  # may be an indirect array
+    info={}
+    try:
+        from pypdf.generic import TextStringObject
+        old=reader.metadata
+        for k in (list(old.keys()) if old is not None else []):
+            v=old.raw_get(k)
+            if isinstance(v, TextStringObject):
+                info[str(k)]=str(v)
+                continue
+            try:  # references and non-strings are written back as their raw token
+                buf=io.BytesIO()
+                v.write_to_stream(buf)
+                info[str(k)]=buf.getvalue()
+            except Exception:
+                pass
+    except Exception:
+        pass
+    return ((root.idnum, root.generation) if hasattr(root, "idnum") else None, size,
+            (old_ref.idnum, old_ref.generation) if hasattr(old_ref, "idnum") else None,
+            _pdf_string_bytes(ids[0]) if ids is not None and len(ids) == 2 else None, info)
+
+def _write_metadata_incremental(path, reader, meta, probe=None):
+    # Appends an incremental update instead of rewriting the file. The previous revision's bytes are
+    # left untouched, so signatures over them stay valid. Returns (ok, reason); "unsupported" means
+    # the file's cross-reference data cannot be chained onto (the caller may fall back to a rewrite).
+    # Without a reader, everything comes from a conclusive probe and pypdf is not used at all.
+    root, size, old_ref, first_id, info=_incremental_base(reader, probe)
+    if size <= 0 or root is None:
+        return False, "unsupported"
+    with open(path, "rb") as f:
+        end=f.seek(0, os.SEEK_END)
+        f.seek(max(0, end-2048))
+        tail=f.read()
+        m=list(re.finditer(rb"startxref\s+(\d+)", tail))
+        prev=int(m[-1].group(1)) if m else -1
+        if prev < 0 or prev >= end:
+            return False, "unsupported"
+        f.seek(prev)
+        head=f.read(64).lstrip()
+    if head.startswith(b"xref"):
+        xref_stream=False
+    elif re.match(rb"\d+\s+\d+\s+obj\b", head):
+        xref_stream=True
+    else:
+        return False, "unsupported"  # startxref is off; pypdf only read the file by rebuilding the xref
+
+    info.update(meta)
+
+    if old_ref is not None:
+        num, gen=old_ref  # same object number, newer revision wins
+    else:
+        num, gen=size, 0
+        size+=1
+    body=b"<<\n"+b"".join(_pdf_name(k)+b" "+(_pdf_text_string(v) if isinstance(v, str) else bytes(v))+b"\n" for k, v in info.items())+b">>"
+    common=b"/Root %d %d R /Info %d %d R /Prev %d" % (root[0], root[1], num, gen, prev)
+    if first_id is not None:
+        second=hashlib.md5(first_id+body+str(time.time()).encode("ascii")).digest()
+        common+=b" /ID [<%s> <%s>]" % (first_id.hex().encode("ascii"), second.hex().encode("ascii"))
+
+    with open(path, "r+b") as f:
+        start=f.seek(0, os.SEEK_END)
+        try:
+            out=[b"" if tail.endswith((b"\n", b"\r")) else b"\n"]
+            obj_off=start+len(out[0])
+            out+=[b"%d %d obj\n" % (num, gen), body, b"\nendobj\n"]
+            xref_off=start+sum(len(x) for x in out)
+            if xref_stream:
+                xnum=size
+                size+=1
+                rows=struct.pack(">BQH", 1, obj_off, gen)+struct.pack(">BQH", 1, xref_off, 0)
+                out+=[b"%d 0 obj\n<< /Type /XRef /Size %d %s /W [1 8 2] /Index [%d 1 %d 1] /Length %d >>\nstream\n"
+                      % (xnum, size, common, num, xnum, len(rows)), rows, b"\nendstream\nendobj\n"]
+            else:
+                out+=[b"xref\n%d 1\n%010d %05d n \ntrailer\n<< /Size %d %s >>\n" % (num, obj_off, gen, size, common)]
+            out.append(b"startxref\n%d\n%%%%EOF\n" % xref_off)
+            f.write(b"".join(out))
+            f.flush()
+            os.fsync(f.fileno())
+
+            if reader is not None:
+                # pypdf path (the probe could not read the file): make sure the result parses.
+                from pypdf import PdfReader
+                f.seek(0)
+                check=(PdfReader(f).metadata or {})
+                if any(str(check.get(k) or "") != v for k, v in meta.items()):
+                    raise ValueError("metadata not readable after update")
+        except BaseException:
+            f.truncate(start)
+            raise
+    return True, None
+
+def _pdf_appears_signed(reader, probe=None) -> bool:
+    if probe is not None and probe.signed is not None:
+        return probe.signed
     def _resolve(o):
         try:
             return o.get_object()
@@ -640,7 +3358,11 @@ def _pdf_appears_signed(reader) -> bool:
     except Exception:
         return True
 
-def write_pdf_metadata_in_place(dst_pdf_path: str, docinfo: typing.Dict[str, typing.Any]) -> typing.Tuple[bool, typing.Optional[str]]:
+def write_pdf_metadata_in_place(dst_pdf_path: str, docinfo: typing.Dict[str, typing.Any], mode: typing.Optional[str]=None,
+                                src_path: typing.Optional[str]=None) -> typing.Tuple[bool, typing.Optional[str]]:
+    # With src_path, dst_pdf_path is overwritten with src_path plus the metadata in one pass (used
+    # for placement); if that fails, dst_pdf_path's content is undefined and the caller must place
+    # the original bytes itself.
     try:
         from pypdf import PdfReader, PdfWriter
     except Exception:
@@ -676,10 +3398,26 @@ def write_pdf_metadata_in_place(dst_pdf_path: str, docinfo: typing.Dict[str, typ
         dst_pdf_path=os.path.abspath(dst_pdf_path)
         dst_dir=os.path.dirname(dst_pdf_path) or "."
 
-        with open(dst_pdf_path, "rb") as f_in:
+        mode=(mode or METADATA_MODE)
+        src_path=os.path.abspath(src_path) if src_path else dst_pdf_path
+        probe=_pdf_probe(src_path)
+        if probe.signed and mode == "rewrite":
+            _progress("  metadata skipped: signed")
+            return False, "signed"
+        if (mode == "incremental" or (mode == "auto" and (probe.signed or probe.size >= METADATA_INCREMENTAL_MIN_MB*1024*1024))) \
+                and probe.ok and probe.encrypted is False and not (probe.signed and probe.certified):
+            # The probe has the trailer and Info dictionary: no pypdf parse needed.
+            if src_path != dst_pdf_path:
+                _clone_file(src_path, dst_pdf_path)
+            ok, reason=_write_metadata_incremental(dst_pdf_path, None, meta, probe)
+            if ok:
+                return True, None
+            # "unsupported" (e.g. an /ID the probe can't read): pypdf decides below, signed files included.
+        with open(src_path, "rb") as f_in:
             reader=PdfReader(f_in)
+            encrypted=bool(getattr(reader, "is_encrypted", False))
 
-            if getattr(reader, "is_encrypted", False):
+            if encrypted:
                 try:
                     reader.decrypt("")
                 except Exception:
@@ -691,16 +3429,36 @@ def write_pdf_metadata_in_place(dst_pdf_path: str, docinfo: typing.Dict[str, typ
                     _progress("  metadata skipped: encrypted")
                     return False, "encrypted"
 
-            if _pdf_appears_signed(reader):
+            signed=_pdf_appears_signed(reader, probe)
+            incremental=(mode == "incremental") or (mode == "auto" and (signed or os.fstat(f_in.fileno()).st_size >= METADATA_INCREMENTAL_MIN_MB*1024*1024))
+            if signed and (not incremental or (probe.certified is not False and _pdf_docmdp_level(reader) == 1)):
                 _progress("  metadata skipped: signed")
                 return False, "signed"
+            if incremental and encrypted and signed:
+                # Info strings of an encrypted file would have to be encrypted too.
+                _progress("  metadata skipped: encrypted")
+                return False, "encrypted"
+            if incremental and not encrypted:
+                if src_path != dst_pdf_path:
+                    _clone_file(src_path, dst_pdf_path)
+                ok, reason=_write_metadata_incremental(dst_pdf_path, reader, meta)
+                if ok:
+                    return True, None
+                if signed:
+                    _progress("  metadata skipped: signed")
+                    return False, "signed"
+                # "unsupported": damaged xref, fall through to a full rewrite
 
             try:
                 writer=PdfWriter(clone_from=reader)
             except Exception:
-                writer=PdfWriter(clone_from=dst_pdf_path)
+                writer=PdfWriter(clone_from=src_path)
 
             writer.add_metadata(meta)
+            if src_path != dst_pdf_path:
+                with open(dst_pdf_path, "wb") as f_out:
+                    writer.write(f_out)
+                return True, None
 
             fd, tmp_path=tempfile.mkstemp(prefix=".scanfile_meta_", suffix=".pdf", dir=dst_dir)
             os.close(fd)
@@ -725,6 +3483,52 @@ def write_pdf_metadata_in_place(dst_pdf_path: str, docinfo: typing.Dict[str, typ
         _progress("  metadata skipped: write_failed")
         return False, "write_failed"
 
+def _is_pdf_name(name):
+    return str(name or "").lower().endswith(".pdf")
+
+def _expand_inputs(specs, recursive=False, skip_dirs=None, skip_names=None):
+    skip=set(os.path.abspath(d) for d in (skip_dirs or []) if d)
+    skip_names=set(skip_names or [])
+    found=[]
+    missing=[]
+    seen=set()
+
+    def _add(p):
+        ap=os.path.abspath(p)
+        if ap in seen: return
+        seen.add(ap)
+        found.append(p)
+
+    def _skip_dir(d):
+        name=os.path.basename(os.path.abspath(d))
+        return (os.path.abspath(d) in skip) or (name in skip_names) or name.startswith(".")
+
+    def _scan_dir(d):
+        if recursive:
+            for root, dirs, files in os.walk(d):
+                dirs[:]=sorted(x for x in dirs if not _skip_dir(os.path.join(root, x)))
+                for f in sorted(files):
+                    if _is_pdf_name(f): _add(os.path.join(root, f))
+            return
+        for f in sorted(os.listdir(d)):
+            fp=os.path.join(d, f)
+            if _is_pdf_name(f) and os.path.isfile(fp): _add(fp)
+
+    for spec in (specs or []):
+        if os.path.isdir(spec):
+            _scan_dir(spec)
+        elif os.path.isfile(spec):
+            _add(spec)
+        elif re.search(r"[*?\[]", str(spec)):
+            matches=sorted(glob.glob(spec, recursive=recursive))
+            for m in matches:
+                if os.path.isdir(m): _scan_dir(m)
+                elif os.path.isfile(m) and _is_pdf_name(m): _add(m)
+            if not matches: missing.append(spec)
+        else:
+            missing.append(spec)
+    return found, missing
+
 def _positive_int(s):
     try:
         v=int(s)
@@ -734,12 +3538,1039 @@ def _positive_int(s):
         raise argparse.ArgumentTypeError("must be > 0")
     return v
 
+def _docinfo_for(info, title, keywords_count):
+    docinfo={
+        "/Title": title,
+        "/Author": info.get("author") or info.get("provider"),
+        "/Subject": info.get("subject"),
+        "/Keywords": format_keywords(info.get("keywords", []), keywords_count),
+    }
+    creation_date=pdf_creation_date_from_ymd(info.get("date"))
+    if creation_date:
+        docinfo["/CreationDate"]=creation_date
+        docinfo["/ModDate"]=creation_date
+    return docinfo
+
+def _cache_dir_for(args):
+    return None if (args.no_cache or not CACHE_ENABLED) else (args.cache_dir or CACHE_DIR)
+
+# --- Job journal: one SQLite row per (input file hash, input path) recording how far the
+# document got (extracted -> placing -> placed -> done), its info JSON and its destination.
+# Each transition is committed before the next step starts, so a run that dies can be finished
+# with --resume: done inputs are skipped, extracted ones skip the LLM, and placing/placed ones
+# reuse their recorded destination instead of getting a " (2)" duplicate.
+JOURNAL_PATH=_env_first(("SCANFILE_JOURNAL",), os.path.join(CACHE_DIR, "journal.sqlite3"))
+JOURNAL_KEEP_DAYS=_env_int_first(("SCANFILE_JOURNAL_KEEP_DAYS",), 30)
+_JOURNAL_STATES=("extracted", "placing", "placed", "done")
+
+class _Journal:
+    def __init__(self, path, keep_days=JOURNAL_KEEP_DAYS):
+        import sqlite3
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path=path
+        self._lock=threading.Lock()
+        self._db=sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS jobs(
+            sha256 TEXT NOT NULL, input TEXT NOT NULL, mode TEXT NOT NULL, state TEXT NOT NULL,
+            info TEXT, dst TEXT, docinfo TEXT, error TEXT, updated REAL NOT NULL,
+            PRIMARY KEY (sha256, input))""")
+        # dst_sha256: hash of the finished output, recorded just before it is renamed into place.
+        if "dst_sha256" not in {r[1] for r in self._db.execute("PRAGMA table_info(jobs)")}:
+            self._db.execute("ALTER TABLE jobs ADD COLUMN dst_sha256 TEXT")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs(state)")
+        if keep_days > 0:
+            self._db.execute("DELETE FROM jobs WHERE state='done' AND updated < ?", (time.time()-keep_days*86400,))
+
+    def get(self, sha256, pdf_input):
+        with self._lock:
+            row=self._db.execute("SELECT sha256, input, mode, state, info, dst, docinfo, error, dst_sha256 FROM jobs WHERE sha256=? AND input=?",
+                                 (sha256, os.path.abspath(pdf_input))).fetchone()
+        return self._row(row) if row else None
+
+    def pending(self):
+        with self._lock:
+            rows=self._db.execute("SELECT sha256, input, mode, state, info, dst, docinfo, error, dst_sha256 FROM jobs WHERE state IN ('placing','placed') ORDER BY updated").fetchall()
+        return [self._row(r) for r in rows]
+
+    @staticmethod
+    def _row(r):
+        return {"sha256":r[0], "input":r[1], "mode":r[2], "state":r[3], "info":json.loads(r[4]) if r[4] else None,
+                "dst":r[5], "docinfo":json.loads(r[6]) if r[6] else None, "error":r[7], "dst_sha256":r[8]}
+
+    def record(self, sha256, pdf_input, mode, state, info=None, dst=None, docinfo=None, error=None, dst_sha256=None):
+        # Upsert; info/dst/docinfo/dst_sha256 keep their previous value when not given.
+        with self._lock:
+            self._db.execute("""INSERT INTO jobs(sha256, input, mode, state, info, dst, docinfo, error, dst_sha256, updated) VALUES(?,?,?,?,?,?,?,?,?,?)
+                ON CONFLICT(sha256, input) DO UPDATE SET mode=excluded.mode, state=excluded.state,
+                    info=COALESCE(excluded.info, info), dst=COALESCE(excluded.dst, dst),
+                    docinfo=COALESCE(excluded.docinfo, docinfo), error=excluded.error,
+                    dst_sha256=COALESCE(excluded.dst_sha256, dst_sha256), updated=excluded.updated""",
+                (sha256, os.path.abspath(pdf_input), mode, state,
+                 json.dumps(info, ensure_ascii=False) if info is not None else None, dst,
+                 json.dumps(docinfo, ensure_ascii=False) if docinfo is not None else None, error, dst_sha256, time.time()))
+
+    def note_error(self, sha256, pdf_input, error):
+        with self._lock:
+            self._db.execute("UPDATE jobs SET error=?, updated=? WHERE sha256=? AND input=?",
+                             (str(error)[:500], time.time(), sha256, os.path.abspath(pdf_input)))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+_JOURNAL=None
+
+def _journal_mode(args):
+    return "metadata" if args.metadata_only else ("move" if args.move else "copy")
+
+def _journal_record(job, args, state, **kw):
+    if _JOURNAL is None or not job.get("sha256") or args.dry_run: return
+    try:
+        _JOURNAL.record(job["sha256"], job["input"], _journal_mode(args), state, **kw)
+    except Exception as e:
+        _progress(f"  journal write failed: {type(e).__name__}: {e}")
+
+def _spec_covers(spec, path):
+    a=os.path.abspath(spec)
+    p=os.path.abspath(path)
+    if re.search(r"[*?\[]", str(spec)):
+        import fnmatch
+        return fnmatch.fnmatch(p, a)
+    return p == a or p.startswith(a.rstrip(os.sep)+os.sep)
+
+def _journal_orphans(specs, inputs, mode):
+    # Half-placed rows whose input is gone (e.g. --move finished, metadata not written) but are
+    # covered by the given specs: resumed from their recorded destination.
+    if _JOURNAL is None: return []
+    seen={os.path.abspath(p) for p in inputs}
+    out=[]
+    for row in _JOURNAL.pending():
+        if row["mode"] != mode or row["input"] in seen or os.path.exists(row["input"]): continue
+        if row["dst"] and os.path.exists(row["dst"]) and any(_spec_covers(sp, row["input"]) for sp in specs):
+            out.append(row)
+    return out
+
+# --- Duplicate detection: before extraction, an input is compared with earlier inputs of this run and
+# with the files already in its output directory. Identical bytes match by SHA-256. A rescan of the same
+# paper matches when its text has the same set of numbers (dates, amounts, account numbers) and a word
+# SimHash within DUPLICATE_TEXT_DISTANCE bits; the numbers are what keep next month's bill apart. Scans
+# without a text layer compare a difference hash of page 1, which cannot tell months apart, so those
+# matches are only reported. Fingerprints of output files live in a SQLite store keyed by path, size
+# and mtime; a directory is only listed again when its own mtime changed (files this tool places are
+# added directly and don't count as a change), and only new files in it are fingerprinted. Off by
+# default: the first run over an existing archive fingerprints every PDF in it.
+DUPLICATE_MODES=("off", "report", "skip")
+DUPLICATE_MODE=os.getenv("DUPLICATES","off").strip().lower()
+DUPLICATE_INDEX=_env_first(("SCANFILE_DUPLICATES",), os.path.join(CACHE_DIR, "duplicates.sqlite3"))
+DUPLICATE_TEXT_DISTANCE=_env_int_first(("DUPLICATE_TEXT_DISTANCE",), 16)            # bits, among documents with the same numbers (unrelated text: ~32)
+DUPLICATE_IMAGE_DISTANCE=min(3, _env_int_first(("DUPLICATE_IMAGE_DISTANCE",), 3))  # bits; more than 3 would need more bands
+_DUPLICATE_TEXT_CHARS=20000
+_DUPLICATE_MIN_SHINGLES=20
+_DUPLICATE_MIN_NUMBERS=3
+_RX_NUMBER=re.compile(r"(?<![^\W\d_])\d(?:[\d.,/:-]*\d)?(?![^\W\d_])")
+_DUPLICATE_LOCK=threading.Lock()
+_DUPLICATE_DB=None
+_DUPLICATE_SEEN=[]  # this run's inputs not yet in the store: {"path", "sha256", "kind", "fp", "key"}
+_DUPLICATE_STATS={"checked":0, "exact":0, "near":0, "skipped":0}
+
+def _text_fingerprint(text):
+    # (SimHash over digit-folded word 3-grams, 64-bit digest of the set of numbers), or None for too little text.
+    t=(text or "")[:_DUPLICATE_TEXT_CHARS]
+    numbers=sorted(set(_RX_NUMBER.findall(t)))
+    w=re.findall(r"[^\W\d_]+|#", re.sub(r"\d+", "#", t.lower()))
+    shingles={" ".join(w[i:i+3]) for i in range(len(w)-2)}
+    if len(shingles) < _DUPLICATE_MIN_SHINGLES or len(numbers) < _DUPLICATE_MIN_NUMBERS: return None
+    digest=int.from_bytes(hashlib.blake2b("\0".join(numbers).encode("utf-8"), digest_size=8).digest(), "big")
+    return _simhash(shingles), _signed64(digest)
+
+def _page_dhash(ppm):
+    # 64-bit difference hash of a _THUMB_DPI thumbnail's inked area; None for a blank page.
+    m=_RX_PPM.match(ppm or b"")
+    if not m: return None
+    w, h=int(m[1]), int(m[2])
+    px=ppm[m.end():m.end()+w*h*3]
+    if not w or not h or len(px) < w*h*3: return None
+    lo=bytes(map(min, px[0::3], px[1::3], px[2::3]))
+    rows=[y for y in range(h) if min(lo[y*w:(y+1)*w]) < 200]
+    cols=[x for x in range(w) if min(lo[x::w]) < 200]
+    if not rows or not cols: return None
+    x0, y0, x1, y1=cols[0], rows[0], cols[-1]+1, rows[-1]+1
+    cells=[]
+    for gy in range(8):
+        ya=y0+(y1-y0)*gy//8
+        yb=max(y0+(y1-y0)*(gy+1)//8, ya+1)
+        for gx in range(9):
+            xa=x0+(x1-x0)*gx//9
+            xb=max(x0+(x1-x0)*(gx+1)//9, xa+1)
+            vals=[lo[y*w+x] for y in range(ya, yb) for x in range(xa, xb)]
+            cells.append(sum(vals)/len(vals))
+    out=0
+    for gy in range(8):
+        for gx in range(8):
+            if cells[gy*9+gx] < cells[gy*9+gx+1]: out|=1 << (gy*8+gx)
+    return out
+
+def _duplicate_fingerprint(pdf_input, text):
+    # (kind, fp, key): ("text", simhash, numbers digest) with enough text, else ("image", dhash of page 1, page count).
+    if len((text or "").strip()) >= MIN_TEXT_CHARS:
+        tf=_text_fingerprint(text)
+        if tf is not None: return ("text", *tf)
+    if not _tool_exists(PDFTOPPM): return None, None, None
+    try:
+        fp=_page_dhash(_render_page_jpeg(pdf_input, 1, dpi=_THUMB_DPI, opts=()))
+    except RuntimeError:
+        return None, None, None
+    return ("image", fp, _pdf_page_count(pdf_input)) if fp is not None else (None, None, None)
+
+def _fingerprint_file(path):
+    # {"sha256", "kind", "fp", "key"} of a PDF, with its own progress output silenced.
+    with _quiet_progress():
+        try:
+            text, rc, _err=_pdftotext(path)
+        except Exception:
+            text, rc="", 1
+        kind, fp, key=_duplicate_fingerprint(path, text if rc == 0 else "")
+    return {"sha256":_file_sha256(path), "kind":kind, "fp":fp, "key":key}
+
+def _near(rec, other):
+    # Bit distance when other is a near duplicate of rec, else None.
+    if rec["kind"] is None or other["kind"] != rec["kind"] or other["fp"] is None or other["key"] != rec["key"]: return None
+    dist=(rec["fp"] ^ other["fp"]).bit_count()
+    return dist if dist <= (DUPLICATE_TEXT_DISTANCE if rec["kind"] == "text" else DUPLICATE_IMAGE_DISTANCE) else None
+
+class _DuplicateIndex:
+    def __init__(self, path):
+        import sqlite3
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path=path
+        self._lock=threading.Lock()
+        self._sync_lock=threading.Lock()  # one directory listing at a time; workers then see each other's rows
+        self._db=sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        # sha256 is the file's own hash; source_sha256 the input it was placed from (metadata makes them differ).
+        # key is the numbers digest for text fingerprints and the page count for image ones.
+        self._db.execute("""CREATE TABLE IF NOT EXISTS files(
+            path TEXT PRIMARY KEY, dir TEXT NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, sha256 TEXT, source_sha256 TEXT,
+            kind TEXT, fp INTEGER, key INTEGER, b0 INTEGER, b1 INTEGER, b2 INTEGER, b3 INTEGER, updated REAL NOT NULL)""")
+        self._db.execute("CREATE TABLE IF NOT EXISTS dirs(path TEXT PRIMARY KEY, mtime_ns INTEGER NOT NULL)")
+        for col in ("dir", "sha256", "source_sha256", "b0", "b1", "b2", "b3"):
+            self._db.execute(f"CREATE INDEX IF NOT EXISTS files_{col} ON files({col})")
+        self._db.execute("CREATE INDEX IF NOT EXISTS files_key ON files(kind, key)")
+
+    def put(self, path, st, rec, source_sha256=None):
+        fp=rec.get("fp")
+        with self._lock:
+            self._db.execute("""INSERT OR REPLACE INTO files(path, dir, size, mtime_ns, sha256, source_sha256, kind, fp, key, b0, b1, b2, b3, updated)
+                VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?)""",
+                (path, os.path.dirname(path), st.st_size, st.st_mtime_ns, rec.get("sha256"), source_sha256, rec.get("kind"),
+                 _signed64(fp) if fp is not None else None, rec.get("key"), *(_hash_bands(fp) if fp is not None else [None]*4), time.time()))
+
+    def placed(self, path, st, rec, source_sha256=None):
+        # A file this tool just wrote: stored directly, and the mtime its directory now has is taken as already
+        # listed, so the next document doesn't relist the directory for our own write.
+        d=os.path.dirname(path)
+        with self._sync_lock:
+            self.put(path, st, rec, source_sha256=source_sha256)
+            try:
+                mtime_ns=os.stat(d).st_mtime_ns
+            except OSError:
+                return
+            with self._lock:
+                self._db.execute("UPDATE dirs SET mtime_ns=? WHERE path=?", (mtime_ns, d))
+
+    def sync(self, d):
+        # Brings the rows of directory d up to date with its PDFs; returns how many files were fingerprinted.
+        with self._sync_lock:
+            return self._sync(os.path.abspath(d))
+
+    def _sync(self, d):
+        try:
+            dst=os.stat(d)
+        except OSError:
+            return 0
+        with self._lock:
+            row=self._db.execute("SELECT mtime_ns FROM dirs WHERE path=?", (d,)).fetchone()
+            if row and row[0] == dst.st_mtime_ns: return 0
+            known={r[0]:(r[1], r[2]) for r in self._db.execute("SELECT path, size, mtime_ns FROM files WHERE dir=?", (d,))}
+        present=set()
+        n=0
+        with os.scandir(d) as it:
+            for e in it:
+                if e.name.startswith(".scanfile_") or not (_is_pdf_name(e.name) and e.is_file()): continue
+                present.add(e.path)
+                try:
+                    st=e.stat()
+                    if known.get(e.path) == (st.st_size, st.st_mtime_ns): continue
+                    self.put(e.path, st, _fingerprint_file(e.path))
+                    n+=1
+                except OSError:
+                    continue
+        with self._lock:
+            self._db.executemany("DELETE FROM files WHERE path=?", [(p,) for p in known if p not in present])
+            self._db.execute("INSERT OR REPLACE INTO dirs(path, mtime_ns) VALUES(?,?)", (d, dst.st_mtime_ns))
+        return n
+
+    def find(self, rec, exclude=None):
+        # (path, distance) of an existing file with rec's bytes (distance None) or a near duplicate; None otherwise.
+        with self._lock:
+            cands=[(r[0], None) for r in self._db.execute("SELECT path FROM files WHERE sha256=? OR source_sha256=?", (rec["sha256"], rec["sha256"]))]
+            rows=[]
+            if rec["kind"] == "text":
+                rows=self._db.execute("SELECT path, kind, fp, key FROM files WHERE kind='text' AND key=?", (rec["key"],)).fetchall()
+            elif rec["kind"] == "image":
+                rows=self._db.execute("SELECT path, kind, fp, key FROM files WHERE kind='image' AND key IS ? AND (b0=? OR b1=? OR b2=? OR b3=?)",
+                                      (rec["key"], *_hash_bands(rec["fp"]))).fetchall()
+        for path, kind, fp, key in rows:
+            dist=_near(rec, {"kind":kind, "fp":fp & ((1 << 64)-1), "key":key})
+            if dist is not None: cands.append((path, dist))
+        for path, dist in sorted(cands, key=lambda c: -1 if c[1] is None else c[1]):
+            if path == exclude: continue
+            if os.path.exists(path): return path, dist
+            with self._lock:
+                self._db.execute("DELETE FROM files WHERE path=?", (path,))
+        return None
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+def _duplicate_index():
+    global _DUPLICATE_DB
+    if DUPLICATE_MODE == "off" or not CACHE_ENABLED: return None
+    with _DUPLICATE_LOCK:
+        if _DUPLICATE_DB is None:
+            try:
+                _DUPLICATE_DB=_DuplicateIndex(DUPLICATE_INDEX)
+            except Exception as e:
+                _progress(f"  duplicate index unavailable: {type(e).__name__}: {e}")
+                return None
+        return _DUPLICATE_DB
+
+def _duplicate_of(rec, pdf_input, outdir, db):
+    # (path, distance) of the earlier input or output file rec duplicates; rec then joins this run's inputs.
+    with _DUPLICATE_LOCK:
+        for other in _DUPLICATE_SEEN:
+            if other["path"] == pdf_input: continue
+            if other["sha256"] == rec["sha256"]: return other["path"], None
+            dist=_near(rec, other)
+            if dist is not None: return other["path"], dist
+        _DUPLICATE_SEEN.append(dict(rec, path=pdf_input))
+    n=db.sync(outdir)
+    if n: _progress(f"  duplicate index: fingerprinted {n} new file(s) in {outdir}")
+    return db.find(rec, exclude=pdf_input)
+
+def _check_duplicate(job, args):
+    # True when the job was finished as a skipped duplicate. Fills job["sha256"] and job["prepared"] on the way;
+    # a cache hit needs no text, so it is only compared by SHA-256.
+    db=None if (args.metadata_only or job.get("resume")) else _duplicate_index()
+    if db is None: return False
+    pdf_input=os.path.abspath(job["input"])
+    with _span("duplicate") as sp:
+        try:
+            if not job.get("sha256"): job["sha256"]=job.get("cache_sha256") or _file_sha256(pdf_input)
+            if job.get("info") is not None:
+                kind, fp, key=None, None, None
+            else:
+                if job.get("prepared") is None:
+                    try:
+                        job["prepared"]=_pdftotext(pdf_input)
+                    except Exception:
+                        job["prepared"]=None  # extract_information retries (and reports) it itself
+                text, rc, _err=job["prepared"] or ("", 1, "")
+                kind, fp, key=_duplicate_fingerprint(pdf_input, text if rc == 0 else "")
+            job["fingerprint"]=rec={"sha256":job["sha256"], "kind":kind, "fp":fp, "key":key}
+            hit=_duplicate_of(rec, pdf_input, job["outdir"], db)
+        except Exception as e:
+            sp["outcome"]="error"
+            _progress(f"  duplicate check failed: {type(e).__name__}: {e}")
+            return False
+        sp.update(outcome="unique" if hit is None else ("exact" if hit[1] is None else "near"), kind=kind)
+        if hit is not None and hit[1] is not None: sp["distance"]=hit[1]
+    skip=hit is not None and DUPLICATE_MODE == "skip" and (hit[1] is None or kind == "text")
+    with _DUPLICATE_LOCK:
+        _DUPLICATE_STATS["checked"]+=1
+        if hit is not None: _DUPLICATE_STATS["exact" if hit[1] is None else "near"]+=1
+        if skip: _DUPLICATE_STATS["skipped"]+=1
+    if hit is None: return False
+    path, dist=hit
+    how="identical" if dist is None else f"{kind} match, distance {dist}"
+    if not skip:
+        _emit("Duplicate of:" if kind == "text" or dist is None else "Possible duplicate of:", path, f"({how})")
+        return False
+    _emit("Skipped duplicate of:", path, f"({how})")
+    _finish(job, 0, f"duplicate of {path}")
+    return True
+
+def _duplicate_record(job, dst):
+    # A placed output is stored under the hash of the input it came from, and leaves this run's list.
+    rec=job.get("fingerprint")
+    db=_duplicate_index() if rec else None
+    if db is None: return
+    dst=os.path.abspath(dst)
+    try:
+        db.placed(dst, os.stat(dst), dict(rec, sha256=None), source_sha256=rec["sha256"])
+    except Exception as e:
+        _progress(f"  duplicate index write failed: {type(e).__name__}: {e}")
+        return
+    src=os.path.abspath(job["input"])
+    with _DUPLICATE_LOCK:
+        _DUPLICATE_SEEN[:]=[r for r in _DUPLICATE_SEEN if r["path"] != src]
+
+def _duplicate_stats_line():
+    with _DUPLICATE_LOCK:
+        st=dict(_DUPLICATE_STATS)
+    if not (st["exact"] or st["near"]): return None
+    return (f"Duplicates: {st['exact']+st['near']} of {st['checked']} document(s) "
+            f"({st['exact']} identical, {st['near']} near match), {st['skipped']} skipped")
+
+_FICLONE=0x40049409  # _IOW(0x94, 9, int): share the source's extents (btrfs, XFS, bcachefs)
+_LIBC=None
+
+def _clonefile_darwin(src, dst):
+    # APFS clonefile(2); dst must not exist yet.
+    global _LIBC
+    try:
+        if _LIBC is None:
+            _LIBC=ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        if os.path.lexists(dst):
+            os.unlink(dst)
+        return _LIBC.clonefile(os.fsencode(src), os.fsencode(dst), 0) == 0
+    except (OSError, AttributeError):
+        return False
+
+def _clone_file(src, dst):
+    # Copies src over dst with the cheapest mechanism available: a reflink (no data written until
+    # either side changes), then copy_file_range (in-kernel, server-side on NFS/SMB), then
+    # shutil.copyfile (sendfile/fcopyfile). Returns the method used.
+    with _span("clone", bytes=_file_size(src)) as sp:
+        method="copy"
+        if sys.platform == "darwin" and _clonefile_darwin(src, dst):
+            method="reflink"
+        else:
+            with open(src, "rb") as fi, open(dst, "wb") as fo:
+                if fcntl is not None and sys.platform.startswith("linux"):
+                    try:
+                        fcntl.ioctl(fo.fileno(), _FICLONE, fi.fileno())
+                        method="reflink"
+                    except OSError:
+                        pass
+                if method == "copy" and hasattr(os, "copy_file_range"):
+                    try:
+                        size=os.fstat(fi.fileno()).st_size
+                        off=0
+                        while off < size:
+                            n=os.copy_file_range(fi.fileno(), fo.fileno(), size-off, off, off)
+                            if n <= 0: break
+                            off+=n
+                        if off >= size:
+                            method="copy_file_range"
+                    except OSError:
+                        pass
+            if method == "copy":
+                shutil.copyfile(src, dst)
+        sp["method"]=method
+    return method
+
+def _place_file(src, dst, move, docinfo=None, on_ready=None):
+    # Copy/move into place via a temp name in the destination directory, so a crash never leaves
+    # a truncated file under the final name. With docinfo, the metadata is written on the way:
+    # the output is produced from src in one pass (a clone plus an appended update in incremental
+    # mode) instead of a copy that is then read back and rewritten. on_ready(tmp) is called with the
+    # finished temp file just before it is renamed to dst. Returns the metadata write's (ok, reason),
+    # or None without docinfo.
+    if move:
+        try:
+            os.replace(src, dst)
+        except OSError:
+            pass  # cross-device: copy then unlink
+        else:
+            return _write_metadata_guarded(dst, docinfo) if docinfo else None
+    fd, tmp=tempfile.mkstemp(prefix=".scanfile_", suffix=".part", dir=os.path.dirname(dst) or ".")
+    os.close(fd)
+    res=None
+    try:
+        if docinfo:
+            res=_write_metadata_guarded(tmp, docinfo, src=src)
+        if res and res[0]:
+            shutil.copymode(src, tmp)
+        else:
+            _clone_file(src, tmp)  # no metadata written: place the original bytes
+            shutil.copystat(src, tmp)
+        if on_ready: on_ready(tmp)
+        os.replace(tmp, dst)
+    except BaseException:
+        try: os.unlink(tmp)
+        except OSError: pass
+        raise
+    if move:
+        os.unlink(src)
+    return res
+
+# Batch documents move through three stages, each a dict-based job:
+#   prepare (cache lookup + pdftotext) -> extract (LLM, vision, heuristics) -> place (copy/move + metadata).
+# A stage that finishes a job sets job["rc"]; later stages then pass it through untouched.
+def _new_job(i, pdf_input):
+    return {"i":i, "input":pdf_input, "rc":None, "detail":None, "t0":time.monotonic(),
+            "cache_sha256":None, "info":None, "prefetch":False, "prepared":None, "dst":None, "docinfo":None}
+
+def _finish(job, rc, detail):
+    job["rc"]=rc
+    job["detail"]=detail
+    job["t_end"]=time.monotonic()
+    return job
+
+def _resume_from_journal(job, args):
+    # True when the journal settled the job (finished, or info restored so the LLM is skipped).
+    row=_JOURNAL.get(job["sha256"], job["input"])
+    if not row or not row["info"] or row["mode"] != _journal_mode(args):
+        return False
+    dst=row["dst"]
+    in_outdir=args.metadata_only or (dst and os.path.dirname(dst) == os.path.abspath(job["outdir"]))
+    if row["state"] == "done" and in_outdir and dst and os.path.exists(dst):
+        _emit("Already done:", dst)
+        _finish(job, 0, dst)
+        return True
+    job["info"]=row["info"]
+    _progress(f"[1/4] Journal: {row['state']}; reusing extracted info")
+    if row["state"] in ("placing", "placed", "done") and in_outdir and dst:
+        job.update(dst=dst, docinfo=row["docinfo"], resumed_state=row["state"], dst_sha256=row["dst_sha256"])
+    return True
+
+def _stage_prepare(job, args):
+    pdf_input=job["input"]
+    if not args.metadata_only:
+        _progress(f"Processing: {os.path.basename(pdf_input)}")
+        original_dir=os.path.dirname(os.path.abspath(pdf_input))
+        job["outdir"]=args.outdir or os.path.join(original_dir, "processed")
+        os.makedirs(job["outdir"], exist_ok=True)
+        _progress(f"Output dir: {job['outdir']}")
+    row=job.get("resume")
+    if row is not None:
+        # Journal row whose input is already gone (moved); only the metadata step is left.
+        job.update(sha256=row["sha256"], info=row["info"], dst=row["dst"], docinfo=row["docinfo"], resumed_state="placed")
+        _progress(f"[1/4] Journal: input already {row['mode']}d to {row['dst']}")
+        return job
+    if _JOURNAL is not None:
+        try:
+            job["sha256"]=_file_sha256(pdf_input)
+        except OSError:
+            job["sha256"]=None
+    if job.get("sha256") and args.resume and _resume_from_journal(job, args):
+        return job
+    job["cache_sha256"], job["info"]=_cache_lookup(pdf_input, _cache_dir_for(args), args.keywords_count, refresh=args.refresh, sha256=job.get("sha256"))
+    if _check_duplicate(job, args):
+        return job
+    if job["info"] is None and job.get("prefetch") and job["prepared"] is None:
+        try:
+            job["prepared"]=_pdftotext(pdf_input)
+        except Exception:
+            job["prepared"]=None  # extract_information retries (and reports) it itself
+    return job
+
+def _stage_extract(job, args):
+    pdf_input=job["input"]
+    info=job["info"]
+    if info is None:
+        try:
+            lm_timeout=max(1, int(args.lm_timeout))
+            lm_retries=max(0, int(args.lm_retries))
+            _TLS.last_model=None
+            info, raw_text=extract_information(pdf_input, lm_timeout=lm_timeout, lm_retries=lm_retries, allow_repair=(not args.no_repair), keywords_count=args.keywords_count, prepared_text=job["prepared"])
+        except RuntimeError as e:
+            _emit("Failed to process PDF:", str(e))
+            _emit("Hint: the PDF may be corrupt; installing qpdf/ghostscript can sometimes repair it.")
+            return _finish(job, 1, f"RuntimeError: {e}")
+        job["prepared"]=None
+        if isinstance(info, dict) and info.get("source") != "rules":  # rules results are cheaper to recompute than to cache
+            if info.get("source") != "template": _learn_from_result(info, raw_text)
+            if job["cache_sha256"]: _cache_store(_cache_dir_for(args), job["cache_sha256"], args.keywords_count, info)
+        if (not info) and raw_text:
+            _progress("[4/4] Falling back to heuristic extraction")
+            info=_heuristic_extract(raw_text)
+
+    if not info:
+        _emit("Failed to extract information.")
+        return _finish(job, 1, "extraction_failed")
+    job["info"]=info
+    if not job.get("resumed_state"):
+        _journal_record(job, args, "extracted", info=info)
+
+    if args.metadata_only:
+        if args.print_json and (not args.dry_run):
+            _emit(json.dumps(info, indent=2, ensure_ascii=False))
+        title=pretty_title_from_filename(os.path.basename(pdf_input))
+        job["docinfo"]=_docinfo_for(info, title, args.keywords_count)
+        if args.dry_run:
+            _emit(json.dumps(job["docinfo"], indent=2, ensure_ascii=False))
+            return _finish(job, 0, None)
+        return job
+
+    if args.print_json:
+        _emit(json.dumps(info, indent=2, ensure_ascii=False))
+
+    dst=job.get("dst")
+    if dst and job.get("resumed_state") == "placing" and os.path.exists(dst) and _file_sha256(dst) not in (job.get("sha256"), job.get("dst_sha256")):
+        dst=None  # the recorded name was taken by another file before our copy landed
+        job["resumed_state"]=None
+    if dst:
+        with _RESERVED_LOCK:
+            _RESERVED_PATHS.add(dst)
+    else:
+        dst=_reserve_unique_path(os.path.join(job["outdir"], create_filename(info)))
+    job["dst"]=dst
+
+    _emit("Proposed:", os.path.basename(dst))
+    if args.dry_run: return _finish(job, 0, dst)
+
+    if not job.get("docinfo"):
+        job["docinfo"]=_docinfo_for(info, pretty_title_from_filename(os.path.basename(dst)), args.keywords_count)
+    return job
+
+def _write_metadata_traced(path, docinfo, src=None):
+    with _span("metadata", mode=METADATA_MODE) as sp:
+        if src:
+            ok, reason=write_pdf_metadata_in_place(path, docinfo, src_path=src)
+        else:
+            ok, reason=write_pdf_metadata_in_place(path, docinfo)
+        sp.update(outcome="ok" if ok else (reason or "failed"), bytes=_file_size(path))
+    return ok, reason
+
+def _write_metadata_guarded(path, docinfo, src=None):
+    # A failed write is skipped, not retried: it is best-effort and usually permanent (signed/encrypted).
+    try:
+        return _write_metadata_traced(path, docinfo, src=src)
+    except Exception:
+        _progress("  metadata skipped: write_failed")
+        return False, "write_failed"
+
+def _stage_place(job, args):
+    pdf_input=job["input"]
+    docinfo=job["docinfo"]
+    if args.metadata_only:
+        with _quiet_progress():
+            ok, reason=_write_metadata_traced(pdf_input, docinfo)
+        if not ok:
+            _emit(reason or "write_failed")
+            return _finish(job, 1, reason or "write_failed")
+        _journal_record(job, args, "done", dst=os.path.abspath(pdf_input))
+        return _finish(job, 0, pdf_input)
+
+    dst=job["dst"]
+    verb="move" if args.move else "copy"
+    state=job.get("resumed_state")
+    if state == "placing" and os.path.exists(dst) and not (args.move and os.path.exists(pdf_input)):
+        state="placed"  # the copy/move landed before the journal was updated
+    if state in ("placed", "done") and not os.path.exists(dst):
+        if not os.path.exists(pdf_input):
+            _emit("Failed: destination is gone and the input was moved:", dst)
+            return _finish(job, 1, "destination_missing")
+        _progress(f"[4/4] Destination is gone; {verb}ing again")
+        state=None
+    if state in ("placed", "done"):
+        _progress(f"[4/4] Already {verb}d; finishing metadata")
+        ok, reason=_write_metadata_guarded(dst, docinfo)
+        if not ok and reason == "write_failed":  # signed/encrypted skips are expected, a failed write is not
+            _emit("Failed to write metadata:", dst)
+            return _finish(job, 1, reason)
+    else:
+        _progress(f"[4/4] {'Moving' if args.move else 'Copying'} file")
+        _journal_record(job, args, "placing", info=job["info"], dst=os.path.abspath(dst), docinfo=docinfo)
+        # The output's own hash (metadata makes it differ from the input's) lets --resume recognize it
+        # after a crash between the rename and the "placed" update.
+        ready=(lambda tmp: _journal_record(job, args, "placing", dst_sha256=_file_sha256(tmp))) if _JOURNAL is not None else None
+        with _span(verb, bytes=_file_size(pdf_input)):
+            _place_file(pdf_input, dst, args.move, docinfo, on_ready=ready)
+        _journal_record(job, args, "placed")
+        _duplicate_record(job, dst)
+    _journal_record(job, args, "done")
+    _emit("Moved to:" if args.move else "Copied to:", dst)
+    return _finish(job, 0, dst)
+
+_STAGES=(("prepare", _stage_prepare), ("extract", _stage_extract), ("place", _stage_place))
+
+def _run_stage(name, fn, job, args, prefix):
+    if job["rc"] is not None:
+        return job
+    if "t_start" not in job:
+        job["t_start"]=time.monotonic()
+        job["ts_start"]=time.time()
+    _TLS.prefix=prefix
+    _TLS.doc=job["input"]
+    try:
+        with _span(f"stage_{name}"):
+            return fn(job, args)
+    except Exception as e:
+        _emit(f"Failed to process {job['input']}: {type(e).__name__}: {e}")
+        return _finish(job, 1, f"{type(e).__name__}: {e}")
+    finally:
+        _TLS.prefix=""
+        _TLS.doc=None
+
+def _stage_workers(name, jobs):
+    if name == "prepare": return max(1, min(jobs, RENDER_WORKERS))
+    if name == "place": return max(1, min(jobs, PLACE_WORKERS))
+    return jobs
+
+def _run_pipeline(jobs_list, args, jobs, on_done=None):
+    # One thread pool per stage, connected by bounded queues: a full queue blocks the stage
+    # feeding it, so at most ~2*jobs prepared documents wait on the LLM stage at any time.
+    # jobs_list may be any iterable (watch mode feeds it from a generator); on_done(job) runs
+    # as each job leaves the last stage.
+    queues=[queue.Queue(maxsize=max(1, jobs)) for _ in _STAGES]
+    done=[]
+    done_lock=threading.Lock()
+
+    def _worker(idx, name, fn):
+        q_in=queues[idx]
+        q_out=queues[idx+1] if idx+1 < len(queues) else None
+        while True:
+            job=q_in.get()
+            if job is None:
+                q_in.put(None)  # let sibling workers see the sentinel too
+                return
+            job=_run_stage(name, fn, job, args, f"[{os.path.basename(job['input'])}] ")
+            if q_out is None:
+                with done_lock:
+                    done.append(job)
+                if on_done is not None:
+                    try:
+                        on_done(job)
+                    except Exception as e:
+                        _emit(f"Failed to report {job['input']}: {type(e).__name__}: {e}")
+            else:
+                q_out.put(job)
+
+    stage_threads=[]
+    for idx, (name, fn) in enumerate(_STAGES):
+        ts=[threading.Thread(target=_worker, args=(idx, name, fn), name=f"scanfile-{name}-{k}", daemon=True)
+            for k in range(_stage_workers(name, jobs))]
+        for t in ts: t.start()
+        stage_threads.append(ts)
+
+    for job in jobs_list:
+        job["prefetch"]=True  # extract text in the prepare stage, while other documents wait on the LLM
+        queues[0].put(job)
+    for idx, ts in enumerate(stage_threads):
+        queues[idx].put(None)
+        for t in ts: t.join()
+    return done
+
+def _run_batch(inputs, args, resume_rows=None):
+    jobs_list=[_new_job(i, p) for i, p in enumerate(inputs)]
+    for row in (resume_rows or []):
+        job=_new_job(len(jobs_list), row["input"])
+        job["resume"]=row
+        jobs_list.append(job)
+    jobs=max(1, min(int(args.jobs or 1), len(jobs_list) or 1))
+    if jobs == 1:
+        for job in jobs_list:
+            for name, fn in _STAGES:
+                job=_run_stage(name, fn, job, args, "")
+    else:
+        _run_pipeline(jobs_list, args, jobs)
+    results=[]
+    for job in jobs_list:
+        _trace_document(job)
+        rc=job["rc"] if job["rc"] is not None else 1
+        results.append({"input":job["input"], "rc":rc, "detail":job["detail"], "secs":_job_secs(job)})
+    return results
+
+def _print_batch_summary(results, missing, t0):
+    ok=sum(1 for r in results if r["rc"] == 0)
+    failed=len(results)-ok
+    _emit(f"Summary: {ok} ok, {failed} failed, {len(missing)} missing in {_fmt_secs(time.monotonic()-t0)}")
+    for r in results:
+        status="ok" if r["rc"] == 0 else "FAIL"
+        detail=f" -> {r['detail']}" if r.get("detail") else ""
+        _emit(f"  [{status}] {r['input']}{detail} ({_fmt_secs(r['secs'])})")
+    for m in missing:
+        _emit(f"  [MISSING] {m}")
+    http=_http_stats_line()
+    if http: _emit(http)
+    rules=_rules_stats_line()
+    if rules: _emit(rules)
+    templates=_template_stats_line()
+    if templates: _emit(templates)
+    duplicates=_duplicate_stats_line()
+    if duplicates: _emit(duplicates)
+    batched=_batch_stats_line()
+    if batched: _emit(batched)
+    if _LLM_CONTROLLER is not None and _HTTP_STATS["requests"]:
+        _emit(_LLM_CONTROLLER.summary())
+    if _LLM_ROUTER is not None:
+        for ln in _LLM_ROUTER.summary_lines(): _emit(ln)
+
+# --- Watch mode: a long-running process that feeds PDFs landing in inbox directories through the
+# batch pipeline. Linux uses inotify (via ctypes); elsewhere, or with --watch-poll, directories are
+# rescanned every --poll-interval seconds. A file is handed over once its size and mtime have not
+# changed for --settle seconds and no process still has it open for writing.
+WATCH_SETTLE_SECS=float(os.getenv("WATCH_SETTLE_SECS","3"))
+WATCH_POLL_SECS=float(os.getenv("WATCH_POLL_SECS","2"))
+WATCH_RESCAN_SECS=float(os.getenv("WATCH_RESCAN_SECS","60"))  # inotify safety-net rescan
+
+class _Inotify:
+    IN_MODIFY=0x2
+    IN_CLOSE_WRITE=0x8
+    IN_MOVED_TO=0x80
+    IN_CREATE=0x100
+    IN_Q_OVERFLOW=0x4000
+    IN_ISDIR=0x40000000
+    _MASK=IN_MODIFY|IN_CLOSE_WRITE|IN_MOVED_TO|IN_CREATE
+    _EVENT=struct.Struct("iIII")
+
+    def __init__(self):
+        self._libc=ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        self.fd=self._libc.inotify_init1(os.O_NONBLOCK|os.O_CLOEXEC)
+        if self.fd < 0:
+            e=ctypes.get_errno()
+            raise OSError(e, f"inotify_init1: {os.strerror(e)}")
+        self._dirs={}
+
+    def add(self, path):
+        wd=self._libc.inotify_add_watch(self.fd, os.fsencode(path), self._MASK)
+        if wd < 0:
+            e=ctypes.get_errno()
+            raise OSError(e, f"inotify_add_watch {path}: {os.strerror(e)}")
+        self._dirs[wd]=path
+
+    def read(self, timeout):
+        # -> [(directory, name, mask)]; empty on timeout.
+        try:
+            ready, _w, _x=select.select([self.fd], [], [], max(0.0, timeout))
+        except InterruptedError:
+            return []
+        if not ready: return []
+        try:
+            data=os.read(self.fd, 1<<16)
+        except BlockingIOError:
+            return []
+        out=[]
+        off=0
+        while off+self._EVENT.size <= len(data):
+            wd, mask, _cookie, n=self._EVENT.unpack_from(data, off)
+            off+=self._EVENT.size
+            name=os.fsdecode(data[off:off+n].rstrip(b"\0"))
+            off+=n
+            out.append((self._dirs.get(wd), name, mask))
+        return out
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd=-1
+
+def _open_for_writing(path):
+    # Linux: is any process holding `path` open with write access? False where /proc is unavailable.
+    if not os.path.isdir("/proc/self/fd"): return False
+    target=os.path.realpath(path)
+    try:
+        pids=[p for p in os.listdir("/proc") if p.isdigit()]
+    except OSError:
+        return False
+    for pid in pids:
+        fd_dir=f"/proc/{pid}/fd"
+        try:
+            fds=os.listdir(fd_dir)
+        except OSError:
+            continue
+        for fd in fds:
+            try:
+                if os.readlink(f"{fd_dir}/{fd}") != target: continue
+                with open(f"/proc/{pid}/fdinfo/{fd}", "r") as f:
+                    for ln in f:
+                        if ln.startswith("flags:"):
+                            if int(ln.split()[1], 8) & (os.O_WRONLY|os.O_RDWR): return True
+                            break
+            except (OSError, ValueError):
+                continue
+    return False
+
+class _InboxWatcher:
+    def __init__(self, inboxes, recursive=False, skip_dirs=None, skip_names=None, settle=WATCH_SETTLE_SECS,
+                 interval=WATCH_POLL_SECS, use_inotify=None):
+        self.inboxes=[os.path.abspath(d) for d in inboxes]
+        self.recursive=recursive
+        self.skip_dirs=skip_dirs or []
+        self.skip_names=skip_names or []
+        self.settle=max(0.0, float(settle))
+        self.interval=max(0.05, float(interval))
+        self.pending={}     # path -> (size, mtime_ns, stable_since)
+        self.submitted={}   # path -> (size, mtime_ns) handed to the pipeline
+        self._inotify=None
+        self._last_scan=0.0
+        if use_inotify is None: use_inotify=sys.platform.startswith("linux")
+        if use_inotify:
+            try:
+                self._inotify=_Inotify()
+                for d in self._watch_dirs():
+                    self._inotify.add(d)
+            except (OSError, AttributeError) as e:
+                _progress(f"  inotify unavailable ({e}); polling every {_fmt_secs(self.interval)}")
+                if self._inotify is not None: self._inotify.close()
+                self._inotify=None
+
+    @property
+    def mode(self):
+        return "inotify" if self._inotify is not None else "polling"
+
+    def _skip(self, d):
+        name=os.path.basename(d)
+        return d in [os.path.abspath(x) for x in self.skip_dirs] or name in self.skip_names or name.startswith(".")
+
+    def _watch_dirs(self):
+        for inbox in self.inboxes:
+            yield inbox
+            if self.recursive:
+                for root, dirs, _files in os.walk(inbox):
+                    dirs[:]=sorted(x for x in dirs if not self._skip(os.path.join(root, x)))
+                    for x in dirs: yield os.path.join(root, x)
+
+    def _note(self, path):
+        if path not in self.pending:
+            self.pending[path]=(-1, -1, time.monotonic())
+
+    def _rescan(self):
+        self._last_scan=time.monotonic()
+        for p in [p for p in self.submitted if not os.path.exists(p)]:
+            del self.submitted[p]  # moved away (--move) or deleted
+        found, _missing=_expand_inputs(self.inboxes, recursive=self.recursive, skip_dirs=self.skip_dirs, skip_names=self.skip_names)
+        for p in found: self._note(os.path.abspath(p))
+
+    def _wait(self, timeout):
+        if self._inotify is None:
+            time.sleep(min(timeout, self.interval))
+            if time.monotonic()-self._last_scan >= self.interval: self._rescan()
+            return
+        for d, name, mask in self._inotify.read(timeout):
+            if mask & _Inotify.IN_Q_OVERFLOW or d is None:
+                self._rescan()
+                continue
+            path=os.path.join(d, name)
+            if mask & _Inotify.IN_ISDIR:
+                if self.recursive and (mask & (_Inotify.IN_CREATE|_Inotify.IN_MOVED_TO)) and not self._skip(path):
+                    try:
+                        self._inotify.add(path)
+                    except OSError:
+                        pass
+                    self._rescan()  # files may have landed before the watch existed
+            elif _is_pdf_name(name) and not name.startswith("."):
+                self._note(path)
+        if time.monotonic()-self._last_scan >= WATCH_RESCAN_SECS: self._rescan()
+
+    def ready(self, timeout=1.0):
+        # Wait up to `timeout` for events, then return files that have settled (each path/version once).
+        if not self._last_scan: self._rescan()
+        self._wait(timeout)
+        now=time.monotonic()
+        out=[]
+        for path, (size, mtime, since) in list(self.pending.items()):
+            try:
+                st=os.stat(path)
+            except OSError:
+                del self.pending[path]
+                continue
+            version=(st.st_size, st.st_mtime_ns)
+            if self.submitted.get(path) == version:
+                del self.pending[path]
+                continue
+            if version != (size, mtime):
+                self.pending[path]=(st.st_size, st.st_mtime_ns, now)
+                continue
+            if st.st_size <= 0 or now-since < self.settle: continue
+            if _open_for_writing(path):
+                self.pending[path]=(size, mtime, now)
+                continue
+            del self.pending[path]
+            self.submitted[path]=version
+            out.append(path)
+        return sorted(out)
+
+    def next_wait(self):
+        # Poll again sooner while files are settling.
+        return min(self.interval, max(0.05, self.settle/2)) if self.pending else self.interval
+
+    def close(self):
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify=None
+
+def _run_watch(inboxes, args, stop=None):
+    stop=stop or threading.Event()
+    skip_dirs=[args.outdir] if args.outdir else []
+    skip_names=[] if args.outdir else ["processed"]
+    watcher=_InboxWatcher(inboxes, recursive=args.recursive, skip_dirs=skip_dirs, skip_names=skip_names,
+                          settle=args.settle, interval=args.poll_interval, use_inotify=(False if args.watch_poll else None))
+    counts={"ok":0, "failed":0}
+    counts_lock=threading.Lock()
+
+    def _on_signal(_signum, _frame):
+        # No output here: the main thread may be holding _OUTPUT_LOCK.
+        if stop.is_set():
+            raise KeyboardInterrupt
+        stop.set()
+
+    restore={}
+    if threading.current_thread() is threading.main_thread():
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            restore[sig]=signal.signal(sig, _on_signal)
+
+    def _jobs():
+        i=0
+        while not stop.is_set():
+            for path in watcher.ready(timeout=watcher.next_wait()):
+                if stop.is_set(): break
+                yield _new_job(i, path)
+                i+=1
+        _emit("Stopping; finishing in-flight documents")
+
+    def _on_done(job):
+        _trace_document(job)
+        rc=job["rc"] if job["rc"] is not None else 1
+        with counts_lock:
+            counts["ok" if rc == 0 else "failed"]+=1
+        detail=f" -> {job['detail']}" if job.get("detail") else ""
+        _emit(f"[{'ok' if rc == 0 else 'FAIL'}] {job['input']}{detail} ({_fmt_secs(_job_secs(job))})")
+        if args.metrics_file and _METRICS is not None:
+            _write_metrics(args.metrics_file)
+
+    _emit(f"Watching {', '.join(watcher.inboxes)} ({watcher.mode}, settle {_fmt_secs(watcher.settle)}); stop with SIGTERM or Ctrl-C")
+    t0=time.monotonic()
+    try:
+        _run_pipeline(_jobs(), args, max(1, int(args.jobs or 1)), on_done=_on_done)
+    finally:
+        watcher.close()
+        for sig, prev in restore.items():
+            signal.signal(sig, prev)
+    _emit(f"Stopped: {counts['ok']} ok, {counts['failed']} failed in {_fmt_secs(time.monotonic()-t0)}")
+    http=_http_stats_line()
+    if http: _emit(http)
+    rules=_rules_stats_line()
+    if rules: _emit(rules)
+    templates=_template_stats_line()
+    if templates: _emit(templates)
+    duplicates=_duplicate_stats_line()
+    if duplicates: _emit(duplicates)
+    batched=_batch_stats_line()
+    if batched: _emit(batched)
+    if _LLM_ROUTER is not None:
+        for ln in _LLM_ROUTER.summary_lines(): _emit(ln)
+    return 0
+
 def main() -> int:
+    global _PROGRESS_ENABLED, LLM_POOL_SIZE, _LLM_CONTROLLER, _JOURNAL, METADATA_MODE, TEXT_BACKEND, RULES_ENABLED, TEMPLATES_ENABLED, DUPLICATE_MODE, _LLM_BATCHER, _LLM_ROUTER
     ap=argparse.ArgumentParser()
-    ap.add_argument("pdf", help="Path to input PDF")
+    ap.add_argument("pdf", nargs="+", help="Input PDF(s), directories or glob patterns (inbox directories with --watch)")
     ap.add_argument("--outdir", default=None, help="Destination directory (default: <input_dir>/processed)")
     ap.add_argument("--move", action="store_true", help="Move instead of copy")
     ap.add_argument("--metadata-only", action="store_true", help="Write PDF DocumentInfo metadata in-place (no copy/move)")
+    ap.add_argument("--metadata-mode", choices=METADATA_MODES, default=METADATA_MODE, help=f"How metadata is written: rewrite the file, append an incremental update (keeps signatures valid), or auto (default: {METADATA_MODE})")
+    ap.add_argument("--text-backend", choices=TEXT_BACKENDS, default=TEXT_BACKEND, help=f"Text extraction: pdftotext subprocess, in-process pypdf, or auto (default: {TEXT_BACKEND})")
+    ap.add_argument("--no-rules", action="store_true", help="Always ask the LLM, even when the rules engine is certain of every field")
+    ap.add_argument("--no-templates", action="store_true", help="Do not reuse or record known document layouts (template index)")
+    ap.add_argument("--duplicates", choices=DUPLICATE_MODES, default=DUPLICATE_MODE, help=f"Inputs identical or nearly identical to an earlier input or an output file: report them, skip them, or don't check (default: {DUPLICATE_MODE})")
     ap.add_argument("--dry-run", action="store_true", help="Print result, do not write file")
     ap.add_argument("--print-json", action="store_true", help="Print extracted JSON")
     ap.add_argument("--no-progress", action="store_true", help="Disable progress output")
@@ -747,18 +4578,108 @@ def main() -> int:
     ap.add_argument("--keywords-count", type=_positive_int, default=5, help="Number of keywords to include (default: 5)")
     ap.add_argument("--lm-timeout", type=int, default=LLM_TIMEOUT, help="LLM timeout in seconds")
     ap.add_argument("--lm-retries", type=int, default=LLM_MAX_RETRIES, help="LLM max retries on network/server errors")
+    ap.add_argument("--lm-endpoint", action="append", type=_endpoint_arg, default=None, metavar="URL[,model=NAME][,max=N]",
+                    help="LLM endpoint to use; repeat for several, each request goes to the least-loaded healthy one (default: LLM_ENDPOINTS, else LLM_ENDPOINT)")
+    ap.add_argument("--lm-pool-size", type=_positive_int, default=None, help=f"Max pooled keep-alive connections to the LLM endpoint (default: {LLM_POOL_SIZE})")
+    ap.add_argument("--lm-concurrency", type=_positive_int, default=None, help="Max concurrent LLM requests; the adaptive limit moves between 1 and this (default: --jobs)")
+    ap.add_argument("--lm-batch", type=_positive_int, default=None, metavar="N", help=f"Pack up to N short text documents into one LLM request (needs --jobs > 1; default: {LLM_BATCH or 'off'})")
+    ap.add_argument("-r", "--recursive", action="store_true", help="Recurse into directories (and ** in glob patterns)")
+    ap.add_argument("-j", "--jobs", type=_positive_int, default=1, help="Number of documents processed concurrently (default: 1)")
+    ap.add_argument("--cache-dir", default=None, help=f"Extraction cache directory (default: {CACHE_DIR})")
+    ap.add_argument("--no-cache", action="store_true", help="Do not read or write the extraction cache")
+    ap.add_argument("--refresh", action="store_true", help="Ignore cached results (re-extract) and update the cache")
+    ap.add_argument("--journal", default=None, metavar="FILE", help=f"Job journal (SQLite) recording each input's progress (default: {JOURNAL_PATH})")
+    ap.add_argument("--no-journal", action="store_true", help="Do not record progress in the job journal")
+    ap.add_argument("--resume", action="store_true", help="Use the journal to skip finished inputs and finish half-done ones without re-extracting")
+    ap.add_argument("--watch", action="store_true", help="Keep running and process PDFs as they land in the given directories (stop with SIGTERM/Ctrl-C)")
+    ap.add_argument("--settle", type=float, default=WATCH_SETTLE_SECS, metavar="SEC", help=f"--watch: seconds a file must stay unchanged before processing (default: {WATCH_SETTLE_SECS:g})")
+    ap.add_argument("--poll-interval", type=float, default=WATCH_POLL_SECS, metavar="SEC", help=f"--watch: directory rescan interval when polling (default: {WATCH_POLL_SECS:g})")
+    ap.add_argument("--watch-poll", action="store_true", help="--watch: poll directories instead of using inotify")
+    ap.add_argument("--trace", default=TRACE_FILE or None, metavar="FILE", help="Append per-stage spans as JSON lines to FILE ('-' for stderr)")
+    ap.add_argument("--metrics-file", default=METRICS_FILE or None, metavar="FILE", help="Write Prometheus textfile-collector metrics for the run to FILE")
     ap.add_argument("--version", action="version", version=f"%(prog)s {__version__}")
     args=ap.parse_args()
 
-    global _PROGRESS_ENABLED
     _PROGRESS_ENABLED = (not args.no_progress)
+    METADATA_MODE=args.metadata_mode
+    TEXT_BACKEND=args.text_backend
+    if args.no_rules: RULES_ENABLED=False
+    if args.no_templates: TEMPLATES_ENABLED=False
+    DUPLICATE_MODE=args.duplicates
+    if args.lm_pool_size:
+        LLM_POOL_SIZE=args.lm_pool_size
+    else:
+        LLM_POOL_SIZE=max(LLM_POOL_SIZE, args.jobs)
+    max_inflight=args.lm_concurrency or LLM_CONCURRENCY or args.jobs
+    _LLM_CONTROLLER=_LlmController(max_inflight, max_limit=max_inflight)
+    endpoints=args.lm_endpoint
+    if endpoints is None and LLM_ENDPOINTS.strip():
+        try:
+            endpoints=[_parse_endpoint(sp) for sp in re.split(r"[\s;]+", LLM_ENDPOINTS.strip())]
+        except ValueError as e:
+            print(f"Error: LLM_ENDPOINTS: {e}")
+            return 2
+    batch=min(args.lm_batch or LLM_BATCH, args.jobs)
+    _LLM_BATCHER=_LlmBatcher(batch) if batch > 1 else None
     if args.print_json and (not sys.stdout.isatty()) and (not _PROGRESS_FORCE):
         # Keep stdout machine-readable when piping JSON.
         _PROGRESS_ENABLED=False
 
-    pdf_input=args.pdf
-    if not os.path.isfile(pdf_input):
-        print("File not found:", pdf_input)
+    journal_path=args.journal or (None if (args.no_journal or not CACHE_ENABLED) else JOURNAL_PATH)
+    if args.resume and not journal_path:
+        print("Error: --resume needs the job journal (drop --no-journal or pass --journal FILE)")
+        return 2
+    if journal_path and not args.dry_run:
+        try:
+            _JOURNAL=_Journal(journal_path)
+        except Exception as e:
+            if args.resume:
+                print(f"Error: cannot open journal {journal_path}: {e}")
+                return 2
+            _progress(f"Journal disabled: {type(e).__name__}: {e}")
+            _JOURNAL=None
+    if endpoints:
+        _LLM_ROUTER=_LlmRouter(endpoints)
+        _LLM_ROUTER.start()
+    try:
+        return _main_run(args)
+    finally:
+        if _LLM_ROUTER is not None:
+            _LLM_ROUTER.close()
+            _LLM_ROUTER=None
+        if _JOURNAL is not None:
+            _JOURNAL.close()
+            _JOURNAL=None
+
+def _main_run(args):
+    global _PROGRESS_ENABLED
+    if args.watch:
+        args.resume=args.resume or (_JOURNAL is not None)  # a restarted watcher skips what it already did
+        bad=[d for d in args.pdf if not os.path.isdir(d)]
+        if bad:
+            print("Error: --watch needs existing directories:", " ".join(bad))
+            return 2
+        if args.metadata_only:
+            print("Error: --watch is incompatible with --metadata-only")
+            return 2
+        _tracing_start(args.trace, args.metrics_file)
+        try:
+            return _run_watch(args.pdf, args)
+        finally:
+            _tracing_finish(args.metrics_file)
+
+    skip_dirs=[args.outdir] if args.outdir else []
+    skip_names=[] if args.outdir else ["processed"]
+    inputs, missing=_expand_inputs(args.pdf, recursive=args.recursive, skip_dirs=skip_dirs, skip_names=skip_names)
+    orphans=_journal_orphans(args.pdf, inputs, _journal_mode(args)) if args.resume else []
+    if orphans:
+        resumed={r["input"] for r in orphans}
+        missing=[m for m in missing if os.path.abspath(m) not in resumed]
+    for m in missing:
+        print("File not found:", m)
+    if not inputs and not orphans:
+        if not missing:
+            print("No PDF files found:", " ".join(args.pdf))
         return 2
 
     if args.metadata_only:
@@ -772,112 +4693,16 @@ def main() -> int:
         if args.dry_run and (not _PROGRESS_FORCE):
             _PROGRESS_ENABLED=False
 
-        try:
-            lm_timeout=max(1, int(args.lm_timeout))
-            lm_retries=max(0, int(args.lm_retries))
-            info, raw_text=extract_information(pdf_input, lm_timeout=lm_timeout, lm_retries=lm_retries, allow_repair=(not args.no_repair), keywords_count=args.keywords_count)
-        except RuntimeError as e:
-            print("Failed to process PDF:", str(e))
-            print("Hint: the PDF may be corrupt; installing qpdf/ghostscript can sometimes repair it.")
-            return 1
-        if (not info) and raw_text:
-            _progress("[4/4] Falling back to heuristic extraction")
-            info=_heuristic_extract(raw_text)
-
-        if not info:
-            print("Failed to extract information.")
-            return 1
-
-        if args.print_json and (not args.dry_run):
-            print(json.dumps(info, indent=2, ensure_ascii=False))
-
-        title=pretty_title_from_filename(os.path.basename(pdf_input))
-        docinfo={
-            "/Title": title,
-            "/Author": info.get("author") or info.get("provider"),
-            "/Subject": info.get("subject"),
-            "/Keywords": format_keywords(info.get("keywords", []), args.keywords_count),
-        }
-        creation_date=pdf_creation_date_from_ymd(info.get("date"))
-        if creation_date:
-            docinfo["/CreationDate"]=creation_date
-            docinfo["/ModDate"]=creation_date
-
-        if args.dry_run:
-            print(json.dumps(docinfo, indent=2, ensure_ascii=False))
-            return 0
-
-        progress_prev=_PROGRESS_ENABLED
-        try:
-            _PROGRESS_ENABLED=False
-            ok, reason=write_pdf_metadata_in_place(pdf_input, docinfo)
-        finally:
-            _PROGRESS_ENABLED=progress_prev
-        if not ok:
-            print(reason or "write_failed")
-            return 1
-        return 0
-
-    _progress(f"Processing: {os.path.basename(pdf_input)}")
-
-    original_dir=os.path.dirname(os.path.abspath(pdf_input))
-    outdir=args.outdir or os.path.join(original_dir, "processed")
-    os.makedirs(outdir, exist_ok=True)
-    _progress(f"Output dir: {outdir}")
-
+    t0=time.monotonic()
+    _tracing_start(args.trace, args.metrics_file)
     try:
-        lm_timeout=max(1, int(args.lm_timeout))
-        lm_retries=max(0, int(args.lm_retries))
-        info, raw_text=extract_information(pdf_input, lm_timeout=lm_timeout, lm_retries=lm_retries, allow_repair=(not args.no_repair), keywords_count=args.keywords_count)
-    except RuntimeError as e:
-        print("Failed to process PDF:", str(e))
-        print("Hint: the PDF may be corrupt; installing qpdf/ghostscript can sometimes repair it.")
-        return 1
-    if not info and raw_text:
-        _progress("[4/4] Falling back to heuristic extraction")
-        info=_heuristic_extract(raw_text)
-
-    if not info:
-        print("Failed to extract information.")
-        return 1
-
-    if args.print_json:
-        print(json.dumps(info, indent=2, ensure_ascii=False))
-
-    new_name=create_filename(info)
-    dst=_unique_path(os.path.join(outdir, new_name))
-
-    print("Proposed:", os.path.basename(dst))
-    if args.dry_run: return 0
-
-    docinfo={
-        "/Title": pretty_title_from_filename(os.path.basename(dst)),
-        "/Author": info.get("author") or info.get("provider"),
-        "/Subject": info.get("subject"),
-        "/Keywords": format_keywords(info.get("keywords", []), args.keywords_count),
-    }
-    creation_date=pdf_creation_date_from_ymd(info.get("date"))
-    if creation_date:
-        docinfo["/CreationDate"]=creation_date
-        docinfo["/ModDate"]=creation_date
+        results=_run_batch(inputs, args, resume_rows=orphans)
+    finally:
+        _tracing_finish(args.metrics_file)
 
-    if args.move:
-        _progress("[4/4] Moving file")
-        shutil.move(pdf_input, dst)
-        try:
-            write_pdf_metadata_in_place(dst, docinfo)
-        except Exception:
-            _progress("  metadata skipped: write_failed")
-        print("Moved to:", dst)
-    else:
-        _progress("[4/4] Copying file")
-        shutil.copy2(pdf_input, dst)
-        try:
-            write_pdf_metadata_in_place(dst, docinfo)
-        except Exception:
-            _progress("  metadata skipped: write_failed")
-        print("Copied to:", dst)
-    return 0
+    if len(inputs)+len(orphans)+len(missing) > 1:
+        _print_batch_summary(results, missing, t0)
+    return max([r["rc"] for r in results]+([2] if missing else []))
 
 if __name__=="__main__":
     raise SystemExit(main())
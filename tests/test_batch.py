@@ -0,0 +1,143 @@
+import unittest
+import os, sys, io, time, tempfile, contextlib
+from unittest.mock import patch
+
+import scanfile_rename as s
+
+
+def _touch(path: str) -> str:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4\n")
+    return path
+
+
+def _run_main(argv):
+    buf=io.StringIO()
+    with patch.object(sys, "argv", argv), \
+         patch.object(s, "CACHE_ENABLED", False), \
+         contextlib.redirect_stdout(buf), \
+         contextlib.redirect_stderr(buf):
+        try:
+            rc=s.main()
+        except SystemExit as e:
+            rc=e.code
+            if not isinstance(rc, int):
+                rc=1
+    return rc, buf.getvalue()
+
+
+class TestExpandInputs(unittest.TestCase):
+    def test_directory_non_recursive_only_top_level_pdfs(self):
+        with tempfile.TemporaryDirectory() as td:
+            a=_touch(os.path.join(td, "a.pdf"))
+            _touch(os.path.join(td, "notes.txt"))
+            _touch(os.path.join(td, "sub", "b.pdf"))
+            found, missing=s._expand_inputs([td])
+            self.assertEqual(found, [a])
+            self.assertEqual(missing, [])
+
+    def test_directory_recursive_skips_output_dir_names(self):
+        with tempfile.TemporaryDirectory() as td:
+            a=_touch(os.path.join(td, "a.pdf"))
+            b=_touch(os.path.join(td, "sub", "b.PDF"))
+            _touch(os.path.join(td, "processed", "done.pdf"))
+            found, _missing=s._expand_inputs([td], recursive=True, skip_names=["processed"])
+            self.assertEqual(found, [a, b])
+
+    def test_glob_and_missing_and_dedup(self):
+        with tempfile.TemporaryDirectory() as td:
+            a=_touch(os.path.join(td, "a.pdf"))
+            b=_touch(os.path.join(td, "b.pdf"))
+            found, missing=s._expand_inputs([os.path.join(td, "*.pdf"), a, os.path.join(td, "nope.pdf")])
+            self.assertEqual(found, [a, b])
+            self.assertEqual(missing, [os.path.join(td, "nope.pdf")])
+
+
+class TestReserveUniquePath(unittest.TestCase):
+    def test_reserved_names_are_not_reused(self):
+        with tempfile.TemporaryDirectory() as td:
+            base=os.path.join(td, "x.pdf")
+            with patch.object(s, "_RESERVED_PATHS", set()):
+                p1=s._reserve_unique_path(base)
+                p2=s._reserve_unique_path(base)
+            self.assertEqual(p1, base)
+            self.assertEqual(p2, os.path.join(td, "x (2).pdf"))
+
+
+class TestBatchCli(unittest.TestCase):
+    def tearDown(self):
+        s._PROGRESS_ENABLED=True
+
+    def test_batch_dry_run_summary_and_aggregate_rc(self):
+        with tempfile.TemporaryDirectory() as td:
+            good=_touch(os.path.join(td, "good.pdf"))
+            bad=_touch(os.path.join(td, "bad.pdf"))
+            info={"date":"2024-01-02", "provider":"Acme", "document_type":"Invoice", "title":"Test"}
+
+            def fake_extract(pdf_input, **_kwargs):
+                return (info, "") if pdf_input == good else (None, "")
+
+            with patch.object(s, "extract_information", side_effect=fake_extract), \
+                 patch.object(s.shutil, "copy2") as copy2:
+                rc, out=_run_main(["scanfile_rename.py", td, "--dry-run", "--jobs", "2", "--no-progress"])
+
+            self.assertEqual(rc, 1)
+            copy2.assert_not_called()
+            self.assertIn("Summary: 1 ok, 1 failed", out)
+            self.assertIn(f"[ok] {good}", out)
+            self.assertIn(f"[FAIL] {bad}", out)
+
+    def test_missing_input_yields_exit_code_2(self):
+        with tempfile.TemporaryDirectory() as td:
+            rc, out=_run_main(["scanfile_rename.py", os.path.join(td, "nope.pdf")])
+        self.assertEqual(rc, 2)
+        self.assertIn("File not found", out)
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+
+class TestStagedPipeline(unittest.TestCase):
+    def tearDown(self):
+        s._PROGRESS_ENABLED=True
+
+    def test_pipeline_prefetches_text_and_keeps_input_order(self):
+        with tempfile.TemporaryDirectory() as td:
+            paths=[_touch(os.path.join(td, f"d{i}.pdf")) for i in range(5)]
+            seen={}
+
+            def fake_extract(pdf_input, **kwargs):
+                seen[pdf_input]=kwargs.get("prepared_text")
+                return {"date":"2024-01-02", "provider":os.path.basename(pdf_input), "document_type":"Bill", "title":"T"}, ""
+
+            with patch.object(s, "_pdftotext", side_effect=lambda p: (f"text of {p}", 0, "")), \
+                 patch.object(s, "extract_information", side_effect=fake_extract), \
+                 patch.object(s, "write_pdf_metadata_in_place", return_value=(True, None)) as writer:
+                rc, out=_run_main(["scanfile_rename.py", *paths, "--jobs", "3", "--no-progress", "--outdir", os.path.join(td, "out")])
+
+            self.assertEqual(rc, 0)
+            self.assertEqual(writer.call_count, 5)
+            self.assertEqual({p:v[0] for p, v in seen.items()}, {p:f"text of {p}" for p in paths})
+            summary=out[out.index("Summary:"):]
+            self.assertEqual([ln.split("] ")[1].split(" -> ")[0] for ln in summary.splitlines() if ln.startswith("  [ok]")], paths)
+            self.assertEqual(len(os.listdir(os.path.join(td, "out"))), 5)
+
+    def test_summary_times_each_file_on_its_own(self):
+        with tempfile.TemporaryDirectory() as td:
+            slow=_touch(os.path.join(td, "a.pdf"))
+            fast=_touch(os.path.join(td, "b.pdf"))
+
+            def fake_extract(pdf_input, **_kwargs):
+                if pdf_input == slow: time.sleep(0.3)
+                return {"date":"2024-01-02", "provider":"Acme", "document_type":"Bill", "title":os.path.basename(pdf_input)}, ""
+
+            with patch.object(s, "extract_information", side_effect=fake_extract), \
+                 patch.object(s, "_print_batch_summary") as summary:
+                rc, _out=_run_main(["scanfile_rename.py", slow, fast, "--dry-run", "--jobs", "1", "--no-progress"])
+
+            self.assertEqual(rc, 0)
+            secs={r["input"]:r["secs"] for r in summary.call_args[0][0]}
+            self.assertGreaterEqual(secs[slow], 0.3)
+            self.assertLess(secs[fast], 0.3)  # not the batch's elapsed time
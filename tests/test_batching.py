@@ -0,0 +1,99 @@
+import unittest
+import json, re, threading
+from unittest.mock import patch
+
+import scanfile_rename as s
+
+
+def _reply(ids, skip=()):
+    return json.dumps([{"id":i, "date":"2024-01-0%d" % (k+1), "provider":f"P{i}", "document_type":"Receipt", "title":"T"}
+                       for k, i in enumerate(ids) if i not in skip])
+
+
+class TestJsonObjects(unittest.TestCase):
+    def test_truncated_array_keeps_complete_elements(self):
+        out='```json\n[{"id": 1, "title": "A {x}"}, {"id": 2, "title": "B"}, {"id": 3, "tit'
+        self.assertEqual(s._json_objects_loose(out), [{"id":1, "title":"A {x}"}, {"id":2, "title":"B"}])
+        self.assertEqual(s._json_objects_loose(None), [])
+
+
+class TestLlmBatcher(unittest.TestCase):
+    def setUp(self):
+        self._patches=[patch.object(s, "_BATCH_STATS", {"requests":0, "docs":0, "failed":0}), patch.object(s, "_MODEL_STATE", {}),
+                       patch.object(s, "LLM_CONTEXT_PROBE", False), patch.object(s, "_update_model_state", lambda *_a, **_k: None),
+                       patch.object(s, "_progress", lambda *_a, **_k: None)]
+        for p in self._patches: p.start()
+
+    def tearDown(self):
+        for p in self._patches: p.stop()
+
+    def _submit_all(self, batcher, texts):
+        results=[None]*len(texts)
+
+        def run(i):
+            results[i]=batcher.submit(texts[i])
+
+        ts=[threading.Thread(target=run, args=(i,)) for i in range(len(texts))]
+        for t in ts: t.start()
+        for t in ts: t.join(10)
+        return results
+
+    def test_one_request_and_failed_elements_come_back_as_none(self):
+        calls=[]
+
+        def fake_llm(messages, max_tokens=350, **_kw):
+            prompt=messages[-1]["content"]
+            ids=[int(x) for x in re.findall(r"=== DOCUMENT (\d+) ===", prompt)]
+            calls.append((ids, max_tokens))
+            return _reply(ids, skip=ids[1:2]), None
+
+        with patch.object(s, "_call_llm", side_effect=fake_llm):
+            results=self._submit_all(s._LlmBatcher(3, linger=5), ["receipt one", "receipt two", "receipt three"])
+        self.assertEqual(len(calls), 1)
+        self.assertEqual((len(calls[0][0]), calls[0][1]), (3, 3*s._BATCH_REPLY_TOKENS))
+        self.assertEqual(sum(r is None for r in results), 1)
+        self.assertTrue(all("id" not in r for r in results if r))
+        self.assertEqual(s._batch_stats_line(), "Batched LLM: 3 document(s) in 1 request(s), 1 sent again on their own")
+
+    def test_batch_is_sized_to_the_context_window_and_never_sent_alone(self):
+        calls=[]
+
+        def fake_llm(messages, **_kw):
+            ids=[int(x) for x in re.findall(r"=== DOCUMENT (\d+) ===", messages[-1]["content"])]
+            calls.append(ids)
+            return _reply(ids), None
+
+        base=s._request_tokens(s._SYSTEM_PROMPT, s._prompt_from_text_batch([]))
+        doc=s._estimate_tokens("x"*600)
+        ctx=int((base+2*(doc+s._BATCH_REPLY_TOKENS+10))/s._CONTEXT_SAFETY)  # room for two documents
+        with patch.object(s, "_call_llm", side_effect=fake_llm), patch.object(s, "LLM_CONTEXT_WINDOW", ctx):
+            results=self._submit_all(s._LlmBatcher(3, linger=1), ["x"*600]*3)
+        self.assertEqual([len(c) for c in calls], [2])
+        self.assertEqual(sum(r is None for r in results), 1)
+
+
+class TestBatchedExtraction(unittest.TestCase):
+    TEXT="Corner Market\nReceipt\nDate 2024-01-02\nMilk 2.99\nBread 3.49\nTotal 6.48\nThank you for shopping with us\n"*3
+
+    def _extract(self, batch_result):
+        batcher=type("B", (), {"submit":lambda _self, *_a, **_k: batch_result})()
+        with patch.object(s, "_LLM_BATCHER", batcher), patch.object(s, "RULES_ENABLED", False), patch.object(s, "TEMPLATES_ENABLED", False), \
+             patch.object(s, "LLM_CONTEXT_PROBE", False), patch.object(s, "_progress", lambda *_a, **_k: None), \
+             patch.object(s, "_pdftotext", return_value=(self.TEXT, 0, "")), \
+             patch.object(s, "_call_llm", return_value=('{"date":"2024-01-02","provider":"Single","document_type":"Receipt","title":"T"}', None)) as llm:
+            info, _text=s.extract_information("r.pdf")
+        return info, llm
+
+    def test_batched_answer_skips_the_single_request(self):
+        info, llm=self._extract({"date":"2024-01-02", "provider":"Batched", "document_type":"Receipt", "title":"T", "keywords":["a", "b"]})
+        llm.assert_not_called()
+        self.assertEqual(info["provider"], "Batched")
+
+    def test_failed_element_is_retried_on_its_own(self):
+        info, llm=self._extract(None)
+        self.assertEqual(llm.call_count, 1)
+        self.assertEqual(info["provider"], "Single")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import unittest
+import os, tempfile
+from unittest.mock import patch
+
+import scanfile_rename as s
+
+
+def _write(path: str, data: bytes) -> str:
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+class TestExtractionCacheKey(unittest.TestCase):
+    def test_key_depends_on_model_keywords_and_prompt(self):
+        k=s._extraction_cache_key("ab"*32, 5)
+        self.assertEqual(k, s._extraction_cache_key("ab"*32, 5))
+        self.assertNotEqual(k, s._extraction_cache_key("ab"*32, 3))
+        self.assertNotEqual(k, s._extraction_cache_key("cd"*32, 5))
+        with patch.object(s, "LLM_MODEL", "other-model"):
+            self.assertNotEqual(k, s._extraction_cache_key("ab"*32, 5))
+        with patch.object(s, "_SYSTEM_PROMPT", "changed"):
+            self.assertNotEqual(k, s._extraction_cache_key("ab"*32, 5))
+
+
+class TestCachedExtractInformation(unittest.TestCase):
+    def test_hit_skips_extraction_and_refresh_bypasses(self):
+        info={"date":"2024-01-02", "provider":"Acme"}
+        with tempfile.TemporaryDirectory() as td:
+            pdf=_write(os.path.join(td, "a.pdf"), b"%PDF-1.4 cache test\n")
+            cache_dir=os.path.join(td, "cache")
+            with patch.object(s, "_progress", lambda *_a, **_k: None), \
+                 patch.object(s, "extract_information", return_value=(info, "text")) as extract:
+                self.assertEqual(s.cached_extract_information(pdf, cache_dir=cache_dir, keywords_count=5), (info, "text"))
+                self.assertEqual(s.cached_extract_information(pdf, cache_dir=cache_dir, keywords_count=5), (info, ""))
+                self.assertEqual(extract.call_count, 1)
+                s.cached_extract_information(pdf, cache_dir=cache_dir, refresh=True, keywords_count=5)
+                self.assertEqual(extract.call_count, 2)
+
+    def test_failed_extraction_is_not_cached(self):
+        with tempfile.TemporaryDirectory() as td:
+            pdf=_write(os.path.join(td, "a.pdf"), b"%PDF-1.4 miss\n")
+            cache_dir=os.path.join(td, "cache")
+            with patch.object(s, "_progress", lambda *_a, **_k: None), \
+                 patch.object(s, "extract_information", return_value=(None, "")) as extract:
+                s.cached_extract_information(pdf, cache_dir=cache_dir)
+                s.cached_extract_information(pdf, cache_dir=cache_dir)
+            self.assertEqual(extract.call_count, 2)
+
+    def test_entries_are_keyed_by_the_model_that_answered(self):
+        router=s._LlmRouter([{"url":"http://a/v1/chat/completions", "model":"small", "max":0}, {"url":"http://b/v1/chat/completions", "model":"large", "max":0}])
+
+        def fake_extract(_pdf, **_kw):
+            s._TLS.last_model="large"
+            return {"date":"2024-01-02", "provider":"Acme"}, "text"
+
+        with tempfile.TemporaryDirectory() as td:
+            pdf=_write(os.path.join(td, "a.pdf"), b"%PDF-1.4 model test\n")
+            cache_dir=os.path.join(td, "cache")
+            with patch.object(s, "_progress", lambda *_a, **_k: None), patch.object(s, "_LLM_ROUTER", router), \
+                 patch.object(s, "extract_information", side_effect=fake_extract) as extract:
+                s.cached_extract_information(pdf, cache_dir=cache_dir)
+                self.assertEqual(s.cached_extract_information(pdf, cache_dir=cache_dir)[1], "")
+                self.assertEqual(extract.call_count, 1)
+            sha=s._file_sha256(pdf)
+            self.assertIsNotNone(s._cache_get(cache_dir, s._extraction_cache_key(sha, 5, model="large")))
+            self.assertIsNone(s._cache_get(cache_dir, s._extraction_cache_key(sha, 5, model="small")))
+            with patch.object(s, "_progress", lambda *_a, **_k: None):  # LLM_MODEL alone never saw this file
+                self.assertEqual(s._cache_lookup(pdf, cache_dir), (sha, None))
+
+
+class TestCacheEviction(unittest.TestCase):
+    def test_overwritten_entry_is_counted_once(self):
+        with tempfile.TemporaryDirectory() as td:
+            s._CACHE_BYTES.pop(td, None)
+            s._cache_put(td, "aa"+"0"*62, {"title":"x"}, max_bytes=10**6)
+            for _ in range(3):
+                s._cache_put(td, "aa"+"0"*62, {"title":"x"}, max_bytes=10**6)
+            self.assertEqual(s._CACHE_BYTES[td], sum(e[1] for e in s._cache_scan(td)))
+
+    def test_lru_eviction_keeps_recently_used(self):
+        with tempfile.TemporaryDirectory() as td:
+            info={"title":"x"*400}
+            s._cache_put(td, "aa"+"0"*62, info, max_bytes=10**6)
+            s._cache_put(td, "bb"+"0"*62, info, max_bytes=10**6)
+            old=s._cache_entry_path(td, "aa"+"0"*62)
+            os.utime(old, (1, 1))
+            os.utime(s._cache_entry_path(td, "bb"+"0"*62), (2, 2))
+            self.assertIsNotNone(s._cache_get(td, "aa"+"0"*62))  # touch -> most recent
+            s._CACHE_BYTES.pop(td, None)
+            s._cache_put(td, "cc"+"0"*62, info, max_bytes=1100)
+            self.assertIsNotNone(s._cache_get(td, "aa"+"0"*62))
+            self.assertIsNone(s._cache_get(td, "bb"+"0"*62))
+            self.assertIsNotNone(s._cache_get(td, "cc"+"0"*62))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+from unittest.mock import patch
+
+import scanfile_rename as s
+
+
+def _statement(pages: int=30) -> str:
+    first=[
+        "ACME ENERGY CO",
+        "PO Box 100, Springfield",
+        "Monthly Statement",
+        "Statement Date: March 3, 2024",
+        "Account Number 1234-5678",
+    ]+[f"usage row {i} kWh {i*3}" for i in range(60)]
+    middle=[[f"detail p{p} row {i} lorem ipsum dolor sit amet" for i in range(60)] for p in range(1, pages-1)]
+    last=[f"filler {i}" for i in range(40)]+["Total Amount Due $123.45", "Due Date 03/28/2024"]
+    return "\f".join(["\n".join(first)]+["\n".join(m) for m in middle]+["\n".join(last)])
+
+
+class TestRankedCompaction(unittest.TestCase):
+    def test_short_text_passes_through(self):
+        self.assertEqual(s._compact_text_ranked("Invoice\nAcme\n2024-01-02", 7000), "Invoice\nAcme\n2024-01-02")
+
+    def test_excerpt_is_small_and_covers_fields(self):
+        out=s._compact_text_ranked(_statement(), 7000)
+        self.assertLessEqual(len(out), s.COMPACT_TARGET_CHARS+200)
+        self.assertIn("ACME ENERGY CO", out)
+        self.assertIn("Statement Date: March 3, 2024", out)
+        self.assertIn("Monthly Statement", out)
+        self.assertIn("Total Amount Due $123.45", out)
+        self.assertIn("[page 1]", out)
+        self.assertLess(len(out), len(s._compact_text_legacy(_statement(), 7000)))
+
+    def test_respects_max_chars(self):
+        self.assertLessEqual(len(s._compact_text_ranked(_statement(), 300)), 300)
+
+    def test_legacy_is_the_default_and_ranked_is_opt_in(self):
+        self.assertEqual(s._compact_text(_statement(), 7000), s._compact_text_legacy(_statement(), 7000))
+        with patch.object(s, "COMPACT_MODE", "ranked"):
+            self.assertEqual(s._compact_text(_statement(), 7000), s._compact_text_ranked(_statement(), 7000))
+
+
+if __name__ == "__main__":
+    unittest.main()
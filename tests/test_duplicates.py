@@ -0,0 +1,188 @@
+import unittest
+import os, sys, io, tempfile, contextlib
+from unittest.mock import patch
+
+import scanfile_rename as s
+
+
+LETTER="""Dear Customer,
+Thank you for your payment of $120.00 received on March 3, 2024 for account 1234-5678.
+Your next statement will be mailed on April 1, 2024. If you have any questions about your
+service, please call our customer service team at 1-800-555-0100 between 8am and 6pm.
+We appreciate your business and look forward to serving you in the coming year.
+Sincerely, Northwind Water Utility, Customer Accounts Department, Riverside
+"""
+
+
+def _ppm(w, h, ink):
+    # White page with black rectangles [(x0, y0, x1, y1), ...].
+    px=bytearray(b"\xff"*(w*h*3))
+    for x0, y0, x1, y1 in ink:
+        for y in range(y0, y1):
+            px[(y*w+x0)*3:(y*w+x1)*3]=b"\x00"*((x1-x0)*3)
+    return f"P6\n{w} {h}\n255\n".encode()+bytes(px)
+
+
+def _write(path, data=b"%PDF-1.4\n"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+class TestFingerprints(unittest.TestCase):
+    def test_text_fingerprint_survives_ocr_noise_but_not_other_numbers(self):
+        a=s._text_fingerprint(LETTER)
+        rescan=s._text_fingerprint(LETTER.replace("appreciate", "appreciatc").replace("Riverside", "Rivers1de"))
+        next_month=s._text_fingerprint(LETTER.replace("$120.00", "$98.10").replace("March 3", "April 2"))
+        self.assertEqual(rescan[1], a[1])
+        self.assertLessEqual((a[0] ^ rescan[0]).bit_count(), s.DUPLICATE_TEXT_DISTANCE)
+        self.assertNotEqual(next_month[1], a[1])
+        self.assertIsNone(s._text_fingerprint("Invoice total 12.00"))
+
+    def test_page_dhash_ignores_margins_and_blank_pages(self):
+        boxes=[(0, 0, 40, 6), (0, 10, 60, 14), (30, 20, 60, 40), (0, 50, 20, 70)]
+        a=s._page_dhash(_ppm(100, 130, [(x0+10, y0+10, x1+10, y1+10) for x0, y0, x1, y1 in boxes]))
+        shifted=s._page_dhash(_ppm(100, 130, [(x0+14, y0+7, x1+14, y1+7) for x0, y0, x1, y1 in boxes]))
+        self.assertEqual(a, shifted)
+        self.assertNotEqual(a, s._page_dhash(_ppm(100, 130, [(10, 10, 70, 80)])))
+        self.assertIsNone(s._page_dhash(_ppm(100, 130, [])))
+
+
+class TestDuplicateIndex(unittest.TestCase):
+    def setUp(self):
+        self.td=tempfile.TemporaryDirectory()
+        self.db=s._DuplicateIndex(os.path.join(self.td.name, "duplicates.sqlite3"))
+        self.out=os.path.join(self.td.name, "out")
+
+    def tearDown(self):
+        self.db.close()
+        self.td.cleanup()
+
+    def _sync(self):
+        fps={}
+
+        def fake(path):
+            fps[path]=True
+            return {"sha256":s._file_sha256(path), "kind":"text", "fp":0 if path.endswith("a.pdf") else (1 << 64)-1, "key":7}
+
+        with patch.object(s, "_fingerprint_file", side_effect=fake):
+            n=self.db.sync(self.out)
+        return n, sorted(fps)
+
+    def test_sync_only_fingerprints_new_files_when_the_directory_changed(self):
+        a=_write(os.path.join(self.out, "a.pdf"), b"%PDF-1.4 a")
+        _write(os.path.join(self.out, "notes.txt"))
+        self.assertEqual(self._sync(), (1, [a]))
+        self.assertEqual(self._sync(), (0, []))  # directory mtime unchanged: not listed
+        b=_write(os.path.join(self.out, "bb.pdf"), b"%PDF-1.4 b")
+        os.unlink(a)
+        self.assertEqual(self._sync(), (1, [b]))
+        self.assertEqual(self.db.find({"sha256":s._file_sha256(b), "kind":None, "fp":None, "key":None}), (b, None))
+        self.assertIsNone(self.db.find({"sha256":"x", "kind":"text", "fp":0, "key":7}))  # a.pdf's row is gone
+        self.assertEqual(self.db.find({"sha256":"x", "kind":"text", "fp":(1 << 64)-2, "key":7}), (b, 1))
+        self.assertIsNone(self.db.find({"sha256":"x", "kind":"text", "fp":(1 << 64)-2, "key":8}))
+
+    def test_placed_file_does_not_relist_the_directory(self):
+        _write(os.path.join(self.out, "a.pdf"), b"%PDF-1.4 a")
+        self.assertEqual(self._sync()[0], 1)
+        b=_write(os.path.join(self.out, "b.pdf"), b"%PDF-1.4 b")
+        os.utime(self.out, ns=(1, 1))  # the write's directory change, even with a coarse clock
+        self.db.placed(b, os.stat(b), {"sha256":None, "kind":None, "fp":None, "key":None}, source_sha256="src")
+        with patch.object(s.os, "scandir", side_effect=AssertionError("directory listed")):
+            self.assertEqual(self.db.sync(self.out), 0)
+        self.assertEqual(self.db.find({"sha256":"src", "kind":None, "fp":None, "key":None}), (b, None))
+
+    def test_find_matches_near_fingerprints_and_drops_stale_rows(self):
+        p=_write(os.path.join(self.out, "x.pdf"))
+        h=(1 << 63) | 0xABCDEF
+        self.db.put(p, os.stat(p), {"sha256":None, "kind":"image", "fp":h, "key":2}, source_sha256="src")
+        self.assertEqual(self.db.find({"sha256":"src", "kind":None, "fp":None, "key":None}), (p, None))
+        self.assertEqual(self.db.find({"sha256":"y", "kind":"image", "fp":h ^ 0b11, "key":2}), (p, 2))
+        self.assertIsNone(self.db.find({"sha256":"y", "kind":"image", "fp":h ^ 0b1111, "key":2}))
+        self.assertIsNone(self.db.find({"sha256":"y", "kind":"image", "fp":h ^ 0b11, "key":3}))  # other page count
+        self.assertIsNone(self.db.find({"sha256":"y", "kind":"text", "fp":h, "key":2}))
+        self.assertIsNone(self.db.find({"sha256":"src", "kind":None, "fp":None, "key":None}, exclude=p))
+        os.unlink(p)
+        self.assertIsNone(self.db.find({"sha256":"src", "kind":None, "fp":None, "key":None}))
+
+
+class TestDuplicateCli(unittest.TestCase):
+    def setUp(self):
+        self.td=tempfile.TemporaryDirectory()
+        self._patches=[patch.object(s, "CACHE_ENABLED", True), patch.object(s, "DUPLICATE_MODE", "off"), patch.object(s, "DUPLICATE_INDEX", os.path.join(self.td.name, "duplicates.sqlite3")),
+                       patch.object(s, "_DUPLICATE_DB", None), patch.object(s, "_DUPLICATE_SEEN", []),
+                       patch.object(s, "_DUPLICATE_STATS", {"checked":0, "exact":0, "near":0, "skipped":0}),
+                       patch.object(s, "_learn_from_result", lambda *_a: None), patch.object(s, "_RESERVED_PATHS", set()),
+                       patch.object(s, "_pdf_page_count", return_value=1),
+                       patch.object(s, "write_pdf_metadata_in_place", return_value=(False, "skipped"))]
+        for p in self._patches: p.start()
+
+    def tearDown(self):
+        if s._DUPLICATE_DB is not None: s._DUPLICATE_DB.close()
+        for p in self._patches: p.stop()
+        s._PROGRESS_ENABLED=True
+        self.td.cleanup()
+
+    def _run(self, *argv, texts=None):
+        calls=[]
+
+        def fake_extract(pdf_input, **_kwargs):
+            calls.append(pdf_input)
+            return {"date":"2024-03-03", "provider":"Northwind", "document_type":"Bill", "title":"Payment"}, ""
+
+        buf=io.StringIO()
+        with patch.object(sys, "argv", ["scanfile_rename.py", *argv, "--no-cache", "--no-journal", "--no-progress", "--outdir", os.path.join(self.td.name, "out")]), \
+             patch.object(s, "_pdftotext", side_effect=lambda p: ((texts or {}).get(os.path.basename(p), ""), 0, "")), \
+             patch.object(s, "_tool_exists", return_value=False), \
+             patch.object(s, "extract_information", side_effect=fake_extract), \
+             contextlib.redirect_stdout(buf):
+            rc=s.main()
+        return rc, buf.getvalue(), calls
+
+    def test_skip_mode_skips_identical_inputs_without_extracting(self):
+        a=_write(os.path.join(self.td.name, "in", "a.pdf"))
+        b=_write(os.path.join(self.td.name, "in", "b.pdf"))
+        rc, out, calls=self._run(a, b, "--duplicates", "skip", "--jobs", "2")
+        self.assertEqual(rc, 0)
+        self.assertEqual(calls, [a])
+        self.assertIn(f"[ok] {b} -> duplicate of {a}", out)
+        self.assertIn("Duplicates: 1 of 2 document(s) (1 identical, 0 near match), 1 skipped", out)
+        self.assertEqual(len(os.listdir(os.path.join(self.td.name, "out"))), 1)
+
+    def test_off_by_default(self):
+        a=_write(os.path.join(self.td.name, "in", "a.pdf"))
+        b=_write(os.path.join(self.td.name, "in", "b.pdf"))
+        rc, out, calls=self._run(a, b)
+        self.assertEqual((rc, calls), (0, [a, b]))
+        self.assertNotIn("Duplicate", out)
+        self.assertFalse(os.path.exists(s.DUPLICATE_INDEX))
+
+    def test_cache_hit_is_compared_by_hash_without_text(self):
+        a=_write(os.path.join(self.td.name, "in", "a.pdf"))
+        b=_write(os.path.join(self.td.name, "in", "b.pdf"))
+        args=type("Args", (), {"metadata_only":False})()
+        out=os.path.join(self.td.name, "out")
+        buf=io.StringIO()
+        with patch.object(s, "DUPLICATE_MODE", "report"), patch.object(s, "_progress", lambda *_a, **_k: None), contextlib.redirect_stdout(buf):
+            with patch.object(s, "_pdftotext", return_value=(LETTER, 0, "")):
+                self.assertFalse(s._check_duplicate({"input":a, "outdir":out}, args))
+            job={"input":b, "outdir":out, "info":{"title":"T"}, "cache_sha256":s._file_sha256(b)}
+            with patch.object(s, "_pdftotext", side_effect=AssertionError("text extracted on a cache hit")):
+                self.assertFalse(s._check_duplicate(job, args))
+        self.assertEqual(job["fingerprint"]["kind"], None)
+        self.assertIn(f"Duplicate of: {a} (identical)", buf.getvalue())
+
+    def test_rescan_of_a_placed_output_is_reported_on_a_later_run(self):
+        a=_write(os.path.join(self.td.name, "in", "a.pdf"), b"%PDF-1.4 scan 1")
+        rc, _out, _calls=self._run(a, "--duplicates", "report", texts={"a.pdf":LETTER})
+        self.assertEqual(rc, 0)
+        placed=os.path.join(self.td.name, "out", os.listdir(os.path.join(self.td.name, "out"))[0])
+        b=_write(os.path.join(self.td.name, "in", "b.pdf"), b"%PDF-1.4 scan 2")
+        rc, out, calls=self._run(b, "--duplicates", "report", texts={"b.pdf":LETTER.replace("Riverside", "Rivers1de")})
+        self.assertEqual((rc, calls), (0, [b]))
+        self.assertIn(f"Duplicate of: {placed} (text match, distance", out)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,175 @@
+import unittest
+import os, sys, io, tempfile, contextlib
+from unittest.mock import patch
+
+import scanfile_rename as s
+
+
+class _Crash(BaseException):
+    pass
+
+
+INFO={"date":"2024-01-02", "provider":"Acme", "document_type":"Invoice", "title":"Test"}
+NAME="2024-01-02 - Acme - Invoice - Test.pdf"
+
+
+def _run_main(argv, extract=None, metadata=None, place=None):
+    buf=io.StringIO()
+    extract=extract or (lambda pdf_input, **_kw: (dict(INFO), ""))
+    metadata=metadata or (lambda path, docinfo, **_kw: (True, None))
+    with contextlib.ExitStack() as st:
+        st.enter_context(patch.object(sys, "argv", argv))
+        st.enter_context(patch.object(s, "CACHE_ENABLED", False))
+        st.enter_context(patch.object(s, "_RESERVED_PATHS", set()))
+        ex=st.enter_context(patch.object(s, "extract_information", side_effect=extract))
+        md=st.enter_context(patch.object(s, "write_pdf_metadata_in_place", side_effect=metadata))
+        if place is not None:
+            st.enter_context(patch.object(s, "_place_file", side_effect=place))
+        st.enter_context(contextlib.redirect_stdout(buf))
+        try:
+            rc=s.main()
+        except _Crash:
+            rc="crash"
+    return rc, buf.getvalue(), ex, md
+
+
+def _crash(*_a, **_kw):
+    raise _Crash()
+
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        self.td=tempfile.TemporaryDirectory()
+        self.dir=self.td.name
+        self.inbox=os.path.join(self.dir, "inbox")
+        self.out=os.path.join(self.dir, "out")
+        os.makedirs(self.inbox)
+        self.pdf=os.path.join(self.inbox, "scan.pdf")
+        with open(self.pdf, "wb") as f:
+            f.write(b"%PDF-1.4\nscan\n")
+        self.journal=os.path.join(self.dir, "journal.sqlite3")
+
+    def tearDown(self):
+        s._PROGRESS_ENABLED=True
+        self.td.cleanup()
+
+    def _argv(self, *extra):
+        return ["scanfile_rename.py", self.inbox, "--outdir", self.out, "--no-progress", "--journal", self.journal, *extra]
+
+    def _row(self):
+        j=s._Journal(self.journal)
+        try:
+            return j.get(s._file_sha256(self.pdf) if os.path.exists(self.pdf) else j.pending()[0]["sha256"], self.pdf)
+        finally:
+            j.close()
+
+    def test_resume_after_crash_during_metadata_write_reuses_destination(self):
+        rc, _out, _ex, _md=_run_main(self._argv(), metadata=_crash)
+        self.assertEqual(rc, "crash")
+        self.assertEqual(self._row()["state"], "placing")
+        self.assertEqual(os.listdir(self.out), [])  # metadata is written on the way in: nothing half-done under the final name
+
+        rc, out, ex, md=_run_main(self._argv("--resume"))
+        self.assertEqual(rc, 0)
+        ex.assert_not_called()
+        md.assert_called_once()
+        self.assertEqual(md.call_args[1]["src_path"], os.path.abspath(self.pdf))
+        self.assertEqual(os.listdir(self.out), [NAME])  # no " (2)" duplicate
+        self.assertEqual(self._row()["state"], "done")
+
+        rc, out, ex, md=_run_main(self._argv("--resume"))
+        self.assertEqual(rc, 0)
+        self.assertIn("Already done:", out)
+        ex.assert_not_called()
+        md.assert_not_called()
+
+    def test_resume_after_crash_during_copy_skips_llm(self):
+        rc, _out, _ex, _md=_run_main(self._argv(), place=_crash)
+        self.assertEqual(rc, "crash")
+        row=self._row()
+        self.assertEqual(row["state"], "placing")
+        self.assertEqual(row["info"]["provider"], "Acme")
+
+        rc, _out, ex, md=_run_main(self._argv("--resume"))
+        self.assertEqual(rc, 0)
+        ex.assert_not_called()
+        self.assertEqual(os.listdir(self.out), [NAME])
+        self.assertEqual(self._row()["state"], "done")
+
+    def test_resume_after_crash_between_rename_and_placed_keeps_the_output(self):
+        def metadata(path, docinfo, src_path=None, **_kw):
+            with open(src_path or path, "rb") as f:
+                data=f.read()
+            with open(path, "wb") as f:
+                f.write(data+b"% info update\n")  # the output no longer has the input's hash
+            return True, None
+
+        record=s._journal_record
+
+        def crash_at_placed(job, args, state, **kw):
+            if state == "placed": raise _Crash()
+            return record(job, args, state, **kw)
+
+        with patch.object(s, "_journal_record", side_effect=crash_at_placed):
+            rc, _out, _ex, _md=_run_main(self._argv(), metadata=metadata)
+        self.assertEqual((rc, self._row()["state"]), ("crash", "placing"))
+        self.assertEqual(os.listdir(self.out), [NAME])
+
+        rc, out, ex, _md=_run_main(self._argv("--resume"), metadata=metadata)
+        self.assertEqual(rc, 0, out)
+        ex.assert_not_called()
+        self.assertEqual(os.listdir(self.out), [NAME])  # recognized as ours: no " (2)" copy
+        self.assertEqual(self._row()["state"], "done")
+
+    def test_resume_finishes_moved_file_whose_input_is_gone(self):
+        rc, _out, _ex, _md=_run_main(self._argv("--move"), metadata=_crash)
+        self.assertEqual(rc, "crash")
+        self.assertFalse(os.path.exists(self.pdf))
+
+        rc, out, ex, md=_run_main(self._argv("--move", "--resume"))
+        self.assertEqual(rc, 0, out)
+        ex.assert_not_called()
+        md.assert_called_once()
+        self.assertEqual(md.call_args[0][0], os.path.join(self.out, NAME))
+        self.assertEqual(os.listdir(self.out), [NAME])
+
+    def test_resume_places_again_when_destination_was_deleted(self):
+        rc, _out, _ex, _md=_run_main(self._argv())
+        self.assertEqual(rc, 0)
+        os.unlink(os.path.join(self.out, NAME))
+
+        rc, out, ex, md=_run_main(self._argv("--resume"))
+        self.assertEqual(rc, 0, out)
+        ex.assert_not_called()
+        self.assertEqual(md.call_args[1]["src_path"], os.path.abspath(self.pdf))  # written on the way in, from the input
+        self.assertEqual(os.listdir(self.out), [NAME])
+        self.assertEqual(self._row()["state"], "done")
+
+    def test_resume_fails_when_metadata_of_placed_file_cannot_be_written(self):
+        with patch.object(s, "_duplicate_record", side_effect=_crash):
+            rc, _out, _ex, _md=_run_main(self._argv())
+        self.assertEqual((rc, self._row()["state"]), ("crash", "placed"))
+
+        def broken(*_a, **_kw):
+            raise OSError("disk full")
+
+        rc, out, _ex, _md=_run_main(self._argv("--resume"), metadata=broken)
+        self.assertEqual(rc, 1)
+        self.assertNotIn("Copied to:", out)
+        self.assertEqual(self._row()["state"], "placed")
+
+    def test_without_resume_reprocesses(self):
+        _run_main(self._argv())
+        rc, _out, ex, _md=_run_main(self._argv())
+        self.assertEqual(rc, 0)
+        ex.assert_called_once()
+        self.assertEqual(sorted(os.listdir(self.out)), sorted([NAME, NAME.replace(".pdf", " (2).pdf")]))
+
+    def test_resume_requires_journal(self):
+        rc, out, _ex, _md=_run_main(["scanfile_rename.py", self.pdf, "--resume", "--no-journal"])
+        self.assertEqual(rc, 2)
+        self.assertIn("--resume needs the job journal", out)
+
+
+if __name__ == "__main__":
+    unittest.main()
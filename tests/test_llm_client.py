@@ -0,0 +1,228 @@
+import unittest
+import json, threading, http.server
+from unittest.mock import patch
+
+import scanfile_rename as s
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version="HTTP/1.1"
+
+    def do_POST(self):
+        n=int(self.headers.get("Content-Length") or 0)
+        self.rfile.read(n)
+        self._ok()
+
+    def _ok(self):
+        body=json.dumps({"choices":[{"message":{"content":"{\"ok\": true}"}}]}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_args):
+        pass
+
+
+class _LocalServerCase(unittest.TestCase):
+    handler=_Handler
+
+    def setUp(self):
+        self.srv=http.server.ThreadingHTTPServer(("127.0.0.1", 0), self.handler)
+        self.thread=threading.Thread(target=self.srv.serve_forever, daemon=True)
+        self.thread.start()
+        self.endpoint=f"http://127.0.0.1:{self.srv.server_port}/v1/chat/completions"
+
+    def tearDown(self):
+        self.srv.shutdown()
+        self.srv.server_close()
+
+
+class TestPooledHttpClient(_LocalServerCase):
+    def test_connection_reused_across_calls(self):
+        stats={"requests":0, "connections":0, "connect_secs":0.0}
+        lines=[]
+        with patch.object(s, "_HTTP_SESSION", None), \
+             patch.object(s, "_HTTP_STATS", stats), \
+             patch.object(s, "LLM_ENDPOINT", self.endpoint), \
+             patch.object(s, "_progress", lines.append):
+            for _ in range(3):
+                out, err=s._call_llm([{"role":"user", "content":"hi"}], retries=0)
+                self.assertIsNone(err)
+                self.assertEqual(json.loads(out), {"ok":True})
+            s._HTTP_SESSION.close()
+        self.assertEqual(stats["requests"], 3)
+        self.assertEqual(stats["connections"], 1)
+        self.assertEqual(sum("reused connection" in ln for ln in lines), 2)
+        self.assertEqual(sum("new connection" in ln for ln in lines), 1)
+
+
+
+class _OverloadThenOkHandler(_Handler):
+    calls=[]
+
+    def do_POST(self):
+        n=int(self.headers.get("Content-Length") or 0)
+        self.rfile.read(n)
+        self.calls.append(1)
+        if len(self.calls) <= 2:
+            body=b'{"error": "busy"}'
+            self.send_response(429)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        self._ok()
+
+
+class TestBackoff(_LocalServerCase):
+    handler=_OverloadThenOkHandler
+
+    def test_429_is_retried_honoring_retry_after(self):
+        _OverloadThenOkHandler.calls=[]
+        ctl=s._LlmController(4)
+        with patch.object(s, "_HTTP_SESSION", None), \
+             patch.object(s, "LLM_ENDPOINT", self.endpoint), \
+             patch.object(s, "_LLM_CONTROLLER", ctl), \
+             patch.object(s, "_progress", lambda *_a, **_k: None):
+            out, err=s._call_llm([{"role":"user", "content":"hi"}], retries=2)
+            s._HTTP_SESSION.close()
+        self.assertIsNone(err)
+        self.assertEqual(len(_OverloadThenOkHandler.calls), 3)
+        self.assertEqual(ctl.stats["overload"], 2)
+        self.assertEqual(ctl.inflight, 0)
+
+    def test_429_retries_are_bounded_by_the_retry_count(self):
+        _OverloadThenOkHandler.calls=[]
+        with patch.object(s, "_HTTP_SESSION", None), \
+             patch.object(s, "LLM_ENDPOINT", self.endpoint), \
+             patch.object(s, "_progress", lambda *_a, **_k: None):
+            out, err=s._call_llm([{"role":"user", "content":"hi"}], retries=0)
+            s._HTTP_SESSION.close()
+        self.assertEqual((out, err), (None, "busy"))
+        self.assertEqual(len(_OverloadThenOkHandler.calls), 1)
+
+    def test_slot_is_released_when_the_attempt_raises(self):
+        ctl=s._LlmController(4)
+        router=s._LlmRouter([{"url":self.endpoint, "model":"m", "max":0}])
+        session=type("S", (), {"post":lambda *_a, **_k: (_ for _ in ()).throw(KeyError("boom"))})()
+        with patch.object(s, "_http_session", lambda: session), \
+             patch.object(s, "_LLM_CONTROLLER", ctl), \
+             patch.object(s, "_LLM_ROUTER", router), \
+             patch.object(s, "_progress", lambda *_a, **_k: None):
+            with self.assertRaises(KeyError):
+                s._call_llm([{"role":"user", "content":"hi"}])
+        self.assertEqual((ctl.inflight, router.endpoints[0].inflight), (0, 0))
+
+    def test_backoff_delay(self):
+        self.assertEqual(s._backoff_delay(5, retry_after=3, cap=30), 3)
+        self.assertEqual(s._backoff_delay(5, retry_after=300, cap=30), 30)
+        for attempt in range(6):
+            d=s._backoff_delay(attempt, base=1, cap=8)
+            self.assertGreaterEqual(d, 0)
+            self.assertLessEqual(d, min(8, 2**attempt))
+
+
+class TestLlmController(unittest.TestCase):
+    def test_aimd(self):
+        ctl=s._LlmController(4, max_limit=8)
+        with patch.object(s, "_progress", lambda *_a, **_k: None):
+            ctl.acquire(); ctl.release("overload")
+            self.assertEqual(ctl.limit, 2.0)
+            for _ in range(10):
+                ctl.acquire(); ctl.release("ok", latency=1.0)
+            self.assertGreater(ctl.limit, 4.0)
+            before=ctl.limit
+            ctl.acquire(); ctl.release("ok", latency=10.0)
+            self.assertLess(ctl.limit, before)
+
+    def test_breaker_opens_after_consecutive_connection_failures(self):
+        ctl=s._LlmController(4)
+        with patch.object(s, "_progress", lambda *_a, **_k: None), \
+             patch.object(s, "LLM_BREAKER_COOLDOWN", 0.2):
+            for _ in range(3):
+                ctl.acquire(); ctl.release("conn")
+            self.assertEqual(ctl.stats["breaker_trips"], 1)
+            self.assertEqual(ctl.limit, 1.0)
+            t0=s.time.monotonic()
+            ctl.acquire()
+            self.assertGreaterEqual(s.time.monotonic()-t0, 0.15)
+            ctl.release("ok", latency=0.1)
+
+
+class _ModelsHandler(_Handler):
+    seen_models=[]
+
+    def do_POST(self):
+        n=int(self.headers.get("Content-Length") or 0)
+        self.seen_models.append(json.loads(self.rfile.read(n))["model"])
+        body=json.dumps({"choices":[{"message":{"content":"{}"}}], "usage":{"completion_tokens":20}}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        body=json.dumps({"data":[{"id":"box-model", "loaded_context_length":4096}]}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _dead_endpoint():
+    srv=http.server.ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    port=srv.server_port
+    srv.server_close()
+    return f"http://127.0.0.1:{port}/v1"
+
+
+class TestLlmRouter(_LocalServerCase):
+    handler=_ModelsHandler
+
+    def test_parse_endpoint(self):
+        self.assertEqual(s._parse_endpoint("http://gpu1:1234/v1,model=m,max=2"), {"url":"http://gpu1:1234/v1/chat/completions", "model":"m", "max":2})
+        self.assertEqual(s._parse_endpoint("http://gpu2:1234/v1")["max"], 0)
+        for bad in ("", "model=m", "http://x/v1,max=two", "http://x/v1,speed=1"):
+            with self.assertRaises(ValueError):
+                s._parse_endpoint(bad)
+
+    def test_least_loaded_within_max(self):
+        router=s._LlmRouter([{"url":"http://a/v1/chat/completions", "model":"m", "max":1}, {"url":"http://b/v1/chat/completions", "model":"m", "max":0}])
+        a=router.acquire()
+        b=router.acquire()
+        c=router.acquire()
+        self.assertEqual([e.name for e in (a, b, c)], ["a", "b", "b"])  # a is at its max
+        router.release(a, "ok", latency=0.1)
+        self.assertEqual(router.acquire().name, "a")
+
+    def test_health_check_and_failover(self):
+        _ModelsHandler.seen_models=[]
+        router=s._LlmRouter([{"url":_dead_endpoint()+"/chat/completions", "model":"dead-model", "max":0},
+                             {"url":self.endpoint, "model":"box-model", "max":0}], health_interval=0)
+        with patch.object(s, "_HTTP_SESSION", None), \
+             patch.object(s, "_LLM_ROUTER", router), \
+             patch.object(s, "_MODEL_STATE", {}), \
+             patch.object(s, "LLM_CONTEXT_WINDOW", 0), \
+             patch.object(s, "_progress", lambda *_a, **_k: None):
+            router.check()
+            self.assertEqual([e.healthy for e in router.endpoints], [False, True])
+            self.assertEqual(s._context_window(), 4096)
+            router.endpoints[0].healthy=True  # as if it had passed the last check
+            out, err=s._call_llm([{"role":"user", "content":"hi"}], retries=0)
+            s._HTTP_SESSION.close()
+        self.assertEqual((out, err), ("{}", None))
+        self.assertEqual(_ModelsHandler.seen_models, ["box-model"])
+        dead, live=router.endpoints
+        self.assertEqual((dead.healthy, dead.failovers, dead.inflight), (False, 1, 0))
+        self.assertEqual((live.ok, live.completion_tokens, live.inflight), (1, 20, 0))
+        lines=router.summary_lines()
+        self.assertEqual(len(lines), 2)
+        self.assertIn("(box-model): 1 request(s), 1 ok, 0 error(s)", lines[1])
+        self.assertTrue(lines[0].endswith(", down"))
+
+
+if __name__ == "__main__":
+    unittest.main()
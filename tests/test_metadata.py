@@ -16,6 +16,24 @@ def _write_minimal_pdf(path: str) -> None:
         w.write(f)
 
 
+def _write_xref_stream_pdf(path: str) -> None:
+    # Minimal PDF 1.5 file whose cross-reference data is an xref stream (no classic table).
+    objs=[b"<< /Type /Catalog /Pages 2 0 R >>", b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+          b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 72 72] >>"]
+    out=bytearray(b"%PDF-1.5\n")
+    offs=[]
+    for i, o in enumerate(objs, 1):
+        offs.append(len(out))
+        out+=b"%d 0 obj\n%s\nendobj\n" % (i, o)
+    xref_off=len(out)
+    rows=b"\x00"+(0).to_bytes(4, "big")+b"\xff\xff"
+    rows+=b"".join(b"\x01"+o.to_bytes(4, "big")+b"\x00\x00" for o in offs+[xref_off])
+    out+=b"4 0 obj\n<< /Type /XRef /Size 5 /Root 1 0 R /W [1 4 2] /Length %d >>\nstream\n" % len(rows)
+    out+=rows+b"\nendstream\nendobj\nstartxref\n%d\n%%%%EOF\n" % xref_off
+    with open(path, "wb") as f:
+        f.write(bytes(out))
+
+
 def _encrypt_pdf_in_place(path: str, user_password: str, owner_password: str) -> None:
     from pypdf import PdfReader, PdfWriter
 
@@ -97,6 +115,127 @@ class TestWritePdfMetadataInPlace(unittest.TestCase):
             self.assertIn("signed", str(reason or "").lower())
 
 
+class TestIncrementalMetadata(unittest.TestCase):
+    def _write(self, path, meta, mode="incremental", **patches):
+        with patch.multiple(s, _progress=lambda *_a, **_k: None, **patches):
+            return s.write_pdf_metadata_in_place(path, meta, mode=mode)
+
+    def _read_meta(self, path):
+        from pypdf import PdfReader
+        r=PdfReader(path)
+        _=r.pages[0]
+        return dict(r.metadata or {})
+
+    def test_appends_update_and_keeps_original_bytes(self):
+        with tempfile.TemporaryDirectory() as td:
+            pdf_path=os.path.join(td, "doc.pdf")
+            _write_minimal_pdf(pdf_path)
+            with open(pdf_path, "rb") as f:
+                before=f.read()
+            ok, reason=self._write(pdf_path, {"/Title":"Rechnung (März)", "/Keywords":"a; b"})
+            self.assertEqual((ok, reason), (True, None))
+            with open(pdf_path, "rb") as f:
+                after=f.read()
+            self.assertTrue(after.startswith(before))
+            self.assertLess(len(after)-len(before), 600)
+            m=self._read_meta(pdf_path)
+        self.assertEqual(m["/Title"], "Rechnung (März)")
+        self.assertEqual(m["/Keywords"], "a; b")
+        self.assertEqual(m["/Producer"], "pypdf")  # existing Info entries are carried over
+
+    def test_xref_stream_file(self):
+        with tempfile.TemporaryDirectory() as td:
+            pdf_path=os.path.join(td, "xs.pdf")
+            _write_xref_stream_pdf(pdf_path)
+            self.assertEqual(self._write(pdf_path, {"/Title":"T"}), (True, None))
+            self.assertEqual(self._write(pdf_path, {"/Author":"A"}), (True, None))
+            m=self._read_meta(pdf_path)
+        self.assertEqual((m["/Title"], m["/Author"]), ("T", "A"))
+
+    def test_signed_file_enriched_in_auto_mode(self):
+        with tempfile.TemporaryDirectory() as td:
+            pdf_path=os.path.join(td, "signed.pdf")
+            _write_minimal_pdf(pdf_path)
+            with open(pdf_path, "rb") as f:
+                before=f.read()
+            self.assertEqual(self._write(pdf_path, {"/Title":"T"}, mode="auto", _pdf_appears_signed=lambda *_a: True), (True, None))
+            with open(pdf_path, "rb") as f:
+                self.assertTrue(f.read().startswith(before))
+            self.assertEqual(self._read_meta(pdf_path)["/Title"], "T")
+
+    def test_broken_startxref_falls_back_to_rewrite(self):
+        with tempfile.TemporaryDirectory() as td:
+            pdf_path=os.path.join(td, "broken.pdf")
+            _write_minimal_pdf(pdf_path)
+            with open(pdf_path, "rb") as f:
+                data=f.read()
+            i=data.rindex(b"startxref")
+            with open(pdf_path, "wb") as f:
+                f.write(data[:i]+b"startxref\n12\n%%EOF\n")
+            self.assertEqual(self._write(pdf_path, {"/Title":"T"}), (True, None))
+            self.assertEqual(self._read_meta(pdf_path)["/Title"], "T")
+
+
+class TestSinglePassPlacement(unittest.TestCase):
+    def _src(self, td):
+        src=os.path.join(td, "in.pdf")
+        _write_minimal_pdf(src)
+        with open(src, "rb") as f:
+            return src, f.read()
+
+    def test_clone_file_copies_bytes(self):
+        with tempfile.TemporaryDirectory() as td:
+            src, data=self._src(td)
+            dst=os.path.join(td, "out.pdf")
+            with open(dst, "wb") as f:
+                f.write(b"stale"*1000)
+            method=s._clone_file(src, dst)
+            self.assertIn(method, ("reflink", "copy_file_range", "copy"))
+            with open(dst, "rb") as f:
+                self.assertEqual(f.read(), data)
+            with patch.object(s, "fcntl", None), patch.object(s.os, "copy_file_range", side_effect=OSError(18, "EXDEV"), create=True):
+                self.assertEqual(s._clone_file(src, dst), "copy")
+            with open(dst, "rb") as f:
+                self.assertEqual(f.read(), data)
+
+    def test_incremental_copy_is_clone_plus_append(self):
+        with tempfile.TemporaryDirectory() as td:
+            src, data=self._src(td)
+            dst=os.path.join(td, "out", "doc.pdf")
+            os.makedirs(os.path.dirname(dst))
+            with patch.multiple(s, METADATA_MODE="incremental", _progress=lambda *_a, **_k: None):
+                res=s._place_file(src, dst, False, {"/Title":"T"})
+            self.assertEqual(res, (True, None))
+            with open(src, "rb") as f:
+                self.assertEqual(f.read(), data)  # source untouched
+            with open(dst, "rb") as f:
+                self.assertTrue(f.read().startswith(data))
+            self.assertEqual(os.listdir(os.path.dirname(dst)), ["doc.pdf"])
+            from pypdf import PdfReader
+            self.assertEqual(PdfReader(dst).metadata["/Title"], "T")
+
+    def test_rewrite_copy_reads_source_once(self):
+        with tempfile.TemporaryDirectory() as td:
+            src, _data=self._src(td)
+            dst=os.path.join(td, "doc.pdf")
+            with patch.multiple(s, METADATA_MODE="rewrite", _progress=lambda *_a, **_k: None), \
+                 patch.object(s, "_clone_file", side_effect=AssertionError("no separate copy")):
+                res=s._place_file(src, dst, False, {"/Title":"T"})
+            self.assertEqual(res, (True, None))
+            from pypdf import PdfReader
+            self.assertEqual(PdfReader(dst).metadata["/Title"], "T")
+
+    def test_skipped_metadata_places_original(self):
+        with tempfile.TemporaryDirectory() as td:
+            src, data=self._src(td)
+            dst=os.path.join(td, "doc.pdf")
+            with patch.multiple(s, _progress=lambda *_a, **_k: None, _pdf_appears_signed=lambda *_a: True):
+                res=s._place_file(src, dst, False, {"/Title":"T"})
+            self.assertEqual(res, (False, "signed"))
+            with open(dst, "rb") as f:
+                self.assertEqual(f.read(), data)
+
+
 class TestExtractInformationKeywordTruncation(unittest.TestCase):
     def test_extract_information_truncates_keywords_list(self):
         big_text=("hello world\n" * 2000)
@@ -15,6 +15,7 @@ def _touch_pdf(tmp_dir: str, name: str="input.pdf") -> str:
 def _run_main(argv):
     buf=io.StringIO()
     with patch.object(sys, "argv", argv), \
+         patch.object(s, "CACHE_ENABLED", False), \
          contextlib.redirect_stdout(buf), \
          contextlib.redirect_stderr(buf):
         try:
@@ -0,0 +1,234 @@
+import unittest
+import os, zlib, tempfile
+from unittest.mock import patch
+
+import scanfile_rename as s
+
+
+PAGE_TEXT=b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 72 72] /Resources << /Font << /F1 4 0 R >> >> >>"
+PAGE_IMAGE=b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 72 72] /Resources << /XObject << >> >> >>"
+FONT=b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"
+
+
+def _classic_pdf(path, objs):
+    # objs[0] is object 1 (the catalog).
+    out=bytearray(b"%PDF-1.4\n")
+    offs=[]
+    for i, body in enumerate(objs, 1):
+        offs.append(len(out))
+        out+=b"%d 0 obj\n%s\nendobj\n" % (i, body)
+    xref=len(out)
+    out+=b"xref\n0 %d\n0000000000 65535 f \n" % (len(objs)+1)
+    out+=b"".join(b"%010d 00000 n \n" % o for o in offs)
+    out+=b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objs)+1, xref)
+    with open(path, "wb") as f:
+        f.write(bytes(out))
+
+
+def _objstm_pdf(path, objs):
+    # objs 1..n packed into a FlateDecode object stream (n+1), indexed by a PNG-predicted xref stream (n+2).
+    n=len(objs)
+    header=bytearray()
+    body=bytearray()
+    for i, o in enumerate(objs, 1):
+        header+=b"%d %d " % (i, len(body))
+        body+=o+b"\n"
+    data=zlib.compress(bytes(header)+bytes(body))
+    out=bytearray(b"%PDF-1.5\n")
+    stm_off=len(out)
+    out+=b"%d 0 obj\n<< /Type /ObjStm /N %d /First %d /Filter /FlateDecode /Length %d >>\nstream\n" % (n+1, n, len(header), len(data))
+    out+=data+b"\nendstream\nendobj\n"
+    xref_off=len(out)
+    rows=[(0, 0, 255)]+[(2, n+1, i) for i in range(n)]+[(1, stm_off, 0), (1, xref_off, 0)]
+    raw=[bytes([t])+f.to_bytes(2, "big")+bytes([g]) for t, f, g in rows]
+    prev=bytes(4)
+    pred=bytearray()
+    for r in raw:
+        pred+=b"\x02"+bytes((a-b) & 0xFF for a, b in zip(r, prev))
+        prev=r
+    xdata=zlib.compress(bytes(pred))
+    out+=b"%d 0 obj\n<< /Type /XRef /Size %d /Root 1 0 R /W [1 2 1] /Filter /FlateDecode /DecodeParms << /Predictor 12 /Columns 4 >> /Length %d >>\nstream\n" % (n+2, n+3, len(xdata))
+    out+=xdata+b"\nendstream\nendobj\nstartxref\n%d\n%%%%EOF\n" % xref_off
+    with open(path, "wb") as f:
+        f.write(bytes(out))
+
+
+def _signed_objs(docmdp=None):
+    perms=b" /Perms << /DocMDP 5 0 R >>" if docmdp else b""
+    ref=(b" /Reference [<< /Type /SigRef /TransformMethod /DocMDP /TransformParams << /Type /TransformParams /P %d /V /1.2 >> >>]" % docmdp) if docmdp else b""
+    return [b"<< /Type /Catalog /Pages 2 0 R /AcroForm << /Fields [4 0 R] /SigFlags 3 >>%s >>" % perms,
+            b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 72 72] /Annots [4 0 R] >>",
+            b"<< /FT /Sig /Type /Annot /Subtype /Widget /Rect [0 0 0 0] /T (S1) /V 5 0 R /P 3 0 R >>",
+            b"<< /Type /Sig /Filter /Adobe.PPKLite /ByteRange [0 0 0 0] /Contents <00>%s >>" % ref]
+
+
+class TestPdfProbe(unittest.TestCase):
+    def setUp(self):
+        self.td=tempfile.TemporaryDirectory()
+        self.quiet=patch.object(s, "_progress", lambda *_a, **_k: None)
+        self.quiet.start()
+
+    def tearDown(self):
+        self.quiet.stop()
+        self.td.cleanup()
+
+    def _path(self, name):
+        return os.path.join(self.td.name, name)
+
+    def test_classic_xref_pages_and_text_layer(self):
+        text=self._path("text.pdf")
+        _classic_pdf(text, [b"<< /Type /Catalog /Pages 2 0 R >>", b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>", PAGE_TEXT, FONT])
+        image=self._path("image.pdf")
+        _classic_pdf(image, [b"<< /Type /Catalog /Pages 2 0 R >>", b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>", PAGE_IMAGE, FONT])
+        p=s._pdf_probe(text)
+        self.assertEqual((p.ok, p.pages, p.encrypted, p.signed, p.text_layer), (True, 1, False, False, True))
+        p=s._pdf_probe(image)
+        self.assertEqual((p.ok, p.signed, p.text_layer), (True, False, False))  # an unused font is not a text layer
+
+    def test_object_and_xref_streams(self):
+        path=self._path("packed.pdf")
+        _objstm_pdf(path, [b"<< /Type /Catalog /Pages 2 0 R >>", b"<< /Type /Pages /Kids [3 0 R 5 0 R] /Count 2 >>", PAGE_TEXT, FONT,
+                           PAGE_IMAGE])
+        from pypdf import PdfReader
+        self.assertEqual(len(PdfReader(path).pages), 2)  # the fixture itself is valid
+        p=s._pdf_probe(path)
+        self.assertEqual((p.ok, p.pages, p.signed, p.text_layer, p.objects), (True, 2, False, True, 7))
+
+    def test_signed_and_certified(self):
+        path=self._path("signed.pdf")
+        _classic_pdf(path, _signed_objs())
+        p=s._pdf_probe(path)
+        self.assertEqual((p.signed, p.certified), (True, False))
+        _objstm_pdf(path, _signed_objs(docmdp=1))
+        p=s._pdf_probe(path)
+        self.assertEqual((p.signed, p.certified), (True, True))
+
+    def test_page_images_through_inherited_resources_and_forms(self):
+        path=self._path("scan.pdf")
+        _classic_pdf(path, [b"<< /Type /Catalog /Pages 2 0 R >>",
+                            b"<< /Type /Pages /Kids [3 0 R 4 0 R] /Count 2 /Resources 5 0 R >>",
+                            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 72 72] >>",  # inherits the form with the scan
+                            PAGE_TEXT,
+                            b"<< /XObject << /Fm0 6 0 R >> >>",
+                            b"<< /Type /XObject /Subtype /Form /BBox [0 0 1 1] /Resources << /XObject << /Im0 7 0 R >> >> /Length 0 >>",
+                            b"<< /Type /XObject /Subtype /Image /Width 1 /Height 1 /Length 0 >>", FONT])
+        self.assertEqual(s._pdf_probe(path).page_images, frozenset({1}))
+
+    def test_damaged_xref_is_inconclusive(self):
+        path=self._path("broken.pdf")
+        _classic_pdf(path, [b"<< /Type /Catalog /Pages 2 0 R >>", b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>", PAGE_IMAGE])
+        with open(path, "rb") as f:
+            data=f.read()
+        with open(path, "wb") as f:
+            f.write(data.replace(b"0000000009 00000 n", b"0000000011 00000 n"))
+        p=s._pdf_probe(path)
+        self.assertFalse(p.ok)
+        self.assertIsNone(p.text_layer)
+        self.assertIsNone(p.signed)
+
+    def test_pdftotext_skipped_without_text_layer(self):
+        path=self._path("image.pdf")
+        _classic_pdf(path, [b"<< /Type /Catalog /Pages 2 0 R >>", b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>", PAGE_IMAGE])
+        with patch.object(s.subprocess, "Popen", side_effect=AssertionError("pdftotext spawned")):
+            self.assertEqual(s._pdftotext(path), ("", 0, ""))
+
+    def test_probe_cached_until_file_changes(self):
+        path=self._path("text.pdf")
+        _classic_pdf(path, [b"<< /Type /Catalog /Pages 2 0 R >>", b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>", PAGE_TEXT, FONT])
+        p=s._pdf_probe(path)
+        self.assertIs(s._pdf_probe(path), p)
+        _classic_pdf(path, _signed_objs())
+        os.utime(path, ns=(1, 1))
+        self.assertTrue(s._pdf_probe(path).signed)
+
+
+class TestProbeMetadataDecisions(unittest.TestCase):
+    def setUp(self):
+        self.td=tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.td.cleanup()
+
+    def _write(self, path, mode):
+        with patch.object(s, "_progress", lambda *_a, **_k: None):
+            return s.write_pdf_metadata_in_place(path, {"/Title":"T"}, mode=mode)
+
+    def test_signed_rewrite_skips_without_parsing(self):
+        path=os.path.join(self.td.name, "signed.pdf")
+        _classic_pdf(path, _signed_objs())
+        with patch("pypdf.PdfReader", side_effect=AssertionError("parsed")):
+            self.assertEqual(self._write(path, "rewrite"), (False, "signed"))
+
+    def test_incremental_from_probe_keeps_existing_info_without_pypdf(self):
+        path=os.path.join(self.td.name, "doc.pdf")
+        _classic_pdf(path, [b"<< /Type /Catalog /Pages 2 0 R >>", b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>", PAGE_TEXT, FONT,
+                            b"<< /Producer (Scanner \\(v2\\)) /Author <FEFF00C4> /Title (old) >>"])
+        with open(path, "rb") as f:
+            data=f.read()
+        with open(path, "wb") as f:
+            f.write(data.replace(b"/Root 1 0 R", b"/Root 1 0 R /Info 5 0 R"))
+        with patch("pypdf.PdfReader", side_effect=AssertionError("parsed")):
+            self.assertEqual(self._write(path, "incremental"), (True, None))
+        from pypdf import PdfReader
+        m=PdfReader(path).metadata
+        self.assertEqual((m["/Producer"], m["/Author"], m["/Title"]), ("Scanner (v2)", "\u00c4", "T"))
+
+    def test_incremental_keeps_indirect_and_non_string_info_entries(self):
+        path=os.path.join(self.td.name, "refs.pdf")
+        _classic_pdf(path, [b"<< /Type /Catalog /Pages 2 0 R >>", b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>", PAGE_TEXT, FONT,
+                            b"<< /Producer 6 0 R /Trapped /False /Custom [(a]) 1] /Title (old) >>", b"(Scanner v2)"])
+        with open(path, "rb") as f:
+            data=f.read()
+        with open(path, "wb") as f:
+            f.write(data.replace(b"/Root 1 0 R", b"/Root 1 0 R /Info 5 0 R"))
+        from pypdf import PdfReader
+        for reader in (None, PdfReader(path)):  # from the probe, and from pypdf
+            self.assertEqual(s._write_metadata_incremental(path, reader, {"/Title":"T"}, s._pdf_probe(path)), (True, None))
+            m=PdfReader(path).metadata
+            self.assertEqual((m["/Producer"], m["/Trapped"], m["/Title"]), ("Scanner v2", "/False", "T"))
+            custom=m["/Custom"]
+            assert isinstance(custom, list)  # an ArrayObject
+            self.assertEqual(list(custom), ["a]", 1])
+
+    def _with_id(self, name, ids):
+        path=os.path.join(self.td.name, name)
+        _classic_pdf(path, [b"<< /Type /Catalog /Pages 2 0 R >>", b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>", PAGE_TEXT, FONT, b"[<0A0B> <0C0D>]"])
+        with open(path, "rb") as f:
+            data=f.read()
+        with open(path, "wb") as f:
+            f.write(data.replace(b"/Root 1 0 R", b"/Root 1 0 R /ID "+ids))
+        return path
+
+    def _first_id(self, path):
+        from pypdf import PdfReader
+        ids=PdfReader(path).trailer["/ID"]
+        assert isinstance(ids, list)  # an ArrayObject
+        return s._pdf_string_bytes(ids[0])
+
+    def test_incremental_keeps_literal_and_odd_hex_ids(self):
+        for name, ids, first in (("literal.pdf", b"[(a\\)b\\051) (x)]", b"a)b)"), ("odd.pdf", b"[<ABC> <01>]", b"\xab\xc0")):
+            path=self._with_id(name, ids)
+            self.assertEqual(s._write_metadata_incremental(path, None, {"/Title":"T"}, s._pdf_probe(path)), (True, None))
+            self.assertEqual(self._first_id(path), first, name)
+
+    def test_indirect_id_falls_back_to_pypdf_and_is_kept(self):
+        path=self._with_id("indirect.pdf", b"5 0 R")
+        self.assertEqual(s._write_metadata_incremental(path, None, {"/Title":"T"}, s._pdf_probe(path)), (False, "unsupported"))
+        self.assertEqual(self._write(path, "incremental"), (True, None))
+        self.assertEqual(self._first_id(path), b"\x0a\x0b")
+
+    def test_certification_level_decides_incremental_enrichment(self):
+        path=os.path.join(self.td.name, "certified.pdf")
+        _classic_pdf(path, _signed_objs(docmdp=1))
+        self.assertEqual(self._write(path, "incremental"), (False, "signed"))
+        _classic_pdf(path, _signed_objs(docmdp=2))
+        with open(path, "rb") as f:
+            before=f.read()
+        self.assertEqual(self._write(path, "auto"), (True, None))
+        with open(path, "rb") as f:
+            self.assertTrue(f.read().startswith(before))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+import unittest
+import os, tempfile
+from unittest.mock import patch
+
+import scanfile_rename as s
+
+
+BILL="""ACME POWER & LIGHT CO.
+PO Box 123, Springfield
+Electric Bill
+Account Number: 1234-5678
+Statement Date: March 3, 2024
+Billing Period: 02/01/2024 - 02/29/2024
+Amount Due: $123.45
+Payment Due Date: 03/25/2024
+Thank you for your payment of $98.00 received 02/10/2024. Questions about your bill? Call us any time.
+"""
+
+
+class TestRulesFields(unittest.TestCase):
+    def _date(self, text):
+        return s._rules_date(s._rules_pages(text))
+
+    def test_date_formats(self):
+        for raw, day in (("2024-01-05", "2024-01-05"), ("January 5, 2024", "2024-01-05"), ("5th Jan 2024", "2024-01-05"),
+                         ("Sept. 9, 2023", "2023-09-09"), ("05.01.2024", "2024-01-05"), ("13/01/2024", "2024-01-13"),
+                         ("01/13/2024", "2024-01-13"), ("1/5/24", "2024-01-05")):
+            self.assertEqual(self._date(f"Date: {raw}")[0], day, raw)
+        self.assertIsNone(self._date("Total 5 2024, Bogus 31, 2024, 02/30/2024")[0])
+
+    def test_labelled_date_beats_due_and_period_dates(self):
+        day, basis, score=self._date(BILL)
+        self.assertEqual((day, basis), ("2024-03-03", "document"))
+        self.assertGreaterEqual(score, 0.9)
+        self.assertEqual(self._date("Acme Clinic\nDate of service: 04/02/2024\nPayment due 05/01/2024")[:2], ("2024-04-02", "service"))
+
+    def test_competing_dates_are_not_certain(self):
+        _day, _basis, score=self._date("Acme\nDate: 03/03/2024\nDate: 04/04/2024")
+        self.assertLessEqual(score, 0.6)
+
+    def test_day_month_ambiguous_date_is_never_certain(self):
+        day, _basis, score=self._date("Date: 03/04/2024")  # label and header bonuses alone would reach 0.85
+        self.assertEqual(day, "2024-03-04")
+        self.assertLess(score, s.RULES_MIN_CONFIDENCE)
+        self.assertGreaterEqual(self._date("Date: 13/04/2024")[2], s.RULES_MIN_CONFIDENCE)
+        with patch.object(s, "RULES_MIN_CONFIDENCE", 0.5):
+            self.assertLess(self._date("Date: 03/04/2024")[2], 0.5)
+
+    def test_doc_type_shared_with_normalizer(self):
+        self.assertEqual(s._normalize_doc_type("monthly inv."), "Invoice")
+        self.assertEqual(s._normalize_doc_type("Explanation of benefits"), "Explanation Of Benefits")
+        dt, score, line=s._rules_doc_type(s._rules_pages(BILL))
+        self.assertEqual((dt, score, line), ("Bill", 0.9, "Electric Bill"))
+
+    def test_heuristic_fallback_keeps_its_fields(self):
+        info=s._heuristic_extract(BILL)
+        self.assertEqual((info["date"], info["document_type"], info["title"]), ("2024-03-03", "Bill", "Electric Bill"))
+        self.assertNotIn("source", info)
+
+
+class TestRulesEngine(unittest.TestCase):
+    def setUp(self):
+        self.td=tempfile.TemporaryDirectory()
+        self._patches=[patch.object(s, "_PROVIDERS", {}), patch.object(s, "CACHE_ENABLED", False), patch.object(s, "RULES_ENABLED", True),
+                       patch.object(s, "RULES_PROVIDERS_FILE", ""), patch.object(s, "_RULES_STATS", {"checked":0, "final":0}),
+                       patch.object(s, "LLM_CONTEXT_PROBE", False), patch.object(s, "_progress", lambda *_a, **_k: None)]
+        for p in self._patches: p.start()
+
+    def tearDown(self):
+        for p in self._patches: p.stop()
+        self.td.cleanup()
+
+    def _extract(self, reply=None):
+        with patch.object(s, "_pdftotext", return_value=(BILL, 0, "")), \
+             patch.object(s, "_call_llm", return_value=(reply, None) if reply else (None, "not called")) as llm:
+            info, _text=s.extract_information("bill.pdf")
+        return info, llm.call_count
+
+    def test_unknown_provider_goes_to_the_llm(self):
+        info, calls=self._extract('{"date":"2024-03-03","provider":"Acme Power & Light","document_type":"Bill","title":"Electric bill"}')
+        self.assertEqual(calls, 1)
+        self.assertIsNone(info.get("source"))
+        self.assertEqual(s._rules_stats_line(), "Rules engine: 0 of 1 document(s) finalized without the LLM (0 LLM call(s) avoided)")
+
+    def test_provider_file_makes_the_document_certain(self):
+        path=os.path.join(self.td.name, "providers.txt")
+        with open(path, "w") as f:
+            f.write("# issuers\nAcme Power & Light = ACME POWER & LIGHT CO., Acme Power\n")
+        with patch.object(s, "RULES_PROVIDERS_FILE", path):
+            info, calls=self._extract()
+        self.assertEqual(calls, 0)
+        self.assertEqual({k:info[k] for k in ("date", "provider", "document_type", "title", "source")},
+                         {"date":"2024-03-03", "provider":"Acme Power & Light", "document_type":"Bill", "title":"Electric Bill", "source":"rules"})
+        self.assertEqual(s._rules_stats_line(), "Rules engine: 1 of 1 document(s) finalized without the LLM (1 LLM call(s) avoided)")
+
+    def test_learned_provider_is_trusted_after_repeat_sightings(self):
+        s._learn_provider("Acme Power & Light", "nothing about it here")  # not in the text: ignored
+        s._learn_provider("ACME POWER & LIGHT CO", BILL)
+        self.assertEqual(self._extract('{"date":"2024-03-03","provider":"Acme","document_type":"Bill","title":"T"}')[1], 1)
+        s._learn_provider("Acme Power & Light Co", BILL)
+        info, calls=self._extract()
+        self.assertEqual((calls, info["provider"]), (0, "ACME POWER & LIGHT CO"))
+
+    def test_learned_provider_only_counts_in_the_letterhead(self):
+        statement="FIRST CITY BANK\nCard Statement\nStatement Date: March 3, 2024\n\fTransactions\n03/01 ACME POWER & LIGHT CO 98.00\n"
+        s._learn_provider("ACME POWER & LIGHT CO", statement)  # only a merchant line here: not learned
+        self.assertEqual(s._learned_providers(), {})
+        for _ in range(2):
+            s._learn_provider("ACME POWER & LIGHT CO", BILL)
+        self.assertEqual(s._rules_provider(s._rules_pages(BILL)), ("ACME POWER & LIGHT CO", 0.9))
+        self.assertNotEqual(s._rules_provider(s._rules_pages(statement))[0], "ACME POWER & LIGHT CO")
+
+    def test_disabled_rules_always_call_the_llm(self):
+        with patch.object(s, "RULES_ENABLED", False), patch.object(s, "RULES_PROVIDERS_FILE", ""):
+            s._learn_provider("Acme Power", BILL)
+            s._learn_provider("Acme Power", BILL)
+            _info, calls=self._extract('{"date":"2024-03-03","provider":"Acme","document_type":"Bill","title":"T"}')
+        self.assertEqual(calls, 1)
+        self.assertIsNone(s._rules_stats_line())
+
+
+if __name__ == "__main__":
+    unittest.main()
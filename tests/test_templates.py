@@ -0,0 +1,172 @@
+import unittest
+import os, tempfile
+from unittest.mock import patch
+
+import scanfile_rename as s
+
+
+def _statement(day, amount, account="1234-5678"):
+    return f"""Northwind Water Utility
+PO Box 77, Riverside
+Customer Service 1-800-555-0100
+Water and Sewer Statement
+Account Number: {account}
+Statement Date: {day}
+Service Address: 12 Elm Street
+Previous Balance ${amount}
+Payments Received - Thank You
+Current Charges ${amount}
+Total Amount Due ${amount}
+Please return the bottom portion with your payment
+Pay online at our customer portal
+"""
+
+OTHER="""Riverside Family Clinic
+Patient Visit Summary
+Your care team thanks you for visiting today
+Diagnosis codes and procedures are listed below
+Follow up with your primary physician in two weeks
+Bring this summary to your next appointment
+Questions about medications should go to the pharmacy
+"""
+
+INFO={"date":"2024-03-03", "provider":"Northwind Water", "document_type":"Bill", "title":"Water bill March 2024"}
+
+
+class TestTemplateFingerprint(unittest.TestCase):
+    def test_dates_and_amounts_do_not_change_the_layout(self):
+        a=s._template_fingerprint(_statement("March 3, 2024", "41.20"))
+        b=s._template_fingerprint(_statement("April 2, 2024", "39.95", account="8765-4321"))
+        other=s._template_fingerprint(OTHER)
+        assert a is not None and b is not None and other is not None
+        self.assertLessEqual((a ^ b).bit_count(), 3)
+        self.assertGreater((a ^ other).bit_count(), 10)
+
+    def test_too_little_text_has_no_fingerprint(self):
+        self.assertIsNone(s._template_fingerprint("Invoice\nTotal 12.00"))
+        self.assertIsNone(s._template_fingerprint(""))
+
+    def test_title_pattern_round_trip(self):
+        pat=s._title_pattern("Water bill March 2024", "2024-03-03")
+        self.assertEqual(pat, "Water bill {month} {year}")
+        self.assertEqual(s._title_from_pattern(pat, "2024-04-02"), "Water bill April 2024")
+        self.assertEqual(s._title_pattern("Statement 2024-03 #2024", "2024-03-03"), "Statement {ym} #{year}")
+
+
+class TestTemplateIndex(unittest.TestCase):
+    def setUp(self):
+        self.td=tempfile.TemporaryDirectory()
+        self.db=s._TemplateIndex(os.path.join(self.td.name, "templates.sqlite3"))
+
+    def tearDown(self):
+        self.db.close()
+        self.td.cleanup()
+
+    def test_record_counts_agreeing_results(self):
+        h=s._template_fingerprint(_statement("March 3, 2024", "41.20"))
+        self.assertIsNone(self.db.nearest(h))
+        self.db.record(h, "Northwind Water", "Bill", "Water bill {month} {year}")
+        self.db.record(h ^ 0b101, "northwind water", "Bill", "Water bill {month} {year}")  # near, same fields
+        hit=self.db.nearest(h ^ 1)
+        self.assertEqual((hit["provider"], hit["seen"], hit["distance"]), ("Northwind Water", 2, 1))
+        self.assertIsNone(self.db.nearest(h ^ 0b1111))  # 4 bits apart
+
+    def test_index_from_before_descriptive_fields_is_upgraded(self):
+        import sqlite3
+        path=os.path.join(self.td.name, "old.sqlite3")
+        con=sqlite3.connect(path)
+        con.execute("""CREATE TABLE templates(id INTEGER PRIMARY KEY, simhash INTEGER NOT NULL, b0 INTEGER NOT NULL, b1 INTEGER NOT NULL,
+            b2 INTEGER NOT NULL, b3 INTEGER NOT NULL, provider TEXT, document_type TEXT, title TEXT, seen INTEGER NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0, updated REAL NOT NULL)""")
+        con.execute("INSERT INTO templates(simhash, b0, b1, b2, b3, provider, document_type, title, seen, updated) VALUES(5,?,?,?,?,'Acme','Bill','T',2,0)",
+                    s._hash_bands(5))
+        con.commit()
+        con.close()
+        db=s._TemplateIndex(path)
+        try:
+            hit=db.nearest(5)
+            self.assertEqual((hit["provider"], hit["keywords"], hit["subject"]), ("Acme", [], None))
+            db.record(5, "Acme", "Bill", "T", keywords=["water"], subject="S")
+            self.assertEqual((db.nearest(5)["keywords"], db.nearest(5)["seen"]), (["water"], 3))
+        finally:
+            db.close()
+
+    def test_disagreeing_result_resets_the_template(self):
+        h=(1 << 63) | 12345  # exercises the signed storage of the high bit
+        self.db.record(h, "Acme", "Bill", "T")
+        self.db.record(h, "Acme", "Bill", "T")
+        self.db.record(h, "Acme Bank", "Statement", "T")
+        hit=self.db.nearest(h)
+        self.assertEqual((hit["provider"], hit["document_type"], hit["seen"], hit["distance"]), ("Acme Bank", "Statement", 1, 0))
+
+
+class TestTemplateReuse(unittest.TestCase):
+    def setUp(self):
+        self.td=tempfile.TemporaryDirectory()
+        self._patches=[patch.object(s, "TEMPLATE_INDEX", os.path.join(self.td.name, "templates.sqlite3")), patch.object(s, "_TEMPLATE_DB", None),
+                       patch.object(s, "TEMPLATES_ENABLED", True), patch.object(s, "CACHE_ENABLED", True), patch.object(s, "CACHE_DIR", self.td.name),
+                       patch.object(s, "_TEMPLATE_STATS", {"checked":0, "matched":0, "local_date":0}), patch.object(s, "_PROVIDERS", {}),
+                       patch.object(s, "RULES_PROVIDERS_FILE", ""), patch.object(s, "RULES_ENABLED", False),
+                       patch.object(s, "LLM_CONTEXT_PROBE", False), patch.object(s, "_progress", lambda *_a, **_k: None)]
+        for p in self._patches: p.start()
+
+    def tearDown(self):
+        if s._TEMPLATE_DB is not None: s._TEMPLATE_DB.close()
+        for p in self._patches: p.stop()
+        self.td.cleanup()
+
+    def _extract(self, text, reply=None):
+        with patch.object(s, "_pdftotext", return_value=(text, 0, "")), \
+             patch.object(s, "_call_llm", return_value=(reply, None) if reply else (None, "not called")) as llm:
+            info, _text=s.extract_information("bill.pdf")
+        return info, llm
+
+    def _teach(self, times):
+        text=_statement("March 3, 2024", "41.20")
+        for _ in range(times):
+            s._learn_from_result(dict(INFO), text)
+
+    def test_lookup_does_not_create_the_index(self):
+        self.assertIsNone(s._template_extract(_statement("March 3, 2024", "41.20")))
+        self.assertFalse(os.path.exists(s.TEMPLATE_INDEX))
+
+    def test_confirmed_template_with_a_local_date_skips_the_llm(self):
+        self._teach(2)
+        info, llm=self._extract(_statement("April 2, 2024", "39.95"))
+        llm.assert_not_called()
+        self.assertEqual({k:info[k] for k in ("date", "provider", "document_type", "title", "source")},
+                         {"date":"2024-04-02", "provider":"Northwind Water", "document_type":"Bill", "title":"Water bill April 2024", "source":"template"})
+        self.assertEqual(s._template_stats_line(), "Templates: 1 of 1 document(s) matched a known layout (1 with no LLM call, 0 with a date-only prompt)")
+
+    def test_template_hit_keeps_keywords_and_subject(self):
+        text=_statement("March 3, 2024", "41.20")
+        info=dict(INFO, keywords=["water", "sewer", "March 2024", "$41.20"], subject="Water and sewer, March 2024", author="Northwind Billing")
+        for _ in range(2):
+            s._learn_from_result(dict(info), text)
+        got, llm=self._extract(_statement("April 2, 2024", "39.95"))
+        llm.assert_not_called()
+        self.assertEqual(got["keywords"], ["water", "sewer", "April 2024"])  # the amount was this one bill's
+        self.assertEqual((got["subject"], got["author"]), ("Water and sewer, April 2024", "Northwind Billing"))
+
+    def test_uncertain_date_uses_the_date_only_prompt(self):
+        self._teach(2)
+        info, llm=self._extract(_statement("04/02/2024 04/09/2024", "39.95"), reply='{"date":"2024-04-02","date_basis":"document"}')
+        self.assertEqual(llm.call_count, 1)
+        self.assertEqual(llm.call_args[1]["max_tokens"], 60)
+        self.assertNotIn("provider", llm.call_args[0][0][-1]["content"])
+        self.assertEqual((info["date"], info["provider"], info["source"]), ("2024-04-02", "Northwind Water", "template"))
+
+    def test_template_is_not_reused_until_confirmed(self):
+        self._teach(1)
+        reply='{"date":"2024-04-02","provider":"Northwind Water","document_type":"Bill","title":"Water bill April 2024"}'
+        info, llm=self._extract(_statement("April 2, 2024", "39.95"), reply=reply)
+        self.assertEqual(llm.call_count, 1)
+        self.assertIsNone(info.get("source"))
+        with patch.object(s, "TEMPLATES_ENABLED", False):
+            self._teach(1)
+            info, llm=self._extract(_statement("April 2, 2024", "39.95"), reply=reply)
+            self.assertEqual(llm.call_count, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
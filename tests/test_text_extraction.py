@@ -0,0 +1,236 @@
+import unittest
+import os, sys, stat, tempfile, textwrap
+from unittest.mock import patch
+
+import scanfile_rename as s
+
+
+def _fake_pdftotext(tmp_dir: str, pages: int, keyword_page: int) -> str:
+    # Stand-in for Poppler's pdftotext: honours -f/-l, writes one form-feed-terminated page at a time.
+    path=os.path.join(tmp_dir, "fake_pdftotext")
+    log=os.path.join(tmp_dir, "calls.log")
+    with open(path, "w") as f:
+        f.write(textwrap.dedent(f"""\
+            #!{sys.executable}
+            import sys
+            args=sys.argv[1:]
+            first=int(args[args.index("-f")+1]) if "-f" in args else 1
+            last=int(args[args.index("-l")+1]) if "-l" in args else {pages}
+            last=min(last, {pages})
+            with open({log!r}, "a") as lf:
+                lf.write(f"{{first}}-{{last}}\\n")
+            for i in range(first, last+1):
+                word="Invoice total due" if i == {keyword_page} else "lorem ipsum"
+                sys.stdout.write(f"page {{i}} " + (word+" ")*30 + "\\f")
+            """))
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    return path
+
+
+def _text_pdf(path, pages):
+    # Real text-layer PDF: one Helvetica content stream per page; a None page is a scan (a full-page image, no text).
+    objs=[b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+          b"<< /Type /XObject /Subtype /Image /Width 1 /Height 1 /ColorSpace /DeviceGray /BitsPerComponent 8 /Length 1 >>\nstream\n\x80\nendstream"]
+    kids=[]
+    for text in pages:
+        if text is None:
+            stream=b"q 612 0 0 792 0 0 cm /Im0 Do Q"
+            res=b"<< /XObject << /Im0 4 0 R >> >>"
+        else:
+            stream=b"BT /F1 10 Tf 40 700 Td 12 TL " + b" ".join(b"(%s) '" % ln.encode("latin-1") for ln in text.split("\n")) + b" ET"
+            res=b"<< /Font << /F1 3 0 R >> >>"
+        objs.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objs.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources %s /Contents %d 0 R >>" % (res, len(objs)))
+        kids.append(len(objs))
+    objs[1]=b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % k for k in kids), len(kids))
+    out=bytearray(b"%PDF-1.4\n")
+    offs=[]
+    for i, body in enumerate(objs, 1):
+        offs.append(len(out))
+        out+=b"%d 0 obj\n%s\nendobj\n" % (i, body)
+    xref=len(out)
+    out+=b"xref\n0 %d\n0000000000 65535 f \n" % (len(objs)+1)+b"".join(b"%010d 00000 n \n" % o for o in offs)
+    out+=b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objs)+1, xref)
+    with open(path, "wb") as f:
+        f.write(bytes(out))
+    return path
+
+
+def _calls(tmp_dir: str):
+    with open(os.path.join(tmp_dir, "calls.log")) as f:
+        return f.read().split()
+
+
+class TestPageBoundedPdftotext(unittest.TestCase):
+    def test_first_pages_plus_last_page(self):
+        with tempfile.TemporaryDirectory() as td:
+            exe=_fake_pdftotext(td, pages=100, keyword_page=1)
+            with patch.object(s, "PDFTOTEXT", exe), \
+                 patch.object(s, "_progress", lambda *_a, **_k: None), \
+                 patch.object(s, "_pdf_page_count", return_value=100), \
+                 patch.object(s, "TEXT_FIRST_PAGES", 4):
+                text, rc, err=s._pdftotext("doc.pdf")
+            self.assertEqual(rc, 0)
+            self.assertEqual(_calls(td), ["1-4", "100-100"])
+            self.assertIn("page 4 ", text)
+            self.assertIn("page 100 ", text)
+            self.assertNotIn("page 5 ", text)
+
+    def test_widens_until_keywords_found(self):
+        with tempfile.TemporaryDirectory() as td:
+            exe=_fake_pdftotext(td, pages=100, keyword_page=7)
+            with patch.object(s, "PDFTOTEXT", exe), \
+                 patch.object(s, "_progress", lambda *_a, **_k: None), \
+                 patch.object(s, "_pdf_page_count", return_value=100), \
+                 patch.object(s, "TEXT_FIRST_PAGES", 2), \
+                 patch.object(s, "TEXT_INCLUDE_LAST_PAGE", False):
+                text, rc, _err=s._pdftotext("doc.pdf")
+            self.assertEqual(rc, 0)
+            self.assertEqual(_calls(td), ["1-2", "3-4", "5-8"])
+            self.assertIn("Invoice", text)
+
+    def test_max_chars_bounds_output(self):
+        with tempfile.TemporaryDirectory() as td:
+            exe=_fake_pdftotext(td, pages=50, keyword_page=1)
+            with patch.object(s, "PDFTOTEXT", exe):
+                text, rc, _err, truncated=s._pdftotext_stream("doc.pdf", max_chars=500)
+            self.assertEqual(rc, 0)
+            self.assertTrue(truncated)
+            self.assertEqual(len(text), 500)
+
+
+class TestTextBackends(unittest.TestCase):
+    def setUp(self):
+        self.td=tempfile.TemporaryDirectory()
+        self.quiet=patch.object(s, "_progress", lambda *_a, **_k: None)
+        self.quiet.start()
+
+    def tearDown(self):
+        self.quiet.stop()
+        self.td.cleanup()
+
+    def _doc(self, n, keyword_page=1):
+        pages=[f"Page {i}\n"+("Invoice total due 2024-01-02 from Acme Power\n" if i == keyword_page else "lorem ipsum dolor sit amet\n")*8
+               for i in range(1, n+1)]
+        return _text_pdf(os.path.join(self.td.name, "doc.pdf"), pages)
+
+    def test_auto_uses_pypdf_for_clean_text_pdf(self):
+        pdf=self._doc(10)
+        exe=_fake_pdftotext(self.td.name, pages=10, keyword_page=1)
+        with patch.object(s, "PDFTOTEXT", exe), patch.object(s, "TEXT_BACKEND", "auto"), patch.object(s, "TEXT_FIRST_PAGES", 4), \
+             patch.object(s.subprocess, "Popen", side_effect=AssertionError("pdftotext spawned")):
+            text, rc, _err=s._pdftotext(pdf)
+        self.assertEqual(rc, 0)
+        self.assertIn("Invoice total due", text)
+        self.assertIn("Page 4", text)
+        self.assertIn("Page 10", text)  # last page
+        self.assertNotIn("Page 5", text)
+
+    def test_auto_falls_back_to_poppler_when_pypdf_text_is_poor(self):
+        pdf=_text_pdf(os.path.join(self.td.name, "short.pdf"), ["x"])
+        exe=_fake_pdftotext(self.td.name, pages=1, keyword_page=1)
+        with patch.object(s, "PDFTOTEXT", exe), patch.object(s, "TEXT_BACKEND", "auto"):
+            text, rc, _err=s._pdftotext(pdf)
+        self.assertEqual(rc, 0)
+        self.assertEqual(_calls(self.td.name), ["1-1"])
+        self.assertIn("Invoice total due", text)
+
+    def test_auto_without_poppler_uses_pypdf(self):
+        pdf=self._doc(2)
+        with patch.object(s, "PDFTOTEXT", os.path.join(self.td.name, "missing-pdftotext")), patch.object(s, "TEXT_BACKEND", "auto"), \
+             patch.object(s, "_pdf_probe", return_value=s._PdfProbe()):  # inconclusive probe
+            text, rc, _err=s._pdftotext(pdf)
+        self.assertEqual(rc, 0)
+        self.assertIn("Acme Power", text)
+
+    def test_forced_poppler_and_pypdf_errors(self):
+        pdf=self._doc(2)
+        exe=_fake_pdftotext(self.td.name, pages=2, keyword_page=1)
+        with patch.object(s, "PDFTOTEXT", exe), patch.object(s, "TEXT_BACKEND", "poppler"):
+            self.assertEqual(s._pdftotext(pdf)[1], 0)
+        self.assertEqual(_calls(self.td.name), ["1-2"])
+        bad=os.path.join(self.td.name, "bad.pdf")
+        with open(bad, "wb") as f:
+            f.write(b"not a pdf")
+        with patch.object(s, "TEXT_BACKEND", "pypdf"):
+            text, rc, err=s._pdftotext(bad)
+        self.assertEqual((text, rc), ("", 1))
+        self.assertIn("pypdf:", err)
+
+
+class TestPageRouting(unittest.TestCase):
+    def setUp(self):
+        self.td=tempfile.TemporaryDirectory()
+        self.quiet=patch.object(s, "_progress", lambda *_a, **_k: None)
+        self.quiet.start()
+
+    def tearDown(self):
+        self.quiet.stop()
+        self.td.cleanup()
+
+    def test_route_pages(self):
+        images=frozenset({2, 3, 4})
+        self.assertEqual(s._route_pages({1:900, 2:0, 3:12, 4:700}, images), [2, 3])
+        self.assertEqual(s._route_pages({1:900, 2:0, 3:12, 5:0}, images), [2, 3])  # page 5 is blank, not a scan
+        self.assertIsNone(s._route_pages({1:900, 5:0}, images))
+        self.assertIsNone(s._route_pages({1:900, 2:0}, None))  # unknown: no image seen
+        self.assertIsNone(s._route_pages({1:900, 2:700}, images))
+        self.assertIsNone(s._route_pages({1:0, 2:5}, images))  # nothing to send as text: plain vision
+        self.assertIsNone(s._route_pages(None, images))
+        with patch.object(s, "VISION_MAX_PAGES", 2):
+            self.assertEqual(s._route_pages({1:900, 2:0, 3:0, 4:0}, images), [2, 3])
+        with patch.object(s, "PAGE_ROUTING", False):
+            self.assertIsNone(s._route_pages({1:900, 2:0}, images))
+
+    def _mixed_doc(self):
+        cover="Acme Power\n"+"Invoice total due 2024-01-02 for service at 12 Main Street\n"*8
+        return _text_pdf(os.path.join(self.td.name, "mixed.pdf"), [cover, None, cover.replace("Invoice", "Notes"), None])
+
+    def test_mixed_document_sends_text_and_only_textless_pages_as_images(self):
+        pdf=self._mixed_doc()
+        rendered=[]
+
+        def fake_render(_pdf, page, dpi):
+            rendered.append(page)
+            return bytearray(b"img%d" % page)
+
+        reply='{"date":"2024-01-02","provider":"Acme Power","document_type":"Invoice","title":"Power bill"}'
+        with patch.object(s, "TEXT_BACKEND", "pypdf"), \
+             patch.object(s, "_render_page_data_url", side_effect=fake_render), \
+             patch.object(s, "_call_llm", return_value=(reply, None)) as llm:
+            info, text=s.extract_information(pdf)
+        self.assertEqual(info["provider"], "Acme Power")
+        self.assertEqual(sorted(rendered), [2, 4])
+        self.assertEqual(llm.call_count, 1)
+        content=llm.call_args[0][0][1]["content"]
+        self.assertIn("Acme Power", content[0]["text"])
+        self.assertIn("page(s) 2, 4", content[0]["text"])
+        self.assertEqual([bytes(c["image_url"]["url"]) for c in content[1:]], [b"img2", b"img4"])
+
+    def test_blank_page_of_a_text_document_stays_on_the_text_path(self):
+        cover="Acme Power\n"+"Invoice total due 2024-01-02 for service at 12 Main Street\n"*8
+        pdf=_text_pdf(os.path.join(self.td.name, "verso.pdf"), [cover, "", "This page intentionally left blank"])
+        self.assertEqual(s._pdf_probe(pdf).page_images, frozenset())
+        reply='{"date":"2024-01-02","provider":"Acme Power","document_type":"Invoice","title":"T"}'
+        with patch.object(s, "TEXT_BACKEND", "pypdf"), \
+             patch.object(s, "_render_page_data_url", side_effect=AssertionError("page rendered")), \
+             patch.object(s, "_call_llm", return_value=(reply, None)) as llm:
+            info, _text=s.extract_information(pdf)
+        self.assertEqual(info["provider"], "Acme Power")
+        self.assertEqual(llm.call_count, 1)
+        self.assertIsInstance(llm.call_args[0][0][1]["content"], str)  # plain text request
+
+    def test_failed_mixed_request_falls_back_to_text(self):
+        pdf=self._mixed_doc()
+        replies=[(None, "HTTP 500"), ('{"date":"2024-01-02","provider":"Acme Power","document_type":"Invoice","title":"T"}', None)]
+        with patch.object(s, "TEXT_BACKEND", "pypdf"), \
+             patch.object(s, "_render_page_data_url", return_value=bytearray(b"img")), \
+             patch.object(s, "_call_llm", side_effect=replies) as llm:
+            info, _text=s.extract_information(pdf)
+        self.assertEqual(info["provider"], "Acme Power")
+        self.assertEqual(llm.call_count, 2)
+        self.assertIsInstance(llm.call_args[0][0][1]["content"], str)  # plain text request
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import unittest
+from unittest.mock import patch
+
+import scanfile_rename as s
+
+
+class _ModelStateIsolation(unittest.TestCase):
+    def setUp(self):
+        self._patches=[
+            patch.object(s, "_MODEL_STATE", {}),
+            patch.object(s, "CACHE_ENABLED", False),
+            patch.object(s, "LLM_CONTEXT_PROBE", False),
+            patch.object(s, "COMPACT_MODE", "legacy"),  # fill every budget, so the ladder is what's tested
+            patch.object(s, "_progress", lambda *_a, **_k: None),
+        ]
+        for p in self._patches: p.start()
+
+    def tearDown(self):
+        for p in reversed(self._patches): p.stop()
+
+
+class TestParseOverflow(unittest.TestCase):
+    def test_lm_studio_message(self):
+        err="Trying to keep the first 5210 tokens when context the overflows. However, the model is loaded with context length of only 4096 tokens"
+        self.assertEqual(s._parse_overflow(err), (4096, 5210))
+
+    def test_openai_style_message(self):
+        err="This model's maximum context length is 8192 tokens. However, you requested 9000 tokens"
+        self.assertEqual(s._parse_overflow(err), (8192, 9000))
+
+    def test_llama_cpp_message(self):
+        err={"code":400, "message":"the request exceeds the available context size, try increasing it", "n_ctx":2048}
+        self.assertEqual(s._parse_overflow(str(err).replace("'n_ctx': ", "n_ctx=")), (2048, None))
+
+    def test_unrecognized_message(self):
+        self.assertEqual(s._parse_overflow("context length exceeded"), (None, None))
+
+
+class TestContextWindow(_ModelStateIsolation):
+    def test_context_from_models_listing_entry(self):
+        self.assertEqual(s._context_from_model_entry({"id":"m", "max_context_length":32768}), 32768)
+        self.assertEqual(s._context_from_model_entry({"id":"m", "meta":{"n_ctx_train":8192}}), 8192)
+        self.assertIsNone(s._context_from_model_entry({"id":"m"}))
+
+    def test_unknown_context_keeps_full_ladder(self):
+        self.assertEqual(s._plan_text_budgets("x"*20000), list(s._TEXT_BUDGETS))
+
+    def test_small_context_skips_budgets_that_cannot_fit(self):
+        s._update_model_state(context_window=2048)
+        budgets=s._plan_text_budgets("invoice total 12/01/2024\n"*1000)
+        self.assertTrue(budgets)
+        self.assertLess(budgets[0], 7000)
+        for b in budgets:
+            prompt=s._prompt_from_text(s._compact_text("invoice total 12/01/2024\n"*1000, b))
+            self.assertTrue(s._fits_context(s._request_tokens(s._SYSTEM_PROMPT, prompt), 350, 2048))
+
+    def test_first_overflow_is_learned_and_next_request_sized(self):
+        text="invoice total 12/01/2024 amount due\n"*1000
+        sizes=[]
+
+        def fake_llm(messages, **_kwargs):
+            n=len(messages[1]["content"])
+            sizes.append(n)
+            if n > 3000:
+                return None, "Trying to keep the first 2500 tokens when context the overflows. However, the model is loaded with context length of only 1024 tokens"
+            return '{"date":"2024-12-01","provider":"Acme","document_type":"Invoice","title":"Acme Invoice"}', None
+
+        with patch.object(s, "_pdftotext", return_value=(text, 0, "")), \
+             patch.object(s, "_call_llm", side_effect=fake_llm):
+            info, _raw=s.extract_information("/tmp/does-not-exist.pdf")
+            self.assertEqual(info["provider"], "Acme")
+            self.assertEqual(len(sizes), 2)
+            self.assertEqual(s._model_state().get("context_window"), 1024)
+
+            sizes.clear()
+            s.extract_information("/tmp/does-not-exist.pdf")
+            self.assertEqual(len(sizes), 1)
+
+
+class TestCalibration(_ModelStateIsolation):
+    def test_chars_per_token_learned_from_usage(self):
+        s._calibrate_from_usage({"prompt_tokens":1016}, prompt_chars=4000)
+        self.assertAlmostEqual(s._model_state()["chars_per_token"], 4.0, places=2)
+        self.assertEqual(s._estimate_tokens("x"*400), 101)
+
+    def test_vision_pages_sized_from_tokens_per_image(self):
+        s._update_model_state(context_window=4096, tokens_per_image=1000)
+        self.assertEqual(s._plan_vision_pages(s._prompt_for_vision(None), 3), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+import unittest
+import os, sys, io, json, tempfile, contextlib
+from unittest.mock import patch
+
+import scanfile_rename as s
+
+
+def _read_jsonl(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(ln) for ln in f if ln.strip()]
+
+
+class TestSpans(unittest.TestCase):
+    def tearDown(self):
+        s._tracing_finish()
+
+    def test_disabled_spans_are_not_recorded(self):
+        s._tracing_start()
+        with patch.object(s, "_record_span") as rec:
+            with s._span("pdftotext") as sp:
+                sp["bytes"]=10
+        rec.assert_not_called()
+
+    def test_nested_spans_written_as_json_lines(self):
+        with tempfile.TemporaryDirectory() as td:
+            path=os.path.join(td, "trace.jsonl")
+            s._tracing_start(trace_file=path)
+            s._TLS.doc="a.pdf"
+            try:
+                with s._span("llm", kind="text", budget=7000) as outer:
+                    with s._span("http", bytes=123) as inner:
+                        inner["outcome"]="ok"
+                    outer["outcome"]="ok"
+                with self.assertRaises(ValueError):
+                    with s._span("render"):
+                        raise ValueError("boom")
+            finally:
+                s._TLS.doc=None
+            s._tracing_finish()
+            recs=_read_jsonl(path)
+        http, llm, render=recs
+        self.assertEqual(http["span"], "http")
+        self.assertEqual(http["parent"], llm["id"])
+        self.assertEqual(http["bytes"], 123)
+        self.assertEqual(http["doc"], "a.pdf")
+        self.assertEqual((llm["kind"], llm["budget"], llm["outcome"]), ("text", 7000, "ok"))
+        self.assertIsNone(llm["parent"])
+        self.assertEqual(render["status"], "error")
+        self.assertIn("ValueError: boom", render["error"])
+
+    def test_metrics_textfile(self):
+        with tempfile.TemporaryDirectory() as td:
+            path=os.path.join(td, "scanfile.prom")
+            s._tracing_start(metrics_file=path)
+            for outcome in ("ok", "overflow"):
+                with s._span("llm") as sp:
+                    sp.update(bytes=100, outcome=outcome)
+            s._tracing_finish(path)
+            with open(path, "r", encoding="utf-8") as f:
+                text=f.read()
+            self.assertEqual(os.listdir(td), ["scanfile.prom"])
+        self.assertIn('scanfile_span_seconds_bucket{span="llm",le="+Inf"} 2', text)
+        self.assertIn('scanfile_span_seconds_count{span="llm"} 2', text)
+        self.assertIn('scanfile_span_bytes_total{span="llm"} 200', text)
+        self.assertIn('scanfile_span_outcomes_total{span="llm",outcome="overflow"} 1', text)
+        self.assertIn("# TYPE scanfile_span_seconds histogram", text)
+
+
+class TestTraceCli(unittest.TestCase):
+    def tearDown(self):
+        s._PROGRESS_ENABLED=True
+
+    def test_dry_run_batch_traces_stages_and_documents(self):
+        with tempfile.TemporaryDirectory() as td:
+            pdfs=[]
+            for name in ("a.pdf", "b.pdf"):
+                p=os.path.join(td, name)
+                with open(p, "wb") as f:
+                    f.write(b"%PDF-1.4\n")
+                pdfs.append(p)
+            trace=os.path.join(td, "trace.jsonl")
+            metrics=os.path.join(td, "m.prom")
+            info={"date":"2024-01-02", "provider":"Acme", "document_type":"Invoice", "title":"Test"}
+
+            def fake_extract(pdf_input, **_kwargs):
+                return (info, "") if pdf_input == pdfs[0] else (None, "")
+
+            buf=io.StringIO()
+            argv=["scanfile_rename.py", *pdfs, "--dry-run", "--no-progress", "--no-cache", "--outdir", os.path.join(td, "out"),
+                  "--trace", trace, "--metrics-file", metrics]
+            with patch.object(sys, "argv", argv), patch.object(s, "CACHE_ENABLED", False), \
+                 patch.object(s, "extract_information", side_effect=fake_extract), contextlib.redirect_stdout(buf):
+                rc=s.main()
+            self.assertEqual(rc, 1)
+            recs=_read_jsonl(trace)
+            with open(metrics, "r", encoding="utf-8") as f:
+                prom=f.read()
+        docs={r["doc"]:r for r in recs if r["span"] == "document"}
+        self.assertEqual(docs[pdfs[0]]["rc"], 0)
+        self.assertEqual(docs[pdfs[1]]["status"], "error")
+        self.assertEqual(sum(1 for r in recs if r["span"] == "stage_extract"), 2)
+        self.assertIn('scanfile_documents_total{result="failed"} 1', prom)
+        self.assertIn('scanfile_documents_total{result="ok"} 1', prom)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,227 @@
+import unittest
+import os, sys, json, stat, base64, tempfile, textwrap
+from unittest.mock import patch
+
+import scanfile_rename as s
+
+
+class TestJpegToDataUrl(unittest.TestCase):
+    def test_matches_reference_base64(self):
+        for n in (0, 1, 2, 3, 100, 3*(1<<14)+5):
+            data=os.urandom(n)
+            expected=b"data:image/jpeg;base64,"+base64.b64encode(data)
+            self.assertEqual(bytes(s._jpeg_to_data_url(data)), expected)
+
+
+class TestJsonBody(unittest.TestCase):
+    def test_streamed_body_matches_json(self):
+        url=s._jpeg_to_data_url(b"\xff\xd8\xff" * 1000)
+        payload={"model":"m", "messages":[{"role":"user", "content":[
+            {"type":"text", "text":"héllo \"q\"\n"},
+            {"type":"image_url", "image_url":{"url":url}},
+        ]}], "temperature":0.0, "max_tokens":10}
+        body=s._JsonBody(payload)
+        chunks=[]
+        while True:
+            b=body.read(777)
+            if not b: break
+            chunks.append(b)
+        raw=b"".join(chunks)
+        self.assertEqual(len(raw), len(body))
+        decoded=json.loads(raw.decode("utf-8"))
+        self.assertEqual(decoded["messages"][0]["content"][1]["image_url"]["url"], url.decode("ascii"))
+        self.assertEqual(decoded["messages"][0]["content"][0]["text"], "héllo \"q\"\n")
+        self.assertEqual(b"".join(s._JsonBody(payload)), raw)
+
+
+class TestRenderPdfToImages(unittest.TestCase):
+    def test_renders_each_page_to_memory(self):
+        with tempfile.TemporaryDirectory() as td:
+            exe=os.path.join(td, "fake_pdftoppm")
+            with open(exe, "w") as f:
+                f.write(textwrap.dedent(f"""\
+                    #!{sys.executable}
+                    import sys
+                    a=sys.argv[1:]
+                    page=int(a[a.index("-f")+1])
+                    if page > 2:
+                        sys.stderr.write("Wrong page range given")
+                        sys.exit(99)
+                    sys.stdout.buffer.write(b"JPEG%d" % page)
+                    """))
+            os.chmod(exe, os.stat(exe).st_mode | stat.S_IEXEC)
+            with patch.object(s, "PDFTOPPM", exe), \
+                 patch.object(s, "_progress", lambda *_a, **_k: None), \
+                 patch.object(s, "_pdf_page_count", return_value=None):
+                imgs=s._render_pdf_to_images("doc.pdf", max_pages=3, dpi=72)
+        self.assertEqual([bytes(u) for u in imgs], [
+            b"data:image/jpeg;base64,"+base64.b64encode(b"JPEG1"),
+            b"data:image/jpeg;base64,"+base64.b64encode(b"JPEG2"),
+        ])
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+
+def _ppm(w, h, ink=None, color=None):
+    # White page; ink=(x0, y0, x1, y1) black box; color=(x0, y0, x1, y1) red box.
+    px=bytearray(b"\xff"*(w*h*3))
+    for box, rgb in ((ink, b"\x00\x00\x00"), (color, b"\xff\x00\x00")):
+        if not box: continue
+        for y in range(box[1], box[3]):
+            for x in range(box[0], box[2]):
+                px[(y*w+x)*3:(y*w+x)*3+3]=rgb
+    return b"P6\n%d %d\n255\n" % (w, h)+bytes(px)
+
+
+class TestBudgetedEncoding(unittest.TestCase):
+    def setUp(self):
+        self.td=tempfile.TemporaryDirectory()
+        self._patches=[patch.object(s, "VISION_MAX_PAGES", 3), patch.object(s, "VISION_REQUEST_BYTES", 1200000),
+                       patch.object(s, "VISION_MAX_EDGE", 1600), patch.object(s, "VISION_JPEG_QUALITY", 75),
+                       patch.object(s, "VISION_MIN_DPI", 72), patch.object(s, "_progress", lambda *_a, **_k: None)]
+        for p in self._patches: p.start()
+
+    def tearDown(self):
+        for p in self._patches: p.stop()
+        self.td.cleanup()
+
+    def _fake_pdftoppm(self, thumb):
+        # Thumbnail requests (no -jpeg) get `thumb`; JPEG renders are logged and sized 30 bytes per dpi^2.
+        thumb_path=os.path.join(self.td.name, "thumb.ppm")
+        with open(thumb_path, "wb") as f:
+            f.write(thumb)
+        log=os.path.join(self.td.name, "calls.log")
+        exe=os.path.join(self.td.name, "fake_pdftoppm")
+        with open(exe, "w") as f:
+            f.write(textwrap.dedent(f"""\
+                #!{sys.executable}
+                import sys, json
+                a=sys.argv[1:]
+                if "-jpeg" not in a:
+                    sys.stdout.buffer.write(open({thumb_path!r}, "rb").read())
+                    sys.exit(0)
+                with open({log!r}, "a") as lf:
+                    lf.write(json.dumps(a)+"\\n")
+                dpi=int(a[a.index("-r")+1])
+                sys.stdout.buffer.write(b"J"*(dpi*dpi*30))
+                """))
+        os.chmod(exe, os.stat(exe).st_mode | stat.S_IEXEC)
+        return exe, log
+
+    def test_page_layout(self):
+        lay=s._page_layout(_ppm(102, 132, ink=(30, 40, 60, 80)))
+        self.assertEqual((lay.w, lay.h, lay.gray, lay.box), (102, 132, True, (28, 38, 62, 82)))
+        self.assertFalse(s._page_layout(_ppm(102, 132, ink=(30, 40, 60, 80), color=(0, 0, 102, 20))).gray)
+        self.assertIsNone(s._page_layout(_ppm(102, 132)).box)  # blank page: nothing to crop to
+        self.assertIsNone(s._page_layout(_ppm(102, 132, ink=(1, 1, 101, 131))).box)  # full-bleed ink: no crop
+        self.assertIsNone(s._page_layout(b"JPEG1"))
+
+    def test_gray_cropped_and_shrunk_to_budget(self):
+        exe, log=self._fake_pdftoppm(_ppm(102, 132, ink=(30, 40, 60, 80)))
+        with patch.object(s, "PDFTOPPM", exe):
+            data, desc=s._encode_page("doc.pdf", 1, 200)
+        with open(log) as f:
+            calls=[json.loads(ln) for ln in f]
+        self.assertEqual(len(calls), 2)  # 200 dpi is 1.2MB, over the 300KB page share: one smaller render
+        last=calls[-1]
+        self.assertEqual(last[last.index("-r")+1], "95")
+        self.assertIn("-gray", last)
+        self.assertEqual([last[last.index(k)+1] for k in ("-x", "-y", "-W", "-H")], ["221", "300", "269", "348"])
+        self.assertIn("quality=75", last)
+        self.assertLessEqual(len(data), 300000)
+        self.assertEqual(desc, f"{len(data)//1024}KB 95dpi q75 gray cropped")
+
+    def test_max_edge_caps_resolution(self):
+        exe, log=self._fake_pdftoppm(_ppm(102, 132, ink=(1, 1, 101, 131), color=(0, 0, 102, 66)))
+        with patch.object(s, "PDFTOPPM", exe), patch.object(s, "VISION_REQUEST_BYTES", 0), patch.object(s, "VISION_MAX_EDGE", 1100):
+            _data, desc=s._encode_page("doc.pdf", 1, 200)
+        with open(log) as f:
+            args=json.loads(f.readline())
+        self.assertEqual(args[args.index("-r")+1], "100")  # 132 thumbnail px at 12 dpi = 11in; 1100px / 11in
+        self.assertNotIn("-gray", args)
+        self.assertNotIn("-x", args)
+        self.assertEqual(desc.split(" ", 1)[1], "100dpi q75")
+
+    def test_plain_mode_is_one_default_render(self):
+        exe, log=self._fake_pdftoppm(_ppm(102, 132, ink=(30, 40, 60, 80)))
+        with patch.object(s, "PDFTOPPM", exe), patch.object(s, "VISION_ENCODE", "plain"):
+            s._render_page_data_url("doc.pdf", 2, 200)
+        with open(log) as f:
+            self.assertEqual([json.loads(ln) for ln in f], [["-f", "2", "-l", "2", "-r", "200", "-jpeg", "doc.pdf"]])
+
+
+class TestVisionDpiLearning(unittest.TestCase):
+    def setUp(self):
+        self._patches=[patch.object(s, "_MODEL_STATE", {}), patch.object(s, "CACHE_ENABLED", False),
+                       patch.object(s, "LLM_CONTEXT_PROBE", False), patch.object(s, "VISION_DPI_LEARN", True),
+                       patch.object(s, "VISION_DPI", 200), patch.object(s, "_progress", lambda *_a, **_k: None),
+                       patch.object(s, "_pdftotext", return_value=("", 0, "")), patch.object(s, "_pdf_page_count", return_value=1)]
+        for p in self._patches: p.start()
+        self.rendered=[]
+
+    def tearDown(self):
+        for p in self._patches: p.stop()
+
+    def _run(self, replies):
+        def fake_render(_pdf, page, dpi):
+            self.rendered.append(dpi)
+            return bytearray(b"img")
+
+        with patch.object(s, "_render_page_data_url", side_effect=fake_render), \
+             patch.object(s, "_call_llm", side_effect=replies) as llm:
+            info, _text=s.extract_information("doc.pdf")
+        return info, llm.call_count
+
+    def test_lowers_dpi_while_fields_match_and_stops_at_first_change(self):
+        a='{"date":"2024-01-02","provider":"Acme","document_type":"Bill","title":"One"}'
+        b='{"date":"2024-01-02","provider":"ACME","document_type":"Bill","title":"Other"}'
+        c='{"date":"2024-01-09","provider":"Acme","document_type":"Bill","title":"One"}'
+        info, calls=self._run([(a, None), (b, None)])
+        self.assertEqual((info["title"], calls), ("One", 2))
+        self.assertEqual(s._model_state()["vision_dpi"], 150)
+        info, calls=self._run([(a, None), (c, None)])
+        self.assertEqual((info["date"], calls), ("2024-01-02", 2))  # the learning request never changes the answer
+        self.assertEqual((s._vision_dpi(), s._model_state()["vision_dpi_floor"]), (150, 120))
+        _info, calls=self._run([(a, None)])
+        self.assertEqual(calls, 1)  # converged
+        self.assertEqual(self.rendered, [200, 150, 150, 120, 150])
+
+
+class TestRenderCache(unittest.TestCase):
+    def test_retries_reuse_rendered_pages(self):
+        calls=[]
+
+        def fake_render(_pdf, page, dpi):
+            calls.append((page, dpi))
+            return bytearray(b"img%d" % page)
+
+        cache={}
+        with patch.object(s, "_render_page_data_url", side_effect=fake_render), \
+             patch.object(s, "_progress", lambda *_a, **_k: None), \
+             patch.object(s, "_pdf_page_count", return_value=5):
+            a=s._render_pdf_to_images("doc.pdf", max_pages=3, dpi=200, cache=cache)
+            b=s._render_pdf_to_images("doc.pdf", max_pages=2, dpi=200, cache=cache)
+            c=s._render_pdf_to_images("doc.pdf", max_pages=1, dpi=200, cache=cache)
+        self.assertEqual(sorted(calls), [(1, 200), (2, 200), (3, 200)])
+        self.assertEqual([bytes(x) for x in a], [b"img1", b"img2", b"img3"])
+        self.assertEqual(b, a[:2])
+        self.assertEqual(c, a[:1])
+
+    def test_vision_retries_render_once(self):
+        calls=[]
+
+        def fake_render(_pdf, page, dpi):
+            calls.append(page)
+            return bytearray(b"img")
+
+        with patch.object(s, "_render_page_data_url", side_effect=fake_render), \
+             patch.object(s, "_progress", lambda *_a, **_k: None), \
+             patch.object(s, "_pdf_page_count", return_value=3), \
+             patch.object(s, "_pdftotext", return_value=("", 0, "")), \
+             patch.object(s, "_call_llm", return_value=(None, "context length exceeded")) as llm:
+            info, _text=s.extract_information("doc.pdf")
+        self.assertIsNone(info)
+        self.assertEqual(llm.call_count, 3)
+        self.assertEqual(sorted(calls), [1, 2, 3])
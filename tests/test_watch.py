@@ -0,0 +1,111 @@
+import unittest
+import os, sys, io, time, tempfile, threading, contextlib, argparse
+from unittest.mock import patch
+
+import scanfile_rename as s
+
+
+def _write(path, data=b"%PDF-1.4\n%%EOF\n"):
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+def _drain(watcher, seconds):
+    got=[]
+    deadline=time.monotonic()+seconds
+    while time.monotonic() < deadline:
+        got+=watcher.ready(timeout=0.05)
+    return got
+
+
+class TestInboxWatcher(unittest.TestCase):
+    def test_polling_waits_for_stable_file_and_reports_once(self):
+        with tempfile.TemporaryDirectory() as td:
+            w=s._InboxWatcher([td], settle=0.3, interval=0.05, use_inotify=False)
+            try:
+                p=_write(os.path.join(td, "scan.pdf"))
+                self.assertEqual(w.ready(timeout=0.05), [])
+                time.sleep(0.15)
+                with open(p, "ab") as f:
+                    f.write(b"more")  # still being written: resets the settle timer
+                self.assertEqual(_drain(w, 0.15), [])
+                self.assertEqual(_drain(w, 0.5), [os.path.abspath(p)])
+                self.assertEqual(_drain(w, 0.4), [])
+            finally:
+                w.close()
+
+    def test_skips_output_dir_and_non_pdfs(self):
+        with tempfile.TemporaryDirectory() as td:
+            os.makedirs(os.path.join(td, "processed"))
+            _write(os.path.join(td, "processed", "done.pdf"))
+            _write(os.path.join(td, "notes.txt"))
+            w=s._InboxWatcher([td], recursive=True, skip_names=["processed"], settle=0, interval=0.05, use_inotify=False)
+            try:
+                self.assertEqual(_drain(w, 0.3), [])
+            finally:
+                w.close()
+
+    def test_open_writer_blocks_processing(self):
+        if not os.path.isdir("/proc/self/fd"):
+            self.skipTest("needs /proc")
+        with tempfile.TemporaryDirectory() as td:
+            p=os.path.join(td, "scan.pdf")
+            w=s._InboxWatcher([td], settle=0.05, interval=0.05, use_inotify=False)
+            try:
+                with open(p, "wb") as f:
+                    f.write(b"%PDF-1.4\n")
+                    f.flush()
+                    self.assertEqual(_drain(w, 0.3), [])
+                self.assertEqual(_drain(w, 0.3), [os.path.abspath(p)])
+            finally:
+                w.close()
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "inotify is Linux-only")
+    def test_inotify_picks_up_new_files(self):
+        with tempfile.TemporaryDirectory() as td:
+            w=s._InboxWatcher([td], settle=0.05, interval=5, use_inotify=True)
+            try:
+                self.assertEqual(w.mode, "inotify")
+                self.assertEqual(w.ready(timeout=0.05), [])
+                p=_write(os.path.join(td, "landed.pdf"))
+                self.assertEqual(_drain(w, 0.5), [os.path.abspath(p)])
+            finally:
+                w.close()
+
+
+class TestRunWatch(unittest.TestCase):
+    def tearDown(self):
+        s._PROGRESS_ENABLED=True
+
+    def test_processes_inbox_and_drains_on_stop(self):
+        with tempfile.TemporaryDirectory() as td:
+            _write(os.path.join(td, "a.pdf"))
+            info={"date":"2024-01-02", "provider":"Acme", "document_type":"Invoice", "title":"Test"}
+            stop=threading.Event()
+            done=[]
+
+            def fake_extract(pdf_input, **_kwargs):
+                done.append(pdf_input)
+                stop.set()  # stop arrives while this document is in flight
+                time.sleep(0.1)
+                return info, ""
+
+            args=argparse.Namespace(outdir=None, move=True, metadata_only=False, dry_run=False, print_json=False,
+                                    keywords_count=5, lm_timeout=5, lm_retries=0, no_repair=True, no_cache=True,
+                                    cache_dir=None, refresh=False, recursive=False, jobs=2, settle=0.05,
+                                    poll_interval=0.05, watch_poll=True, metrics_file=None)
+            buf=io.StringIO()
+            with patch.object(s, "extract_information", side_effect=fake_extract), \
+                 patch.object(s, "write_pdf_metadata_in_place", return_value=(True, None)), \
+                 patch.object(s, "_progress"), contextlib.redirect_stdout(buf):
+                rc=s._run_watch([td], args, stop=stop)
+            self.assertEqual(rc, 0)
+            self.assertEqual(len(done), 1)
+            self.assertFalse(os.path.exists(os.path.join(td, "a.pdf")))
+            self.assertEqual(os.listdir(os.path.join(td, "processed")), ["2024-01-02 - Acme - Invoice - Test.pdf"])
+            self.assertIn("Stopped: 1 ok, 0 failed", buf.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()